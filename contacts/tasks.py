@@ -1,6 +1,5 @@
 from urllib.parse import urljoin
 
-import requests
 from celery import shared_task
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
@@ -9,29 +8,33 @@ from django.utils import timezone
 from requests.exceptions import RequestException
 
 from contacts.models import Case
+from healthcheck import http
+from healthcheck.ratelimit import RateLimitExceeded
 
 logger = get_task_logger(__name__)
 
 
 @shared_task(
-    autoretry_for=(RequestException, SoftTimeLimitExceeded),
+    autoretry_for=(RequestException, RateLimitExceeded, SoftTimeLimitExceeded),
     max_retires=3,
     retry_backoff=True,
-    soft_time_limit=15,
+    soft_time_limit=25,
     time_limit=45,
     acks_late=True,
-    # this will ensure turn.io rate limiter does not return 429
-    rate_limit="60/m",
 )
 def send_contact_update(phone_number, confirmed_contact, case_id):
-    # request should not take longer than 15 seconds total
-    connect_timeout, read_timeout = 5.0, 10.0
+    # waiting for the rate limit and the request should not take longer than 20
+    # seconds total, which leaves time before the soft time limit
+    max_wait, connect_timeout, read_timeout = 5.0, 5.0, 10.0
 
     phone_number = phone_number.lstrip("+")
 
-    response = requests.patch(
+    response = http.request(
+        "turn",
+        "patch",
         url=urljoin(settings.API_DOMAIN, f"/v1/contacts/{phone_number}/profile"),
         json={"confirmed_contact": confirmed_contact},
+        max_wait=max_wait,
         timeout=(connect_timeout, read_timeout),
         headers={
             "Authorization": f"Bearer {settings.TURN_API_KEY}",
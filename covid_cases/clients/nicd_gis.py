@@ -1,11 +1,11 @@
 from functools import lru_cache
 
-import requests
+from healthcheck.http import Session
 
 
 class NICDGISClient:
     def __init__(self):
-        self.session = requests.Session()
+        self.session = Session("nicd")
 
     @lru_cache()
     def get_ward_cases_data(self) -> dict:
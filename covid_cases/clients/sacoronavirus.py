@@ -3,9 +3,10 @@ from dataclasses import dataclass
 from datetime import date, datetime
 from typing import Iterator
 
-import requests
 from bs4 import BeautifulSoup
 
+from healthcheck.http import Session
+
 
 @dataclass
 class Counters:
@@ -24,7 +25,7 @@ class CaseImage:
 
 class SACoronavirusClient:
     def __init__(self):
-        self.session = requests.Session()
+        self.session = Session("sacoronavirus")
 
     def get_homepage(self) -> str:
         with self.session as session:
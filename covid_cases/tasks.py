@@ -1,6 +1,5 @@
 from datetime import date
 
-import requests
 from celery.exceptions import SoftTimeLimitExceeded
 from django.conf import settings
 from django.core.cache import cache
@@ -16,6 +15,7 @@ from covid_cases.models import (
     WardCase,
 )
 from covid_cases.utils import get_filename_from_url, normalise_text
+from healthcheck import http
 from healthcheck.celery import app
 
 
@@ -145,8 +145,13 @@ def scrape_sacoronavirus_case_images():
             continue
         except SACoronavirusCaseImage.DoesNotExist:
             pass
-        image_data = requests.get(
-            image.url, headers={"User-Agent": "contactndoh-whatsapp"}, timeout=30
+        image_data = http.request(
+            "sacoronavirus",
+            "get",
+            image.url,
+            endpoint="case_image",
+            headers={"User-Agent": "contactndoh-whatsapp"},
+            timeout=30,
         )
         image_data.raise_for_status()
         file = ContentFile(
@@ -1,12 +1,27 @@
 from __future__ import absolute_import
 
 import os
+import time
 
+import prometheus_client
 import sentry_sdk
 from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_retry,
+    worker_init,
+    worker_process_shutdown,
+)
 from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from prometheus_client import multiprocess
 from sentry_sdk.integrations.celery import CeleryIntegration
 
+from healthcheck import metrics
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "healthcheck.settings.base")
 
 app = Celery(__name__)
@@ -17,3 +32,72 @@ app.autodiscover_tasks()
 # only connect to sentry if dsn is supplied
 if settings.SENTRY_DSN:
     sentry_sdk.init(dsn=settings.SENTRY_DSN, integrations=[CeleryIntegration()])
+
+
+# The start times of the tasks that are running in this process, by task id
+task_start_times = {}
+
+
+@before_task_publish.connect
+def record_task_published(headers=None, **kwargs):
+    headers["published_at"] = time.time()
+
+
+@task_prerun.connect
+def record_task_started(task_id=None, task=None, **kwargs):
+    task_start_times[task_id] = time.monotonic()
+
+    # Tasks that are run eagerly aren't published
+    published_at = getattr(task.request, "published_at", None)
+    if published_at is None:
+        return
+    # Don't count the time that a task was waiting for its ETA, eg. between retries
+    eta = task.request.eta
+    if eta:
+        eta = parse_datetime(eta) if isinstance(eta, str) else eta
+        published_at = max(published_at, eta.timestamp())
+    metrics.CELERY_TASK_QUEUE_WAIT.labels(task=task.name).observe(
+        max(time.time() - published_at, 0)
+    )
+
+
+@task_postrun.connect
+def record_task_finished(task_id=None, task=None, state=None, **kwargs):
+    start = task_start_times.pop(task_id, None)
+    if start is not None:
+        metrics.CELERY_TASK_RUNTIME.labels(task=task.name, state=state).observe(
+            time.monotonic() - start
+        )
+
+
+@task_retry.connect
+def record_task_retry(sender=None, **kwargs):
+    metrics.CELERY_TASK_RETRIES.labels(task=sender.name).inc()
+
+
+@task_failure.connect
+def record_task_failure(sender=None, **kwargs):
+    metrics.CELERY_TASK_FAILURES.labels(task=sender.name).inc()
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """
+    Serves the metrics of the worker on WORKER_METRICS_PORT. With the prefork
+    pool, the tasks run in child processes, so prometheus_multiproc_dir must be set
+    for their metrics to be collected here.
+    """
+    if not settings.WORKER_METRICS_PORT:
+        return
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    prometheus_client.start_http_server(settings.WORKER_METRICS_PORT, registry=registry)
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    if "prometheus_multiproc_dir" in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,242 @@
+import functools
+import json
+import re
+import time
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from temba_client import v2
+from temba_client.clients import MAX_RETRIES
+from temba_client.exceptions import (
+    TembaBadRequestError,
+    TembaConnectionError,
+    TembaHttpError,
+    TembaNoSuchObjectError,
+    TembaRateExceededError,
+    TembaTokenError,
+)
+from urllib3.util.retry import Retry
+
+from healthcheck import metrics
+from healthcheck.ratelimit import get_rate_limit
+
+# Path segments that are phone numbers, database ids or UUIDs
+ID_PATTERN = re.compile(
+    r"/(\+?\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?=/|$)",
+    re.IGNORECASE,
+)
+
+
+def get_endpoint(url):
+    """
+    Returns the path of the URL with the ids replaced, so that there's a single
+    endpoint label for eg. every contact
+    """
+    return ID_PATTERN.sub("/{id}", urlparse(url).path) or "/"
+
+
+def get_error_type(exception):
+    if isinstance(exception, requests.Timeout):
+        return "timeout"
+    if isinstance(exception, requests.ConnectionError):
+        return "connection"
+    return type(exception).__name__
+
+
+def get_body_size(body):
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    # Streamed uploads, we don't know their size without consuming them
+    return 0
+
+
+def get_retry_after(response):
+    try:
+        return int(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class Session(requests.Session):
+    """
+    A requests Session that records the latency, status code, errors and bytes
+    transferred of its requests, labelled with the integration and endpoint.
+
+    The endpoint defaults to the path of the URL, but should be given for URLs
+    that aren't known in advance, eg. links that are returned by the integration.
+
+    If there's a rate limit for the integration in RATE_LIMITS, requests wait for
+    it, for up to max_wait seconds, and a Retry-After in a 429 response pauses it.
+    Requests that are made while a user is waiting should use a max_wait of 0, and
+    handle RateLimitExceeded.
+    """
+
+    def __init__(self, integration, max_wait=None):
+        super().__init__()
+        self.integration = integration
+        self.rate_limit = get_rate_limit(integration)
+        self.max_wait = max_wait
+
+    def request(self, method, url, *args, endpoint=None, **kwargs):
+        method = method.upper()
+        labels = {
+            "integration": self.integration,
+            "endpoint": endpoint or get_endpoint(url),
+            "method": method,
+        }
+        if self.rate_limit:
+            self.rate_limit.acquire(max_wait=self.max_wait)
+        start = time.monotonic()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException as e:
+            metrics.HTTP_CLIENT_ERRORS.labels(error=get_error_type(e), **labels).inc()
+            raise
+        finally:
+            metrics.HTTP_CLIENT_DURATION.labels(**labels).observe(
+                time.monotonic() - start
+            )
+
+        metrics.HTTP_CLIENT_RESPONSES.labels(
+            status=response.status_code, **labels
+        ).inc()
+        metrics.HTTP_CLIENT_SENT_BYTES.labels(**labels).inc(
+            get_body_size(response.request.body)
+        )
+        if kwargs.get("stream"):
+            received = int(response.headers.get("Content-Length", 0))
+        else:
+            received = len(response.content)
+        metrics.HTTP_CLIENT_RECEIVED_BYTES.labels(**labels).inc(received)
+
+        retry_after = get_retry_after(response)
+        if self.rate_limit and response.status_code == 429 and retry_after:
+            self.rate_limit.pause(retry_after)
+        return response
+
+
+def request(integration, method, url, max_wait=None, **kwargs):
+    """
+    The same as requests.request, but instrumented as the given integration
+    """
+    with Session(integration, max_wait=max_wait) as session:
+        return session.request(method, url, **kwargs)
+
+
+class TembaClient(v2.TembaClient):
+    """
+    A RapidPro client that sends its requests with an instrumented Session, as the
+    rapidpro integration.
+
+    The base client doesn't accept a session, so this mirrors its _request.
+
+    Idempotent requests that fail with a 5xx are retried up to `retries` times
+    with back-off, and rate limited requests are retried if the Retry-After is
+    at most `max_retry_after` seconds. Requests wait for the rapidpro rate limit
+    for up to `max_wait` seconds, see Session.
+    """
+
+    def __init__(
+        self,
+        host,
+        token,
+        user_agent=None,
+        verify_ssl=None,
+        timeout=None,
+        retries=0,
+        max_retry_after=0,
+        pool_size=10,
+        max_wait=None,
+    ):
+        super().__init__(host, token, user_agent=user_agent, verify_ssl=verify_ssl)
+        self.timeout = timeout
+        self.max_retry_after = max_retry_after
+        self.session = Session("rapidpro", max_wait=max_wait)
+        adapter = HTTPAdapter(
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method, url, params=None, body=None, retry_on_rate_exceed=False):
+        retries = 0
+        while True:
+            try:
+                return self._send(method, url, params=params, body=body)
+            except TembaRateExceededError as e:
+                retries += 1
+                wait = e.retry_after
+                retry = retry_on_rate_exceed or wait <= self.max_retry_after
+                if wait and retry and retries < MAX_RETRIES:
+                    time.sleep(wait)
+                else:
+                    raise
+
+    def _send(self, method, url, params=None, body=None):
+        try:
+            response = self.session.request(
+                method,
+                url,
+                headers=self.headers,
+                data=json.dumps(body) if body else None,
+                params=params or None,
+                verify=self.verify_ssl,
+                timeout=self.timeout,
+            )
+        except requests.ConnectionError:
+            raise TembaConnectionError()
+
+        if response.status_code == 400:
+            try:
+                errors = response.json()
+            except ValueError:
+                errors = {"details": [response.content]}
+            raise TembaBadRequestError(errors)
+        elif response.status_code == 403:
+            raise TembaTokenError()
+        elif response.status_code == 404:
+            raise TembaNoSuchObjectError()
+        elif response.status_code == 429:
+            retry_after = response.headers.get("retry-after")
+            raise TembaRateExceededError(int(retry_after) if retry_after else 0)
+
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            raise TembaHttpError(e)
+        return response.json() if response.content else None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rapidpro_client(url, token, max_wait):
+    return TembaClient(
+        url,
+        token,
+        timeout=settings.RAPIDPRO_TIMEOUT,
+        retries=settings.RAPIDPRO_RETRIES,
+        max_retry_after=settings.RAPIDPRO_MAX_RETRY_AFTER,
+        pool_size=settings.RAPIDPRO_POOL_SIZE,
+        max_wait=max_wait,
+    )
+
+
+def get_rapidpro_client(token=None, max_wait=None):
+    """
+    Returns the shared RapidPro client for the token, which defaults to
+    RAPIDPRO_TOKEN. The client is built when it's first used, and keeps its
+    connections open between requests.
+
+    Views should use a max_wait of 0, so that they don't wait for the rate limit,
+    and handle RateLimitExceeded.
+    """
+    return _get_rapidpro_client(
+        settings.RAPIDPRO_URL, token or settings.RAPIDPRO_TOKEN, max_wait
+    )
@@ -0,0 +1,139 @@
+import functools
+import inspect
+import logging
+import threading
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import LockError, RedisError
+
+from healthcheck import metrics
+
+logger = logging.getLogger(__name__)
+
+# The lease of the singleton task that's running in this thread
+_current = threading.local()
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Lease:
+    """
+    A redis lock that is renewed by a heartbeat thread for as long as it's held. A
+    worker that dies only holds the lease for `ttl` seconds, instead of for the
+    longest time that the work could take.
+
+    The metrics are labelled with the name, which defaults to the key. Keys that
+    contain arguments, eg. timestamps, should have a name without them, so that
+    there's a fixed number of metrics.
+    """
+
+    def __init__(self, key, ttl=None, name=None):
+        self.key = key
+        self.name = name or key
+        self.ttl = ttl or settings.TASK_LEASE_TTL
+        # The token needs to be shared with the heartbeat thread
+        self.lock = get_redis_connection().lock(
+            key, timeout=self.ttl, thread_local=False
+        )
+        self.lost = False
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+
+    def acquire(self):
+        """
+        Returns whether the lease was acquired, without waiting for it
+        """
+        if not self.lock.acquire(blocking=False):
+            metrics.LEASE_SKIPS.labels(lease=self.name).inc()
+            return False
+
+        metrics.LEASE_ACQUIRED.labels(lease=self.name).inc()
+        self._heartbeat.start()
+        return True
+
+    def _renew(self):
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                self.lock.reacquire()
+            except LockError:
+                self._lose()
+                return
+            except RedisError:
+                # Try again on the next heartbeat, the lease is still valid until
+                # it expires
+                logger.exception(f"Failed to renew the lease {self.key}")
+
+    def _lose(self):
+        self.lost = True
+        metrics.LEASE_LOST.labels(lease=self.name).inc()
+        logger.warning(f"Lost the lease {self.key} before the work finished")
+
+    def check(self):
+        """
+        Raises LeaseLost if the lease was lost, so that the work can stop before
+        another worker starts it again
+        """
+        if self.lost:
+            raise LeaseLost(self.key)
+
+    def release(self):
+        self._stopped.set()
+        self._heartbeat.join()
+        try:
+            self.lock.release()
+        except LockError:
+            # The lease expired, and could already be held by another worker
+            if not self.lost:
+                self._lose()
+
+
+def singleton_task(key, ttl=None, name=None):
+    """
+    Makes sure that only one instance of the decorated function runs at a time, by
+    taking a Lease while it runs. If the lease is already held, the function is
+    skipped and returns None.
+
+    key can refer to the function's arguments, eg. "sync_{dataset}.{table}". The
+    metrics are labelled with name, which can also refer to the arguments, and
+    defaults to the unformatted key. It shouldn't refer to arguments with many
+    values, eg. timestamps, so that there's a fixed number of metrics.
+
+    Long running functions should call check_lease between batches, which stops
+    the function if the lease was lost. The function then returns None.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            label = name.format(**arguments) if name else key
+            lease = Lease(key.format(**arguments), ttl, name=label)
+            if not lease.acquire():
+                return
+            outer, _current.lease = getattr(_current, "lease", None), lease
+            try:
+                return func(*args, **kwargs)
+            except LeaseLost:
+                logger.warning(f"Stopped {lease.key} because the lease was lost")
+            finally:
+                _current.lease = outer
+                lease.release()
+
+        return wrapper
+
+    return decorator
+
+
+def check_lease():
+    """
+    Raises LeaseLost if the lease of the singleton task that's running in this
+    thread was lost. Does nothing outside of a singleton task.
+    """
+    lease = getattr(_current, "lease", None)
+    if lease:
+        lease.check()
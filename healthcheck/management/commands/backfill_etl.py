@@ -0,0 +1,72 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django_redis import get_redis_connection
+
+from healthcheck.pipelines import get_etl_pipelines
+from healthcheck.tasks import backfill_model_in_parallel
+from healthcheck.utils import get_etl_backfill_key
+
+
+def date(value):
+    parsed = parse_date(value)
+    if not parsed:
+        raise ValueError(f"Invalid date {value}")
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-exports a table of an ETL pipeline for a time range, split into windows "
+        "that are exported in parallel by the celery workers. Finished windows are "
+        "checkpointed, so running this again only exports the windows that failed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pipeline", choices=get_etl_pipelines().keys())
+        parser.add_argument("table")
+        parser.add_argument("--start", type=date, required=True, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--end",
+            type=date,
+            default=None,
+            help="YYYY-MM-DD, not included. Defaults to tomorrow.",
+        )
+        parser.add_argument("--window-days", type=int, default=7)
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Clear the checkpoints, and export every window again",
+        )
+
+    def handle(self, *args, **options):
+        key_path, dataset, models = get_etl_pipelines()[options["pipeline"]]
+        table = options["table"]
+        if table not in models:
+            raise CommandError(
+                f"Unknown table {table}, must be one of {', '.join(models)}"
+            )
+
+        if options["reset"]:
+            get_redis_connection().delete(get_etl_backfill_key(dataset, table))
+
+        end = options["end"] or timezone.localdate() + datetime.timedelta(days=1)
+        start = timezone.make_aware(
+            datetime.datetime.combine(options["start"], datetime.time())
+        )
+        end = timezone.make_aware(datetime.datetime.combine(end, datetime.time()))
+        if start >= end:
+            raise CommandError("The start must be before the end")
+
+        windows = backfill_model_in_parallel(
+            key_path,
+            dataset,
+            table,
+            models[table],
+            start,
+            end,
+            datetime.timedelta(days=options["window_days"]),
+        )
+        self.stdout.write(f"Started backfilling {dataset}.{table} in {windows} windows")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from healthcheck.utils import backfill_hashed_fields
+from lifenet.models import LNCheck
+from selfswab.models import SelfSwabRegistration, SelfSwabScreen, SelfSwabTest
+from tbconnect.models import TBCheck, TBTest
+
+MODELS = {
+    TBCheck: {"hashed_msisdn": "msisdn"},
+    TBTest: {"hashed_msisdn": "msisdn"},
+    LNCheck: {"hashed_msisdn": "msisdn"},
+    SelfSwabRegistration: {
+        "hashed_msisdn": "msisdn",
+        "hashed_employee_number": "employee_number",
+    },
+    SelfSwabScreen: {
+        "hashed_msisdn": "msisdn",
+        "hashed_employee_number": "employee_number",
+    },
+    SelfSwabTest: {"hashed_msisdn": "msisdn"},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills in the hashed MSISDN columns for rows created before they existed. "
+        "The migrations do this, so it's only needed for rows that were created by "
+        "code from before the migrations while they were running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model, fields in MODELS.items():
+            total = backfill_hashed_fields(model, fields, options["batch_size"])
+            self.stdout.write(f"Updated {total} {model._meta.verbose_name_plural}")
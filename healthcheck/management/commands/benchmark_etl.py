@@ -0,0 +1,125 @@
+import json
+import resource
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from healthcheck.pipelines import get_etl_pipelines
+from healthcheck.utils import LocalSink, Sink, sync_models_to_bigquery
+
+
+def get_peak_rss_mb():
+    """
+    The peak resident set size of this process and of any transform processes
+    that have finished, in MB. ru_maxrss is in KB on Linux.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss += resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the ETL pipelines against a local sink in a temporary directory, and "
+        "reports the throughput, peak memory, and time spent in each stage. Use "
+        "generate_etl_data to create rows to export."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pipeline",
+            action="append",
+            dest="pipelines",
+            choices=get_etl_pipelines().keys(),
+            help="Pipeline to run. Can be given multiple times. Defaults to all.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Overrides ETL_BATCH_SIZE for all of the tables",
+        )
+        parser.add_argument(
+            "--output", default=None, help="Also write the results as JSON to this file"
+        )
+
+    def handle(self, *args, **options):
+        results = {
+            "source_format": settings.ETL_SOURCE_FORMAT,
+            "transform_processes": settings.ETL_TRANSFORM_PROCESSES,
+            "pipelines": {},
+        }
+        self.stdout.write(
+            f"Source format: {settings.ETL_SOURCE_FORMAT}, transform processes: "
+            f"{settings.ETL_TRANSFORM_PROCESSES}"
+        )
+
+        pipelines = get_etl_pipelines()
+        for pipeline in options["pipelines"] or pipelines.keys():
+            _, _, models = pipelines[pipeline]
+            # Export changes from the change log straight away, rather than waiting
+            # for them to be ETL_CHANGELOG_LAG seconds old
+            models = {
+                table: {**details, "changelog_lag": 0}
+                for table, details in models.items()
+            }
+            if options["batch_size"]:
+                for details in models.values():
+                    details["batch_size"] = options["batch_size"]
+
+            # A fresh directory, so that there are no watermarks and everything is
+            # exported
+            with tempfile.TemporaryDirectory() as path:
+                sink = LocalSink(path, pipeline)
+                start = time.monotonic()
+                stats = sync_models_to_bigquery(None, pipeline, models, sink=sink)
+                seconds = time.monotonic() - start
+
+            result = self.get_result(stats, seconds)
+            results["pipelines"][pipeline] = result
+            self.write_result(pipeline, result)
+
+        if options["output"]:
+            try:
+                with open(options["output"], "w") as f:
+                    json.dump(results, f, indent=2)
+            except OSError as e:
+                raise CommandError(f"Cannot write results: {e}")
+
+    def get_result(self, stats, seconds):
+        tables = {}
+        for table, table_stats in stats.items():
+            table_seconds = sum(
+                table_stats[f"{stage}_seconds"] for stage in Sink.STAGES
+            )
+            tables[table] = {
+                **table_stats,
+                "rows_per_second": (
+                    table_stats["rows"] / table_seconds if table_seconds else 0
+                ),
+            }
+        rows = sum(table["rows"] for table in tables.values())
+        return {
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds else 0,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "tables": tables,
+        }
+
+    def write_result(self, pipeline, result):
+        self.stdout.write(
+            f"{pipeline}: {result['rows']} rows in {result['seconds']:.2f}s "
+            f"({result['rows_per_second']:.0f} rows/s), "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+        for table, stats in result["tables"].items():
+            stages = ", ".join(
+                f"{stage} {stats[f'{stage}_seconds']:.2f}s" for stage in Sink.STAGES
+            )
+            self.stdout.write(
+                f"  {table}: {stats['rows']} rows in {stats['batches']} batches "
+                f"({stats['rows_per_second']:.0f} rows/s); {stages}"
+            )
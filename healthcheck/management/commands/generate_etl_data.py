@@ -0,0 +1,232 @@
+import datetime
+import random
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from healthcheck.models import (
+    ChangeLog,
+    ChangeLogMixin,
+    EventIndex,
+    EventIndexMixin,
+)
+from healthcheck.utils import extract_lat_long, get_batches, hash_string
+from lifenet.models import LNCheck
+from selfswab.models import SelfSwabRegistration, SelfSwabScreen, SelfSwabTest
+from tbconnect.models import TBCheck, TBTest
+
+# Mobile prefixes in use in South Africa, to give the MSISDNs a realistic spread
+MSISDN_PREFIXES = ["6", "71", "72", "73", "74", "76", "78", "79", "81", "82", "83"]
+
+
+def get_msisdn(rand):
+    prefix = rand.choice(MSISDN_PREFIXES)
+    suffix = "".join(rand.choice("0123456789") for _ in range(9 - len(prefix)))
+    return f"+27{prefix}{suffix}"
+
+
+def get_location(rand):
+    """
+    An ISO 6709 location somewhere inside the bounding box of South Africa
+    """
+    return "{:+08.4f}{:+09.4f}/".format(
+        rand.uniform(-34.8, -22.1), rand.uniform(16.5, 32.9)
+    )
+
+
+def get_timestamp(rand, days):
+    return timezone.now() - datetime.timedelta(seconds=rand.randint(0, days * 86400))
+
+
+def generate_tbcheck(rand, days):
+    msisdn = get_msisdn(rand)
+    location = get_location(rand)
+    city_location = get_location(rand)
+    location_latitude, location_longitude = extract_lat_long(location)
+    city_latitude, city_longitude = extract_lat_long(city_location)
+    timestamp = get_timestamp(rand, days)
+    return TBCheck(
+        msisdn=msisdn,
+        hashed_msisdn=hash_string(msisdn),
+        source="WhatsApp",
+        province=rand.choice(TBCheck.PROVINCE_CHOICES)[0],
+        city="Cape Town",
+        age=rand.choice(TBCheck.AGE_CHOICES)[0],
+        gender=rand.choice(TBCheck.GENDER_CHOICES)[0],
+        location=location,
+        city_location=city_location,
+        location_latitude=location_latitude,
+        location_longitude=location_longitude,
+        city_latitude=city_latitude,
+        city_longitude=city_longitude,
+        cough=rand.random() < 0.3,
+        fever=rand.random() < 0.2,
+        sweat=rand.random() < 0.2,
+        weight=rand.random() < 0.1,
+        exposure=rand.choice(TBCheck.EXPOSURE_CHOICES)[0],
+        tracing=rand.random() < 0.8,
+        completed_timestamp=timestamp,
+        timestamp=timestamp,
+        risk=rand.choice(TBCheck.RISK_CHOICES)[0],
+        follow_up_optin=rand.random() < 0.5,
+        language=rand.choice(TBCheck.LANGUAGE_CHOICES)[0],
+        commit_get_tested=rand.choice(TBCheck.COMMIT_CHOICES)[0],
+        research_consent=rand.random() < 0.5,
+    )
+
+
+def generate_tbtest(rand, days):
+    msisdn = get_msisdn(rand)
+    return TBTest(
+        msisdn=msisdn,
+        hashed_msisdn=hash_string(msisdn),
+        source="WhatsApp",
+        result=rand.choice(TBTest.RESULT_CHOICES)[0],
+        timestamp=get_timestamp(rand, days),
+    )
+
+
+def generate_lncheck(rand, days):
+    msisdn = get_msisdn(rand)
+    timestamp = get_timestamp(rand, days)
+    return LNCheck(
+        msisdn=msisdn,
+        hashed_msisdn=hash_string(msisdn),
+        source="WhatsApp",
+        age=rand.choice(LNCheck.Age.values),
+        cough=rand.random() < 0.3,
+        fever=rand.random() < 0.2,
+        sore_throat=rand.random() < 0.2,
+        difficulty_breathing=rand.random() < 0.1,
+        muscle_pain=rand.random() < 0.2,
+        smell=rand.random() < 0.1,
+        exposure=rand.choice(LNCheck.Exposure.values),
+        tracing=rand.random() < 0.8,
+        completed_timestamp=timestamp,
+        timestamp=timestamp,
+        risk=rand.choice(LNCheck.Risk.values),
+        follow_up_optin=rand.random() < 0.5,
+        language=rand.choice(LNCheck.Language.values),
+    )
+
+
+def generate_selfswab_registration(rand, days):
+    msisdn = get_msisdn(rand)
+    employee_number = str(rand.randint(10000, 99999))
+    return SelfSwabRegistration(
+        created_by="WhatsApp",
+        employee_number=employee_number,
+        hashed_employee_number=hash_string(employee_number),
+        contact_id=str(uuid.UUID(int=rand.getrandbits(128))),
+        msisdn=msisdn,
+        hashed_msisdn=hash_string(msisdn),
+        first_name="Test",
+        last_name="User",
+        facility="Groote Schuur",
+        occupation="Nurse",
+        age=rand.choice(SelfSwabRegistration.Age.values),
+        gender=rand.choice(SelfSwabRegistration.Gender.values),
+        timestamp=get_timestamp(rand, days),
+    )
+
+
+def generate_selfswab_screen(rand, days):
+    msisdn = get_msisdn(rand)
+    employee_number = str(rand.randint(10000, 99999))
+    return SelfSwabScreen(
+        contact_id=str(uuid.UUID(int=rand.getrandbits(128))),
+        msisdn=msisdn,
+        hashed_msisdn=hash_string(msisdn),
+        age=rand.choice(SelfSwabScreen.Age.values),
+        gender=rand.choice(SelfSwabScreen.Gender.values),
+        facility="Groote Schuur",
+        risk_type=rand.choice(SelfSwabScreen.RISK_TYPES)[0],
+        occupation="Nurse",
+        employee_number=employee_number,
+        hashed_employee_number=hash_string(employee_number),
+        cough=rand.random() < 0.3,
+        fever=rand.random() < 0.2,
+        shortness_of_breath=rand.random() < 0.1,
+        body_aches=rand.random() < 0.2,
+        loss_of_taste_smell=rand.random() < 0.1,
+        sore_throat=rand.random() < 0.2,
+        additional_symptoms=rand.random() < 0.1,
+        timestamp=get_timestamp(rand, days),
+    )
+
+
+def generate_selfswab_test(rand, days):
+    msisdn = get_msisdn(rand)
+    return SelfSwabTest(
+        contact_id=str(uuid.UUID(int=rand.getrandbits(128))),
+        msisdn=msisdn,
+        hashed_msisdn=hash_string(msisdn),
+        result=rand.choice(SelfSwabTest.Result.values),
+        # Barcodes are unique, so use a random UUID rather than a random number
+        barcode=f"CP{uuid.UUID(int=rand.getrandbits(128)).hex}",
+        timestamp=get_timestamp(rand, days),
+    )
+
+
+# bulk_create doesn't call save, so the generators fill in the hashed and decoded
+# fields that save would usually set, and the change log is written separately
+GENERATORS = {
+    TBCheck: generate_tbcheck,
+    TBTest: generate_tbtest,
+    LNCheck: generate_lncheck,
+    SelfSwabRegistration: generate_selfswab_registration,
+    SelfSwabScreen: generate_selfswab_screen,
+    SelfSwabTest: generate_selfswab_test,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates synthetic rows for the models that are exported by the ETL, for "
+        "benchmarking. Don't run this against a production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count", type=int, default=10000, help="Rows to create for each model"
+        )
+        parser.add_argument(
+            "--model",
+            action="append",
+            dest="models",
+            help="Model label to generate rows for, eg. tbconnect.TBCheck. Can be "
+            "given multiple times. Defaults to all of the ETL models.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="Spread the timestamps over this many days before now",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        models = {model._meta.label: model for model in GENERATORS}
+        labels = options["models"] or list(models.keys())
+        for label in labels:
+            if label not in models:
+                raise CommandError(
+                    f"Unknown model {label}, must be one of {', '.join(models)}"
+                )
+
+        rand = random.Random(options["seed"])
+        for label in labels:
+            model = models[label]
+            records = (
+                GENERATORS[model](rand, options["days"])
+                for _ in range(options["count"])
+            )
+            for batch in get_batches(records, options["batch_size"]):
+                created = model.objects.bulk_create(batch)
+                if issubclass(model, ChangeLogMixin):
+                    ChangeLog.objects.log_changes(created)
+                if issubclass(model, EventIndexMixin):
+                    EventIndex.objects.record(created)
+            self.stdout.write(f"Created {options['count']} {label} rows")
@@ -0,0 +1,102 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+ETL_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+ETL_ROWS = Counter(
+    "etl_rows_exported", "Rows exported by the ETL", ["dataset", "table"]
+)
+ETL_BYTES = Counter(
+    "etl_bytes_uploaded", "Bytes uploaded by the ETL", ["dataset", "table"]
+)
+ETL_LOAD_DURATION = Histogram(
+    "etl_load_duration_seconds",
+    "Time taken to serialize and load each ETL batch",
+    ["dataset", "table"],
+    buckets=ETL_BUCKETS,
+)
+ETL_TRANSFORM_DURATION = Histogram(
+    "etl_transform_duration_seconds",
+    "Time taken to transform each ETL batch",
+    ["dataset", "table"],
+    buckets=ETL_BUCKETS,
+)
+ETL_WATERMARK_AGE = Gauge(
+    "etl_watermark_age_seconds",
+    "Age of the last row or change exported by the ETL",
+    ["dataset", "table"],
+    multiprocess_mode="liveall",
+)
+
+LEASE_ACQUIRED = Counter(
+    "lease_acquired", "Times that a task lease was acquired", ["lease"]
+)
+LEASE_SKIPS = Counter(
+    "lease_skips", "Task runs skipped because the lease was already held", ["lease"]
+)
+LEASE_LOST = Counter(
+    "lease_lost", "Leases that expired before the task finished", ["lease"]
+)
+
+CELERY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, float("inf"))
+
+CELERY_TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds",
+    "Time between a task being published, or its ETA, and it starting",
+    ["task"],
+    buckets=CELERY_BUCKETS,
+)
+CELERY_TASK_RUNTIME = Histogram(
+    "celery_task_runtime_seconds",
+    "Time taken to run a task",
+    ["task", "state"],
+    buckets=CELERY_BUCKETS,
+)
+CELERY_TASK_RETRIES = Counter("celery_task_retries", "Task retries", ["task"])
+CELERY_TASK_FAILURES = Counter("celery_task_failures", "Task failures", ["task"])
+
+HTTP_CLIENT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+HTTP_CLIENT_DURATION = Histogram(
+    "http_client_request_duration_seconds",
+    "Time taken by outbound HTTP requests, including reading the response",
+    ["integration", "endpoint", "method"],
+    buckets=HTTP_CLIENT_BUCKETS,
+)
+HTTP_CLIENT_RESPONSES = Counter(
+    "http_client_responses",
+    "Responses to outbound HTTP requests",
+    ["integration", "endpoint", "method", "status"],
+)
+HTTP_CLIENT_ERRORS = Counter(
+    "http_client_errors",
+    "Outbound HTTP requests that failed without a response, eg. timeouts",
+    ["integration", "endpoint", "method", "error"],
+)
+HTTP_CLIENT_SENT_BYTES = Counter(
+    "http_client_sent_bytes",
+    "Bytes sent in the bodies of outbound HTTP requests",
+    ["integration", "endpoint", "method"],
+)
+HTTP_CLIENT_RECEIVED_BYTES = Counter(
+    "http_client_received_bytes",
+    "Bytes received in the bodies of outbound HTTP responses",
+    ["integration", "endpoint", "method"],
+)
+
+RATE_LIMIT_TOKENS = Gauge(
+    "rate_limit_tokens",
+    "Tokens left in the rate limit bucket after the last request",
+    ["limit"],
+    multiprocess_mode="liveall",
+)
+RATE_LIMIT_WAIT = Histogram(
+    "rate_limit_wait_seconds",
+    "Time that requests waited for the rate limit",
+    ["limit"],
+    buckets=HTTP_CLIENT_BUCKETS,
+)
+RATE_LIMIT_EXCEEDED = Counter(
+    "rate_limit_exceeded",
+    "Requests that gave up waiting for the rate limit",
+    ["limit"],
+)
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("healthcheck", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EventIndex",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("msisdn", models.CharField(max_length=255)),
+                ("model", models.CharField(max_length=100)),
+                ("first_id", models.CharField(max_length=255)),
+                ("first_timestamp", models.DateTimeField()),
+                ("latest_id", models.CharField(max_length=255)),
+                ("latest_timestamp", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="eventindex",
+            constraint=models.UniqueConstraint(
+                fields=("msisdn", "model"), name="healthcheck_eventindex_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,205 @@
+from django.db import connection, models, transaction
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete
+
+
+class ChangeLogManager(models.Manager):
+    def log_changes(self, instances):
+        """
+        Records that the instances have been created or updated. bulk_create and
+        queryset updates don't call save, so they need to call this themselves.
+        """
+        return self.bulk_create(
+            ChangeLog(model=instance._meta.label, object_id=str(instance.pk))
+            for instance in instances
+        )
+
+
+class ChangeLog(models.Model):
+    """
+    A transactional outbox of the rows that have been created or updated, which the
+    ETL exports in id order. This means that updates are exported, and that rows
+    aren't skipped if they're committed after a later timestamp has been exported.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=255)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = ChangeLogManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["model", "id"])]
+
+
+class ChangeLogMixin:
+    """
+    Writes a ChangeLog entry in the same transaction as every save of the model
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            ChangeLog.objects.log_changes([self])
+
+
+class EventIndexManager(models.Manager):
+    def record(self, instances):
+        """
+        Moves the first and latest pointers for the msisdns of the instances, if
+        they're earlier or later than the current ones. bulk_create doesn't call save,
+        so it needs to call this itself.
+        """
+        events = {}
+        for instance in instances:
+            key = (instance.msisdn, instance._meta.label)
+            event = (getattr(instance, instance._meta.get_latest_by), instance.pk)
+            first, latest = events.get(key, (event, event))
+            events[key] = (min(first, event), max(latest, event))
+        if not events:
+            return
+
+        table = self.model._meta.db_table
+        params = []
+        for (msisdn, model), (first, latest) in events.items():
+            params.extend(
+                [msisdn, model, str(first[1]), first[0], str(latest[1]), latest[0]]
+            )
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(events))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (
+                    msisdn, model, first_id, first_timestamp, latest_id,
+                    latest_timestamp
+                )
+                VALUES {values}
+                ON CONFLICT (msisdn, model) DO UPDATE SET
+                    first_id = CASE
+                        WHEN EXCLUDED.first_timestamp < {table}.first_timestamp
+                        THEN EXCLUDED.first_id ELSE {table}.first_id
+                    END,
+                    first_timestamp = LEAST(
+                        EXCLUDED.first_timestamp, {table}.first_timestamp
+                    ),
+                    latest_id = CASE
+                        WHEN EXCLUDED.latest_timestamp >= {table}.latest_timestamp
+                        THEN EXCLUDED.latest_id ELSE {table}.latest_id
+                    END,
+                    latest_timestamp = GREATEST(
+                        EXCLUDED.latest_timestamp, {table}.latest_timestamp
+                    )
+                """,
+                params,
+            )
+
+    def rebuild(self, model, msisdns):
+        """
+        Recomputes the pointers for the msisdns from the model's table, eg. after
+        an event's get_latest_by is changed, or an event is deleted. Queryset updates
+        don't call save, so they need to call this themselves.
+        """
+        table = self.model._meta.db_table
+        field = model._meta.get_field(model._meta.get_latest_by).column
+        pk = model._meta.pk.column
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (
+                    msisdn, model, first_id, first_timestamp, latest_id,
+                    latest_timestamp
+                )
+                SELECT
+                    msisdn,
+                    %s,
+                    (array_agg({pk}::text ORDER BY {field}, {pk}))[1],
+                    min({field}),
+                    (array_agg({pk}::text ORDER BY {field} DESC, {pk} DESC))[1],
+                    max({field})
+                FROM {model._meta.db_table}
+                WHERE msisdn = ANY(%s)
+                GROUP BY msisdn
+                ON CONFLICT (msisdn, model) DO UPDATE SET
+                    first_id = EXCLUDED.first_id,
+                    first_timestamp = EXCLUDED.first_timestamp,
+                    latest_id = EXCLUDED.latest_id,
+                    latest_timestamp = EXCLUDED.latest_timestamp
+                """,
+                [model._meta.label, list(msisdns)],
+            )
+            self.filter(model=model._meta.label, msisdn__in=msisdns).exclude(
+                msisdn__in=model.objects.filter(msisdn__in=msisdns).values("msisdn")
+            ).delete()
+
+    def _get_events(self, model, msisdns, pointer):
+        ids = self.filter(model=model._meta.label, msisdn__in=msisdns).values(pointer)
+        pk = model._meta.pk
+        return model.objects.filter(
+            pk__in=ids.annotate(event_id=Cast(pointer, type(pk)())).values("event_id")
+        )
+
+    def get_first_events(self, model, msisdns):
+        """
+        Returns a queryset of the first instance of the model for each of the msisdns
+        """
+        return self._get_events(model, msisdns, "first_id")
+
+    def get_latest_events(self, model, msisdns):
+        """
+        Returns a queryset of the latest instance of the model for each of the
+        msisdns
+        """
+        return self._get_events(model, msisdns, "latest_id")
+
+    def has_events(self, model, msisdn):
+        return self.filter(model=model._meta.label, msisdn=msisdn).exists()
+
+
+class EventIndex(models.Model):
+    """
+    Points to the first and latest instance of each event model for each msisdn, by
+    the model's get_latest_by, so that they can be looked up without sorting the
+    events.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    msisdn = models.CharField(max_length=255)
+    model = models.CharField(max_length=100)
+    first_id = models.CharField(max_length=255)
+    first_timestamp = models.DateTimeField()
+    latest_id = models.CharField(max_length=255)
+    latest_timestamp = models.DateTimeField()
+
+    objects = EventIndexManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["msisdn", "model"], name="healthcheck_eventindex_unique"
+            )
+        ]
+
+
+class EventIndexMixin:
+    """
+    Updates the EventIndex in the same transaction as every save and delete of the
+    model, including queryset deletes
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        post_delete.connect(rebuild_event_index, sender=cls)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            if adding:
+                EventIndex.objects.record([self])
+            else:
+                EventIndex.objects.rebuild(type(self), [self.msisdn])
+
+
+def rebuild_event_index(sender, instance, **kwargs):
+    EventIndex.objects.rebuild(sender, [instance.msisdn])
@@ -0,0 +1,28 @@
+from django.conf import settings
+
+from lifenet.tasks import ETL_MODELS as LIFENET_ETL_MODELS
+from selfswab.tasks import ETL_MODELS as SELFSWAB_ETL_MODELS
+from tbconnect.tasks import ETL_MODELS as TBCONNECT_ETL_MODELS
+
+
+def get_etl_pipelines():
+    """
+    Returns the key path, dataset, and models of each of the ETL pipelines
+    """
+    return {
+        "tbconnect": (
+            settings.TBCONNECT_BQ_KEY_PATH,
+            settings.TBCONNECT_BQ_DATASET,
+            TBCONNECT_ETL_MODELS,
+        ),
+        "lifenet": (
+            settings.LIFENET_BQ_KEY_PATH,
+            settings.LIFENET_BQ_DATASET,
+            LIFENET_ETL_MODELS,
+        ),
+        "selfswab": (
+            settings.SELFSWAB_BQ_KEY_PATH,
+            settings.SELFSWAB_BQ_DATASET,
+            SELFSWAB_ETL_MODELS,
+        ),
+    }
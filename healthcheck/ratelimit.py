@@ -0,0 +1,108 @@
+import time
+
+from celery.utils.time import rate
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from healthcheck import metrics
+
+# Refills the bucket for the time since it was last updated, and takes a token if
+# there is one. Returns the tokens left, and how long to wait before trying again.
+TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated", "paused_until")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+local paused_until = tonumber(bucket[3]) or 0
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if paused_until > now then
+    wait = paused_until - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate + wait) + 1)
+return {tostring(tokens), tostring(wait)}
+"""
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"Rate limit {self.name} exceeded, retry after {self.retry_after:.1f}s"
+
+
+class TokenBucket:
+    """
+    A rate limit that is shared by every process, so that adding workers doesn't
+    increase the rate of requests. `limit` is a rate like celery's rate_limit, eg.
+    "60/m", and `capacity` is how many tokens can build up for a burst, which
+    defaults to a second's worth.
+    """
+
+    def __init__(self, name, limit, capacity=None):
+        self.name = name
+        self.rate = rate(limit)
+        self.capacity = capacity or max(self.rate, 1)
+        self.key = f"ratelimit:{name}"
+        self.redis = get_redis_connection()
+        self.take_token = self.redis.register_script(TAKE_TOKEN)
+
+    def try_acquire(self):
+        """
+        Takes a token if there is one. Returns 0 if it did, otherwise how many
+        seconds to wait before there will be one.
+        """
+        tokens, wait = self.take_token(
+            keys=[self.key], args=[self.rate, self.capacity, time.time()]
+        )
+        metrics.RATE_LIMIT_TOKENS.labels(limit=self.name).set(float(tokens))
+        return float(wait)
+
+    def acquire(self, max_wait=None):
+        """
+        Waits for a token, for up to max_wait seconds, or RATE_LIMIT_MAX_WAIT.
+        Raises RateLimitExceeded if there won't be a token in that time.
+        """
+        if max_wait is None:
+            max_wait = settings.RATE_LIMIT_MAX_WAIT
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            waited = time.monotonic() - start
+            if not wait:
+                metrics.RATE_LIMIT_WAIT.labels(limit=self.name).observe(waited)
+                return
+            if waited + wait > max_wait:
+                metrics.RATE_LIMIT_EXCEEDED.labels(limit=self.name).inc()
+                raise RateLimitExceeded(self.name, wait)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stops giving out tokens for the given number of seconds, eg. for the
+        Retry-After of a 429 response
+        """
+        with self.redis.pipeline() as pipe:
+            pipe.hset(self.key, "paused_until", time.time() + seconds)
+            pipe.expire(self.key, int(seconds) + 1)
+            pipe.execute()
+
+
+def get_rate_limit(name):
+    """
+    Returns the TokenBucket for the named limit in RATE_LIMITS, or None if there
+    isn't one
+    """
+    limit = settings.RATE_LIMITS.get(name)
+    if not limit:
+        return None
+    return TokenBucket(name, limit)
@@ -1,4 +1,5 @@
 from celery.schedules import crontab
+from kombu import Queue
 import os
 
 import environ
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
     "health_check.contrib.rabbitmq",
     "health_check.contrib.celery_ping",
     # local apps
+    "healthcheck",
     "users",
     "contacts",
     "covid_cases",
@@ -157,15 +159,53 @@ PHONENUMBER_DB_FORMAT = "NATIONAL"
 PHONENUMBER_DEFAULT_REGION = "ZA"
 
 # CELERY SETTINGS
+# How long the lease of a singleton task lasts if the worker stops renewing it
+TASK_LEASE_TTL = env.int("TASK_LEASE_TTL", 60)
+# The port that celery workers serve their metrics on. The /prometheus/ view only has
+# the metrics of the web server.
+WORKER_METRICS_PORT = env.int("WORKER_METRICS_PORT", 0)
 CELERY_BROKER_URL = env.str("CELERY_BROKER_URL", "redis://localhost:6379/0")
 # BROKER_URL and REDIS_URL are required to have rabbitmq and redis monitoring.
 # Redis is used in dev env, RabbitMQ on production.
 BROKER_URL = env.str("CELERY_BROKER_URL", "redis://localhost:6379/0")
 REDIS_URL = env.str("REDIS_URL", "redis://localhost:6379/0")
-CELERY_RESULT_BACKEND = "django-db"
+# Nothing reads the results of most tasks, so they're only stored for the tasks that
+# are annotated with ignore_result False, and for failures, and expire after a day
+CELERY_RESULT_BACKEND = env.str("CELERY_RESULT_BACKEND", REDIS_URL)
+CELERY_RESULT_EXPIRES = env.int("CELERY_RESULT_EXPIRES", 60 * 60 * 24)
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_STORE_ERRORS_EVEN_IF_IGNORED = True
+CELERY_TASK_ANNOTATIONS = {
+    "healthcheck.tasks.sync_model_to_bigquery": {"ignore_result": False},
+    "healthcheck.tasks.backfill_model_window": {"ignore_result": False},
+}
+# How long to keep the task results that were stored in the database
+TASK_RESULT_RETENTION_DAYS = env.int("TASK_RESULT_RETENTION_DAYS", 7)
 CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = env.str("CELERY_TASK_SERIALIZER", "json")
 CELERY_RESULT_SERIALIZER = env.str("CELERY_RESULT_SERIALIZER", "json")
+# Tasks are routed to a queue for their workload, so that long ETL and scraping runs
+# don't hold up the tasks that users are waiting on. Workers consume all the queues
+# unless they're given -Q, see the README for the worker for each queue.
+CELERY_TASK_DEFAULT_QUEUE = "celery"
+CELERY_TASK_QUEUES = (
+    Queue("celery"),
+    Queue("realtime"),
+    Queue("etl"),
+    Queue("scraping"),
+)
+CELERY_TASK_ROUTES = {
+    "contacts.tasks.send_contact_update": {"queue": "realtime"},
+    "real411.tasks.process_complaint_update": {"queue": "realtime"},
+    "tbconnect.tasks.send_tbcheck_data_to_cci": {"queue": "realtime"},
+    "*.tasks.perform_etl": {"queue": "etl"},
+    "healthcheck.tasks.*": {"queue": "etl"},
+    "covid_cases.tasks.*": {"queue": "scraping"},
+}
+# These are set per worker, eg. a prefetch multiplier of 1 so that a worker with long
+# tasks doesn't hold on to tasks that another worker could be running
+CELERY_WORKER_PREFETCH_MULTIPLIER = env.int("CELERY_WORKER_PREFETCH_MULTIPLIER", 4)
+CELERY_TASK_ACKS_LATE = env.bool("CELERY_TASK_ACKS_LATE", False)
 CELERY_BEAT_SCHEDULE = {
     "scrape-nicd-gis": {
         "task": "covid_cases.tasks.scrape_nicd_gis",
@@ -195,6 +235,18 @@ CELERY_BEAT_SCHEDULE = {
         "task": "lifenet.tasks.perform_etl",
         "schedule": crontab(minute="*/5"),
     },
+    "prune-task-results": {
+        "task": "healthcheck.tasks.prune_task_results",
+        "schedule": crontab(minute=30, hour=2),
+    },
+    "prune-changelog": {
+        "task": "healthcheck.tasks.prune_changelog",
+        "schedule": crontab(minute=45, hour=2),
+    },
+    "recount-profile-counters": {
+        "task": "userprofile.tasks.recount_profile_counters",
+        "schedule": crontab(minute=0, hour=3),
+    },
 }
 
 TURN_API_KEY = env.str("TURN_API_KEY", "default")
@@ -205,11 +257,42 @@ RAPIDPRO_URL = env.str("RAPIDPRO_URL", "")
 RAPIDPRO_TOKEN = env.str("RAPIDPRO_TOKEN", "")
 RAPIDPRO_TBCONNECT_FLOW = env.str("RAPIDPRO_TBCONNECT_FLOW", "")
 RAPIDPRO_REAL411_FLOW = env.str("RAPIDPRO_REAL411_FLOW", "")
+# For the shared clients from healthcheck.http.get_rapidpro_client
+RAPIDPRO_TIMEOUT = env.int("RAPIDPRO_TIMEOUT", 30)
+RAPIDPRO_RETRIES = env.int("RAPIDPRO_RETRIES", 3)
+RAPIDPRO_MAX_RETRY_AFTER = env.int("RAPIDPRO_MAX_RETRY_AFTER", 5)
+RAPIDPRO_POOL_SIZE = env.int("RAPIDPRO_POOL_SIZE", 10)
+# The number of flow starts that tbconnect's sync sends at a time. This shouldn't
+# be more than RAPIDPRO_POOL_SIZE, or the extra requests wait for a connection.
+RAPIDPRO_SYNC_CONCURRENCY = env.int("RAPIDPRO_SYNC_CONCURRENCY", 5)
+# The sync stops, and is retried later, after this many flow starts fail in a row
+RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES = env.int(
+    "RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES", 20
+)
+# Contacts that RapidPro rejects, eg. for an invalid URN, are tried again after this
+# many seconds, so that they don't hold up the rest of the queue
+RAPIDPRO_SYNC_REJECTED_DELAY = env.int("RAPIDPRO_SYNC_REJECTED_DELAY", 60 * 60)
 
 MEDITECH_URL = env.str("MEDITECH_URL", "")
 MEDITECH_USER = env.str("MEDITECH_USER", "")
 MEDITECH_PASSWORD = env.str("MEDITECH_PASSWORD", "")
 
+# The rate of requests to each partner API, eg. "60/m", shared by all the workers.
+# Empty to not limit the requests.
+RATE_LIMITS = {
+    "turn": env.str("TURN_RATE_LIMIT", "60/m"),
+    # For requests that a user is waiting for, which don't wait for the limit
+    "turn_interactive": env.str("TURN_INTERACTIVE_RATE_LIMIT", "60/m"),
+    "selfswab_turn": env.str("SELFSWAB_TURN_RATE_LIMIT", ""),
+    "rapidpro": env.str("RAPIDPRO_RATE_LIMIT", ""),
+    # RapidPro throttles flow starts separately from the rest of the API
+    "rapidpro_flow_starts": env.str("RAPIDPRO_FLOW_START_RATE_LIMIT", ""),
+    "cci": env.str("CCI_RATE_LIMIT", ""),
+    "meditech": env.str("MEDITECH_RATE_LIMIT", ""),
+}
+# How long a request waits for its rate limit before raising RateLimitExceeded
+RATE_LIMIT_MAX_WAIT = env.int("RATE_LIMIT_MAX_WAIT", 10)
+
 SELFSWAB_RAPIDPRO_TOKEN = env.str("SELFSWAB_RAPIDPRO_TOKEN", "")
 SELFSWAB_RAPIDPRO_FLOW = env.str("SELFSWAB_RAPIDPRO_FLOW", "")
 
@@ -246,6 +329,24 @@ SELFSWAB_TURN_TOKEN = env.str("SELFSWAB_TURN_TOKEN", "default")
 LIFENET_BQ_KEY_PATH = env.str("LIFENET_BQ_KEY_PATH", "bq_credentials.json")
 LIFENET_BQ_DATASET = env.str("LIFENET_BQ_DATASET", "wassup-165700.lifenet")
 
+# bigquery, or local to write the ETL output to files in ETL_LOCAL_SINK_PATH
+ETL_SINK = env.str("ETL_SINK", "bigquery")
+ETL_LOCAL_SINK_PATH = env.str("ETL_LOCAL_SINK_PATH", os.path.join(BASE_DIR, "etl"))
+ETL_BATCH_SIZE = env.int("ETL_BATCH_SIZE", 10000)
+# Processes to split the ETL transforms over. This only applies outside of celery's
+# prefork pool, eg. with the solo or threads pool, or in the benchmark_etl command,
+# because the prefork pool's processes can't start processes of their own.
+ETL_TRANSFORM_PROCESSES = env.int("ETL_TRANSFORM_PROCESSES", 0)
+# How old change log entries need to be before they're exported, so that changes
+# that are committed out of order aren't skipped
+ETL_CHANGELOG_LAG = env.int("ETL_CHANGELOG_LAG", 60)
+# How long to keep the change log entries, which should be exported long before then
+CHANGELOG_RETENTION_DAYS = env.int("CHANGELOG_RETENTION_DAYS", 7)
+# NEWLINE_DELIMITED_JSON or AVRO
+ETL_SOURCE_FORMAT = env.str("ETL_SOURCE_FORMAT", "NEWLINE_DELIMITED_JSON")
+# If set, staged AVRO files are kept in the default file storage under this path
+ETL_STAGING_STORAGE_PATH = env.str("ETL_STAGING_STORAGE_PATH", "")
+
 CONTACT_NOTIFICATION_ENABLED = env.bool("CONTACT_NOTIFICATION_ENABLED", False)
 
 ENABLE_NICD_GIS_SCRAPING = env.bool("ENABLE_NICD_GIS_SCRAPING", False)
@@ -14,3 +14,8 @@ CELERY_TASK_ALWAYS_EAGER = True
 PROMETHEUS_EXPORT_MIGRATIONS = False
 ALLOWED_HOSTS = env.list("ALLOWED_HOSTS", default="*")  # noqa: F405
 SOFT_COMMITMENT_PLUS_LIMIT = 3
+# The rate limits are shared between tests in redis, so they're only set by the tests
+# for them
+RATE_LIMITS = {}
+# Send the flow starts one at a time, so that the tests can check them in order
+RAPIDPRO_SYNC_CONCURRENCY = 1
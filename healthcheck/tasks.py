@@ -0,0 +1,147 @@
+import datetime
+
+from celery import group, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_celery_results.models import TaskResult
+from django_redis import get_redis_connection
+from google.api_core.exceptions import GoogleAPIError
+
+from healthcheck import utils
+from healthcheck.leases import singleton_task
+from healthcheck.models import ChangeLog
+
+
+@shared_task
+@singleton_task(
+    "sync_model_to_bigquery_{dataset}.{table}",
+    # A metric for each table
+    name="sync_model_to_bigquery_{dataset}.{table}",
+)
+def sync_model_to_bigquery(key_path, dataset, table, details):
+    """
+    Syncs a single table to BigQuery. `details` is the same as for
+    `utils.sync_models_to_bigquery`, except that "model" is the model label
+    """
+    details = {**details, "model": apps.get_model(details["model"])}
+    stats = utils.sync_models_to_bigquery(key_path, dataset, {table: details})
+
+    rows = stats.get(table, {}).get("rows", 0)
+    return f"Finished syncing {rows} rows to {dataset}.{table}"
+
+
+def sync_models_to_bigquery_in_parallel(key_path, dataset, models):
+    """
+    Starts a separate task for each of the models, so that a slow table doesn't
+    hold up the others
+    """
+    return group(
+        sync_model_to_bigquery.s(
+            key_path, dataset, table, {**details, "model": details["model"]._meta.label}
+        )
+        for table, details in models.items()
+    ).apply_async()
+
+
+# Unlike the periodic ETL, a lost window isn't picked up by a later run, so it's
+# acknowledged after it runs. Windows are checkpointed, and leased, so a redelivered
+# window is skipped if it's done or still running.
+@shared_task(
+    autoretry_for=(GoogleAPIError, SoftTimeLimitExceeded),
+    max_retries=5,
+    retry_backoff=True,
+    acks_late=True,
+)
+@singleton_task("backfill_model_window_{dataset}.{table}_{start}")
+def backfill_model_window(key_path, dataset, table, details, start, end):
+    """
+    Exports a single window of a backfill, and checkpoints it so that it isn't
+    exported again if the backfill is restarted. `details` is the same as for
+    `sync_model_to_bigquery`, and start and end are ISO 8601 timestamps.
+    """
+    r = get_redis_connection()
+    checkpoint_key = utils.get_etl_backfill_key(dataset, table)
+    if r.sismember(checkpoint_key, start):
+        return f"Already backfilled {dataset}.{table} from {start} to {end}"
+
+    details = {**details, "model": apps.get_model(details["model"])}
+    stats = utils.backfill_model_to_bigquery(
+        key_path, dataset, table, details, parse_datetime(start), parse_datetime(end)
+    )
+    r.sadd(checkpoint_key, start)
+
+    rows = stats.get(table, {}).get("rows", 0)
+    return (
+        f"Finished backfilling {rows} rows to {dataset}.{table} from {start} to {end}"
+    )
+
+
+def backfill_model_in_parallel(key_path, dataset, table, details, start, end, window):
+    """
+    Splits the time range into windows, and starts a separate task to export each
+    window, so that they can be spread over workers and retried on their own.
+    Returns the number of windows that were started.
+    """
+    details = {**details, "model": details["model"]._meta.label}
+    windows = utils.get_backfill_windows(start, end, window)
+    group(
+        backfill_model_window.s(
+            key_path,
+            dataset,
+            table,
+            details,
+            window_start.isoformat(),
+            window_end.isoformat(),
+        )
+        for window_start, window_end in windows
+    ).apply_async()
+    return len(windows)
+
+
+@shared_task
+@singleton_task("prune_task_results")
+def prune_task_results(batch_size=1000):
+    """
+    Deletes the task results in the database that are older than
+    TASK_RESULT_RETENTION_DAYS, in batches, so that each delete is a short
+    transaction
+    """
+    cutoff = timezone.now() - datetime.timedelta(
+        days=settings.TASK_RESULT_RETENTION_DAYS
+    )
+    deleted = 0
+    while True:
+        ids = list(
+            TaskResult.objects.filter(date_done__lt=cutoff).values_list(
+                "id", flat=True
+            )[:batch_size]
+        )
+        if not ids:
+            break
+        deleted += TaskResult.objects.filter(id__in=ids).delete()[0]
+    return f"Deleted {deleted} task results"
+
+
+@shared_task
+@singleton_task("prune_changelog")
+def prune_changelog(batch_size=10000):
+    """
+    Deletes the change log entries that are older than CHANGELOG_RETENTION_DAYS, in
+    batches, so that each delete is a short transaction. The ETL exports changes
+    within minutes, so this only needs to leave enough time to fix a stuck ETL.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.CHANGELOG_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        ids = list(
+            ChangeLog.objects.filter(timestamp__lt=cutoff)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        deleted += ChangeLog.objects.filter(id__in=ids).delete()[0]
+    return f"Deleted {deleted} change log entries"
@@ -0,0 +1,129 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from celery import shared_task
+from django.test import TestCase
+from prometheus_client import REGISTRY
+
+from healthcheck import celery
+
+
+@shared_task
+def add(x, y):
+    return x + y
+
+
+def get_sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class CeleryMetricsTests(TestCase):
+    def get_task(self, **request):
+        return SimpleNamespace(
+            name="test_task",
+            request=SimpleNamespace(**{"published_at": None, "eta": None, **request}),
+        )
+
+    def test_record_task_published(self):
+        headers = {}
+        celery.record_task_published(headers=headers)
+        self.assertAlmostEqual(headers["published_at"], time.time(), delta=1)
+
+    def test_runtime(self):
+        """
+        Should record the runtime of tasks by name and state
+        """
+        labels = {"task": add.name, "state": "SUCCESS"}
+        count = get_sample("celery_task_runtime_seconds_count", labels)
+
+        self.assertEqual(add.delay(1, 2).get(), 3)
+
+        self.assertEqual(
+            get_sample("celery_task_runtime_seconds_count", labels), count + 1
+        )
+
+    def test_queue_wait(self):
+        """
+        Should record the time between the task being published and it starting
+        """
+        labels = {"task": "test_task"}
+        total = get_sample("celery_task_queue_wait_seconds_sum", labels)
+
+        task = self.get_task(published_at=time.time() - 5)
+        celery.record_task_started(task_id="1", task=task)
+        celery.record_task_finished(task_id="1", task=task, state="SUCCESS")
+
+        self.assertAlmostEqual(
+            get_sample("celery_task_queue_wait_seconds_sum", labels), total + 5, 0
+        )
+
+    def test_queue_wait_eta(self):
+        """
+        Shouldn't count the time spent waiting for the task's ETA
+        """
+        labels = {"task": "test_task"}
+        total = get_sample("celery_task_queue_wait_seconds_sum", labels)
+
+        eta = datetime.now(timezone.utc) - timedelta(seconds=2)
+        task = self.get_task(published_at=time.time() - 100, eta=eta.isoformat())
+        celery.record_task_started(task_id="1", task=task)
+
+        self.assertAlmostEqual(
+            get_sample("celery_task_queue_wait_seconds_sum", labels), total + 2, 0
+        )
+
+    def test_not_published(self):
+        """
+        Tasks that are run eagerly have no queue wait
+        """
+        labels = {"task": "test_task"}
+        count = get_sample("celery_task_queue_wait_seconds_count", labels)
+
+        celery.record_task_started(task_id="1", task=self.get_task())
+
+        self.assertEqual(
+            get_sample("celery_task_queue_wait_seconds_count", labels), count
+        )
+
+    def test_retries_and_failures(self):
+        labels = {"task": "test_task"}
+        retries = get_sample("celery_task_retries_total", labels)
+        failures = get_sample("celery_task_failures_total", labels)
+
+        celery.record_task_retry(sender=self.get_task())
+        celery.record_task_failure(sender=self.get_task())
+
+        self.assertEqual(get_sample("celery_task_retries_total", labels), retries + 1)
+        self.assertEqual(get_sample("celery_task_failures_total", labels), failures + 1)
+
+
+class TaskRoutingTests(TestCase):
+    def get_queue(self, name):
+        return celery.app.amqp.router.route({}, name)["queue"].name
+
+    def test_routes(self):
+        """
+        Should route tasks to the queue for their workload
+        """
+        self.assertEqual(
+            self.get_queue("contacts.tasks.send_contact_update"), "realtime"
+        )
+        self.assertEqual(
+            self.get_queue("real411.tasks.process_complaint_update"), "realtime"
+        )
+        self.assertEqual(self.get_queue("tbconnect.tasks.perform_etl"), "etl")
+        self.assertEqual(
+            self.get_queue("healthcheck.tasks.sync_model_to_bigquery"), "etl"
+        )
+        self.assertEqual(
+            self.get_queue("covid_cases.tasks.scrape_nicd_gis"), "scraping"
+        )
+
+    def test_default_queue(self):
+        """
+        Tasks without a route should go to the default queue
+        """
+        self.assertEqual(
+            self.get_queue("tbconnect.tasks.perform_sync_to_rapidpro"), "celery"
+        )
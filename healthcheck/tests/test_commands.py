@@ -0,0 +1,148 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+
+from healthcheck.utils import backfill_hashed_fields, hash_string
+from lifenet.models import LNCheck
+from selfswab.models import SelfSwabScreen, SelfSwabTest
+from tbconnect.models import TBCheck, TBTest
+
+
+class BackfillHashedMSISDNsTests(TestCase):
+    def test_backfill(self):
+        test = TBTest.objects.create(
+            msisdn="+27831231234", source="test", result=TBTest.RESULT_PENDING
+        )
+        screen = SelfSwabScreen.objects.create(
+            contact_id="CV0101H",
+            msisdn="+27831231234",
+            employee_number="12345",
+            cough=False,
+            fever=False,
+            shortness_of_breath=False,
+            body_aches=False,
+            loss_of_taste_smell=False,
+            sore_throat=False,
+            additional_symptoms=False,
+        )
+        TBTest.objects.update(hashed_msisdn="")
+        SelfSwabScreen.objects.update(hashed_msisdn="", hashed_employee_number="")
+
+        stdout = StringIO()
+        call_command("backfill_hashed_msisdns", stdout=stdout)
+
+        test.refresh_from_db()
+        self.assertEqual(
+            test.hashed_msisdn, "eIUHAUSFHvvZ2vpXxPJDwMZ2MuMPVpKOJHUeICFyQnE="
+        )
+        screen.refresh_from_db()
+        self.assertEqual(
+            screen.hashed_msisdn, "eIUHAUSFHvvZ2vpXxPJDwMZ2MuMPVpKOJHUeICFyQnE="
+        )
+        self.assertEqual(
+            screen.hashed_employee_number,
+            "WZRHGrsBESr8wYFZ9sx0tPURuZgG2lmzyvWpwXPKz8U=",
+        )
+        self.assertIn("Updated 1 tb tests", stdout.getvalue())
+
+    def test_backfill_batches(self):
+        """
+        Should update every row, one batch at a time
+        """
+        for i in range(3):
+            TBTest.objects.create(
+                msisdn=f"+2783123123{i}", source="test", result=TBTest.RESULT_PENDING
+            )
+        TBTest.objects.update(hashed_msisdn="")
+
+        updated = backfill_hashed_fields(
+            TBTest, {"hashed_msisdn": "msisdn"}, batch_size=2
+        )
+
+        self.assertEqual(updated, 3)
+        for test in TBTest.objects.all():
+            self.assertEqual(test.hashed_msisdn, hash_string(test.msisdn))
+
+
+class GenerateETLDataTests(TestCase):
+    def test_generate(self):
+        stdout = StringIO()
+        call_command("generate_etl_data", count=3, batch_size=2, stdout=stdout)
+
+        self.assertEqual(TBCheck.objects.count(), 3)
+        self.assertEqual(SelfSwabTest.objects.count(), 3)
+        self.assertIn("Created 3 tbconnect.TBCheck rows", stdout.getvalue())
+
+        check = TBCheck.objects.first()
+        self.assertEqual(check.hashed_msisdn, hash_string(check.msisdn))
+        self.assertLess(check.location_latitude, -22)
+        self.assertGreater(check.location_longitude, 16)
+        self.assertLess(check.city_latitude, -22)
+
+    def test_generate_model(self):
+        call_command(
+            "generate_etl_data", count=2, model=["lifenet.LNCheck"], stdout=StringIO()
+        )
+        self.assertEqual(LNCheck.objects.count(), 2)
+        self.assertEqual(TBCheck.objects.count(), 0)
+
+    def test_unknown_model(self):
+        with self.assertRaises(CommandError):
+            call_command("generate_etl_data", model=["userprofile.Covid19Triage"])
+
+
+class BenchmarkETLTests(TestCase):
+    def test_benchmark(self):
+        call_command("generate_etl_data", count=3, stdout=StringIO())
+
+        stdout = StringIO()
+        with tempfile.TemporaryDirectory() as path:
+            output = os.path.join(path, "results.json")
+            call_command("benchmark_etl", batch_size=2, output=output, stdout=stdout)
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(results["pipelines"]["tbconnect"]["rows"], 6)
+        self.assertEqual(results["pipelines"]["selfswab"]["rows"], 9)
+        checks = results["pipelines"]["lifenet"]["tables"]["checks"]
+        self.assertEqual(checks["rows"], 3)
+        self.assertEqual(checks["batches"], 2)
+        self.assertGreater(checks["query_seconds"], 0)
+        self.assertGreater(results["pipelines"]["lifenet"]["peak_rss_mb"], 0)
+        self.assertIn("lifenet: 3 rows", stdout.getvalue())
+
+
+class BackfillETLTests(TestCase):
+    def tearDown(self):
+        get_redis_connection().delete("etl_backfill:wassup-165700.tbconnect.tests")
+
+    @override_settings(TBCONNECT_BQ_DATASET="wassup-165700.tbconnect")
+    @patch("healthcheck.tasks.utils.backfill_model_to_bigquery")
+    def test_backfill(self, mock_backfill_model_to_bigquery):
+        mock_backfill_model_to_bigquery.return_value = {}
+        stdout = StringIO()
+        call_command(
+            "backfill_etl",
+            "tbconnect",
+            "tests",
+            "--start=2021-01-01",
+            "--end=2021-01-29",
+            "--window-days=7",
+            stdout=stdout,
+        )
+
+        self.assertEqual(mock_backfill_model_to_bigquery.call_count, 4)
+        self.assertIn(
+            "Started backfilling wassup-165700.tbconnect.tests in 4 windows",
+            stdout.getvalue(),
+        )
+
+    def test_unknown_table(self):
+        with self.assertRaises(CommandError):
+            call_command("backfill_etl", "tbconnect", "foo", "--start=2021-01-01")
@@ -0,0 +1,254 @@
+import json
+from unittest.mock import patch
+
+import requests
+import responses
+from django.test import TestCase, override_settings
+from prometheus_client import REGISTRY
+from temba_client.exceptions import TembaNoSuchObjectError, TembaRateExceededError
+
+from healthcheck import http
+
+
+def get_sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class GetEndpointTests(TestCase):
+    def test_ids_replaced(self):
+        """
+        Phone numbers, database ids and UUIDs in the path should be replaced
+        """
+        self.assertEqual(
+            http.get_endpoint("https://turn/v1/contacts/27820001001/messages"),
+            "/v1/contacts/{id}/messages",
+        )
+        self.assertEqual(
+            http.get_endpoint(
+                "https://turn/v1/media/d5b0e4a2-9f3b-4d2c-8e0f-2b6a1c3d4e5f?x=1"
+            ),
+            "/v1/media/{id}",
+        )
+        self.assertEqual(http.get_endpoint("https://turn/v1/media"), "/v1/media")
+        self.assertEqual(http.get_endpoint("https://cci"), "/")
+
+
+class SessionTests(TestCase):
+    labels = {"integration": "test", "endpoint": "/v1/contacts/{id}", "method": "POST"}
+
+    @responses.activate
+    def test_response(self):
+        """
+        Should record the latency, status and size of the request and response
+        """
+        responses.add(
+            responses.POST, "https://test/v1/contacts/1234", json={"status": "ok"}
+        )
+        count = get_sample("http_client_request_duration_seconds_count", self.labels)
+        status = get_sample(
+            "http_client_responses_total", {"status": "200", **self.labels}
+        )
+        sent = get_sample("http_client_sent_bytes_total", self.labels)
+        received = get_sample("http_client_received_bytes_total", self.labels)
+
+        response = http.request(
+            "test", "post", "https://test/v1/contacts/1234", json={"name": "test"}
+        )
+
+        self.assertEqual(response.json(), {"status": "ok"})
+        self.assertEqual(
+            get_sample("http_client_request_duration_seconds_count", self.labels),
+            count + 1,
+        )
+        self.assertEqual(
+            get_sample("http_client_responses_total", {"status": "200", **self.labels}),
+            status + 1,
+        )
+        self.assertEqual(
+            get_sample("http_client_sent_bytes_total", self.labels),
+            sent + len(json.dumps({"name": "test"})),
+        )
+        self.assertEqual(
+            get_sample("http_client_received_bytes_total", self.labels),
+            received + len(json.dumps({"status": "ok"})),
+        )
+
+    @responses.activate
+    def test_timeout(self):
+        """
+        Should record requests that time out as errors
+        """
+        responses.add(
+            responses.POST,
+            "https://test/v1/contacts/1234",
+            body=requests.exceptions.ReadTimeout(),
+        )
+        labels = {"error": "timeout", **self.labels}
+        errors = get_sample("http_client_errors_total", labels)
+        count = get_sample("http_client_request_duration_seconds_count", self.labels)
+
+        with self.assertRaises(requests.Timeout):
+            http.request("test", "post", "https://test/v1/contacts/1234")
+
+        self.assertEqual(get_sample("http_client_errors_total", labels), errors + 1)
+        self.assertEqual(
+            get_sample("http_client_request_duration_seconds_count", self.labels),
+            count + 1,
+        )
+
+    @responses.activate
+    def test_endpoint(self):
+        """
+        Should use the given endpoint label instead of the path
+        """
+        responses.add(responses.GET, "https://test/files/report-1.pdf", body=b"pdf")
+        labels = {"integration": "test", "endpoint": "pdf", "method": "GET"}
+        received = get_sample("http_client_received_bytes_total", labels)
+
+        with http.Session("test") as session:
+            session.get("https://test/files/report-1.pdf", endpoint="pdf")
+
+        self.assertEqual(
+            get_sample("http_client_received_bytes_total", labels), received + 3
+        )
+
+
+class TembaClientTests(TestCase):
+    labels = {
+        "integration": "rapidpro",
+        "endpoint": "/api/v2/contacts.json",
+        "method": "GET",
+    }
+
+    @responses.activate
+    def test_request(self):
+        """
+        Should make the request with the instrumented session, and parse the response
+        """
+        responses.add(
+            responses.GET,
+            "https://rapidpro/api/v2/contacts.json?urn=tel%3A%2B27820001001",
+            json={"results": [], "next": None},
+            match_querystring=True,
+        )
+        count = get_sample("http_client_request_duration_seconds_count", self.labels)
+
+        client = http.TembaClient("https://rapidpro", "token")
+        contact = client.get_contacts(urn="tel:+27820001001").first()
+
+        self.assertIsNone(contact)
+        self.assertEqual(
+            responses.calls[0].request.headers["Authorization"], "Token token"
+        )
+        self.assertEqual(
+            get_sample("http_client_request_duration_seconds_count", self.labels),
+            count + 1,
+        )
+
+    @responses.activate
+    def test_body(self):
+        """
+        Should send the payload as JSON
+        """
+        responses.add(
+            responses.POST,
+            "https://rapidpro/api/v2/flow_starts.json",
+            json={
+                "uuid": "start-uuid",
+                "flow": {"uuid": "flow-uuid", "name": "Test"},
+                "groups": [],
+                "contacts": [],
+                "restart_participants": True,
+                "status": "pending",
+                "created_on": "2021-01-01T00:00:00.000000+00:00",
+                "modified_on": "2021-01-01T00:00:00.000000+00:00",
+                "extra": {},
+            },
+        )
+
+        client = http.TembaClient("https://rapidpro", "token")
+        client.create_flow_start(flow="flow-uuid", urns=["tel:+27820001001"])
+
+        self.assertEqual(
+            json.loads(responses.calls[0].request.body),
+            {"flow": "flow-uuid", "urns": ["tel:+27820001001"]},
+        )
+
+    @responses.activate
+    def test_errors(self):
+        """
+        Should raise the same errors as the base client
+        """
+        responses.add(
+            responses.DELETE, "https://rapidpro/api/v2/contacts.json", status=404
+        )
+        labels = {**self.labels, "method": "DELETE", "status": "404"}
+        status = get_sample("http_client_responses_total", labels)
+
+        client = http.TembaClient("https://rapidpro", "token")
+        with self.assertRaises(TembaNoSuchObjectError):
+            client.delete_contact("tel:+27820001001")
+
+        self.assertEqual(get_sample("http_client_responses_total", labels), status + 1)
+
+
+class GetRapidproClientTests(TestCase):
+    @override_settings(RAPIDPRO_URL="https://rapidpro", RAPIDPRO_TOKEN="token")
+    def test_shared_client(self):
+        """
+        Should return the same client for each token, with its own connection pool
+        """
+        client = http.get_rapidpro_client()
+        self.assertIs(http.get_rapidpro_client("token"), client)
+        self.assertIsNot(http.get_rapidpro_client("other"), client)
+        self.assertEqual(client.headers["Authorization"], "Token token")
+        self.assertEqual(
+            client.session.get_adapter("https://rapidpro")._pool_maxsize, 10
+        )
+
+    @override_settings(RAPIDPRO_URL="https://rapidpro", RAPIDPRO_TOKEN="token")
+    def test_client_max_wait(self):
+        """
+        Should return a separate client for views that don't wait for the rate limit
+        """
+        client = http.get_rapidpro_client(max_wait=0)
+        self.assertIs(http.get_rapidpro_client(max_wait=0), client)
+        self.assertIsNot(http.get_rapidpro_client(), client)
+        self.assertEqual(client.session.max_wait, 0)
+        self.assertIsNone(http.get_rapidpro_client().session.max_wait)
+
+    @responses.activate
+    def test_retry_rate_limited(self):
+        """
+        Should retry rate limited requests if the Retry-After is short enough
+        """
+        responses.add(
+            responses.DELETE,
+            "https://rapidpro/api/v2/contacts.json",
+            status=429,
+            headers={"Retry-After": "1"},
+        )
+        responses.add(responses.DELETE, "https://rapidpro/api/v2/contacts.json")
+
+        client = http.TembaClient("https://rapidpro", "token", max_retry_after=1)
+        with patch("healthcheck.http.time.sleep") as mock_sleep:
+            client.delete_contact("tel:+27820001001")
+
+        mock_sleep.assert_called_once_with(1)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_rate_limited_long_retry_after(self):
+        """
+        Should raise if the Retry-After is too long to wait for
+        """
+        responses.add(
+            responses.DELETE,
+            "https://rapidpro/api/v2/contacts.json",
+            status=429,
+            headers={"Retry-After": "60"},
+        )
+
+        client = http.TembaClient("https://rapidpro", "token", max_retry_after=1)
+        with self.assertRaises(TembaRateExceededError):
+            client.delete_contact("tel:+27820001001")
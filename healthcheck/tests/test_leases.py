@@ -0,0 +1,133 @@
+import time
+
+from django.test import TestCase
+from django_redis import get_redis_connection
+from prometheus_client import REGISTRY
+
+from healthcheck.leases import Lease, check_lease, singleton_task
+
+
+def get_sample(name, lease):
+    return REGISTRY.get_sample_value(name, {"lease": lease}) or 0
+
+
+class LeaseTests(TestCase):
+    def tearDown(self):
+        get_redis_connection().delete("test_lease")
+
+    def test_acquire(self):
+        """
+        Only one lease should be held at a time
+        """
+        acquired = get_sample("lease_acquired_total", "test_lease")
+        skips = get_sample("lease_skips_total", "test_lease")
+
+        lease = Lease("test_lease", ttl=10)
+        self.assertTrue(lease.acquire())
+        self.assertFalse(Lease("test_lease", ttl=10).acquire())
+        lease.release()
+        self.assertIsNone(get_redis_connection().get("test_lease"))
+
+        self.assertEqual(get_sample("lease_acquired_total", "test_lease"), acquired + 1)
+        self.assertEqual(get_sample("lease_skips_total", "test_lease"), skips + 1)
+
+    def test_heartbeat(self):
+        """
+        Should keep renewing the lease while it's held
+        """
+        lease = Lease("test_lease", ttl=1)
+        lease.acquire()
+        time.sleep(1.5)
+        self.assertGreater(get_redis_connection().pttl("test_lease"), 0)
+        lease.release()
+        self.assertFalse(lease.lost)
+
+    def test_lost(self):
+        """
+        Should count the lease as lost if it expired before it was released
+        """
+        lost = get_sample("lease_lost_total", "test_lease")
+
+        lease = Lease("test_lease", ttl=10)
+        lease.acquire()
+        get_redis_connection().delete("test_lease")
+        lease.release()
+
+        self.assertTrue(lease.lost)
+        self.assertEqual(get_sample("lease_lost_total", "test_lease"), lost + 1)
+
+
+class SingletonTaskTests(TestCase):
+    def tearDown(self):
+        get_redis_connection().delete("test_lease_a")
+
+    def test_singleton_task(self):
+        """
+        Should format the key with the arguments, and skip if the lease is held
+        """
+
+        @singleton_task("test_lease_{name}")
+        def task(name, value=1):
+            return value
+
+        self.assertEqual(task("a", value=2), 2)
+        self.assertIsNone(get_redis_connection().get("test_lease_a"))
+
+        lease = Lease("test_lease_a", ttl=10)
+        lease.acquire()
+        self.assertIsNone(task("a"))
+        self.assertEqual(task(name="b"), 1)
+        lease.release()
+
+    def test_release_on_error(self):
+        """
+        Should release the lease if the task raises an exception
+        """
+
+        @singleton_task("test_lease_{name}")
+        def task(name):
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            task("a")
+        self.assertIsNone(get_redis_connection().get("test_lease_a"))
+
+    def test_stop_when_lost(self):
+        """
+        Should stop the task at the next check if the lease was lost
+        """
+        batches = []
+
+        @singleton_task("test_lease_{name}", ttl=1)
+        def task(name):
+            for i in range(3):
+                check_lease()
+                batches.append(i)
+                # The heartbeat finds that the lease expired
+                get_redis_connection().delete("test_lease_a")
+                time.sleep(0.5)
+            return "done"
+
+        self.assertIsNone(task("a"))
+        self.assertEqual(batches, [0])
+
+        # Outside of a task there's no lease to check
+        check_lease()
+
+    def test_metrics_label(self):
+        """
+        Should label the metrics with the unformatted key, so that there isn't a
+        metric for each value of the arguments
+        """
+
+        @singleton_task("test_lease_{name}")
+        def task(name):
+            return name
+
+        acquired = get_sample("lease_acquired_total", "test_lease_{name}")
+        task("a")
+        task("b")
+        self.assertEqual(
+            get_sample("lease_acquired_total", "test_lease_{name}"), acquired + 2
+        )
+        self.assertEqual(get_sample("lease_acquired_total", "test_lease_a"), 0)
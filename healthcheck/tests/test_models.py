@@ -0,0 +1,191 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from healthcheck.models import EventIndex
+from tbconnect.models import TBCheck
+from userprofile.models import Covid19Triage
+
+
+def create_tbcheck(msisdn, completed_timestamp):
+    return TBCheck.objects.create(
+        msisdn=msisdn,
+        cough=False,
+        fever=False,
+        sweat=False,
+        weight=False,
+        tracing=True,
+        exposure=TBCheck.EXPOSURE_NO,
+        source="WhatsApp",
+        risk=TBCheck.RISK_LOW,
+        completed_timestamp=completed_timestamp,
+    )
+
+
+def create_triage(msisdn, timestamp):
+    return Covid19Triage.objects.create(
+        msisdn=msisdn,
+        fever=False,
+        cough=False,
+        sore_throat=False,
+        tracing=True,
+        timestamp=timestamp,
+    )
+
+
+class EventIndexTests(TestCase):
+    def test_first_and_latest(self):
+        """
+        Should point to the first and latest event for each msisdn, by the model's
+        get_latest_by, whatever order they're inserted in
+        """
+        now = timezone.now()
+        create_tbcheck("+27820001001", now - timedelta(days=1))
+        latest = create_tbcheck("+27820001001", now)
+        first = create_tbcheck("+27820001001", now - timedelta(days=2))
+        other = create_tbcheck("+27820001002", now)
+
+        index = EventIndex.objects.get(model="tbconnect.TBCheck", msisdn="+27820001001")
+        self.assertEqual(index.first_id, str(first.id))
+        self.assertEqual(index.latest_id, str(latest.id))
+        self.assertEqual(
+            set(EventIndex.objects.get_latest_events(TBCheck, ["+27820001001"])),
+            {latest},
+        )
+        self.assertEqual(
+            set(
+                EventIndex.objects.get_first_events(
+                    TBCheck, ["+27820001001", "+27820001002"]
+                )
+            ),
+            {first, other},
+        )
+
+    def test_uuid_primary_key(self):
+        """
+        Should look up events with UUID primary keys, separately from other models
+        """
+        now = timezone.now()
+        create_triage("+27820001001", now - timedelta(days=1))
+        latest = create_triage("+27820001001", now)
+        create_tbcheck("+27820001001", now + timedelta(days=1))
+
+        self.assertEqual(
+            list(EventIndex.objects.get_latest_events(Covid19Triage, ["+27820001001"])),
+            [latest],
+        )
+        self.assertTrue(EventIndex.objects.has_events(Covid19Triage, "+27820001001"))
+        self.assertFalse(EventIndex.objects.has_events(Covid19Triage, "+27820001002"))
+
+    def test_record_batch(self):
+        """
+        Should record a batch with more than one event for an msisdn, eg. from
+        bulk_create
+        """
+        now = timezone.now()
+        checks = TBCheck.objects.bulk_create(
+            TBCheck(
+                msisdn="+27820001001",
+                cough=False,
+                fever=False,
+                sweat=False,
+                weight=False,
+                tracing=True,
+                exposure=TBCheck.EXPOSURE_NO,
+                source="WhatsApp",
+                risk=TBCheck.RISK_LOW,
+                completed_timestamp=now - timedelta(days=i),
+            )
+            for i in range(3)
+        )
+
+        with self.assertNumQueries(1):
+            EventIndex.objects.record(checks)
+
+        index = EventIndex.objects.get(model="tbconnect.TBCheck", msisdn="+27820001001")
+        self.assertEqual(index.first_id, str(checks[2].id))
+        self.assertEqual(index.latest_id, str(checks[0].id))
+
+    def test_update(self):
+        """
+        Updating an event shouldn't move the pointers, unless its get_latest_by
+        changes
+        """
+        now = timezone.now()
+        latest = create_tbcheck("+27820001001", now)
+        earlier = create_tbcheck("+27820001001", now - timedelta(days=1))
+
+        earlier.risk = TBCheck.RISK_HIGH
+        earlier.save()
+
+        index = EventIndex.objects.get(model="tbconnect.TBCheck", msisdn="+27820001001")
+        self.assertEqual(index.latest_id, str(latest.id))
+
+        earlier.completed_timestamp = now + timedelta(days=1)
+        earlier.save()
+
+        index.refresh_from_db()
+        self.assertEqual(index.first_id, str(latest.id))
+        self.assertEqual(index.latest_id, str(earlier.id))
+        self.assertEqual(index.latest_timestamp, earlier.completed_timestamp)
+
+    def test_delete(self):
+        """
+        Deleting events, including with a queryset delete, should move the pointers
+        to the remaining events, and remove the row if there are none left
+        """
+        now = timezone.now()
+        first = create_triage("+27820001001", now - timedelta(days=2))
+        middle = create_triage("+27820001001", now - timedelta(days=1))
+        latest = create_triage("+27820001001", now)
+
+        first.delete()
+        self.assertEqual(
+            list(EventIndex.objects.get_first_events(Covid19Triage, ["+27820001001"])),
+            [middle],
+        )
+
+        Covid19Triage.objects.filter(pk=latest.pk).delete()
+        self.assertEqual(
+            list(EventIndex.objects.get_latest_events(Covid19Triage, ["+27820001001"])),
+            [middle],
+        )
+
+        Covid19Triage.objects.filter(msisdn="+27820001001").delete()
+        self.assertFalse(EventIndex.objects.has_events(Covid19Triage, "+27820001001"))
+
+    def test_integer_primary_key_ties(self):
+        """
+        Events with the same get_latest_by should be ordered by their primary key
+        values, not their string values, eg. 10 after 9
+        """
+        now = timezone.now()
+        checks = TBCheck.objects.bulk_create(
+            TBCheck(
+                id=i,
+                msisdn="+27820001001",
+                cough=False,
+                fever=False,
+                sweat=False,
+                weight=False,
+                tracing=True,
+                exposure=TBCheck.EXPOSURE_NO,
+                source="WhatsApp",
+                risk=TBCheck.RISK_LOW,
+                completed_timestamp=now,
+            )
+            for i in (9, 10)
+        )
+
+        EventIndex.objects.record(checks)
+
+        index = EventIndex.objects.get(model="tbconnect.TBCheck", msisdn="+27820001001")
+        self.assertEqual(index.first_id, "9")
+        self.assertEqual(index.latest_id, "10")
+
+        EventIndex.objects.rebuild(TBCheck, ["+27820001001"])
+
+        index = EventIndex.objects.get(model="tbconnect.TBCheck", msisdn="+27820001001")
+        self.assertEqual(index.first_id, "9")
+        self.assertEqual(index.latest_id, "10")
@@ -0,0 +1,91 @@
+from unittest.mock import patch
+
+import responses
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+from prometheus_client import REGISTRY
+
+from healthcheck import http
+from healthcheck.ratelimit import RateLimitExceeded, TokenBucket, get_rate_limit
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        get_redis_connection().delete("ratelimit:test")
+
+    def test_burst(self):
+        """
+        Should give out tokens up to the capacity, and then say how long to wait
+        """
+        bucket = TokenBucket("test", "2/s", capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5, delta=0.1)
+        self.assertAlmostEqual(
+            REGISTRY.get_sample_value("rate_limit_tokens", {"limit": "test"}),
+            0,
+            delta=0.2,
+        )
+
+    def test_shared(self):
+        """
+        Buckets with the same name should share their tokens
+        """
+        TokenBucket("test", "1/m").try_acquire()
+        self.assertGreater(TokenBucket("test", "1/m").try_acquire(), 50)
+
+    def test_acquire_waits(self):
+        """
+        Should wait for a token if there'll be one within the max wait
+        """
+        bucket = TokenBucket("test", "10/s", capacity=1)
+        bucket.acquire()
+        with patch("healthcheck.ratelimit.time.sleep") as mock_sleep:
+            with patch.object(bucket, "try_acquire", side_effect=[0.1, 0]):
+                bucket.acquire(max_wait=1)
+        mock_sleep.assert_called_once_with(0.1)
+
+    def test_acquire_exceeded(self):
+        """
+        Should raise RateLimitExceeded if there won't be a token within the max wait
+        """
+        bucket = TokenBucket("test", "1/m")
+        bucket.acquire()
+        with self.assertRaises(RateLimitExceeded) as e:
+            bucket.acquire(max_wait=1)
+        self.assertGreater(e.exception.retry_after, 50)
+
+    def test_pause(self):
+        """
+        Shouldn't give out tokens while it's paused
+        """
+        bucket = TokenBucket("test", "10/s")
+        bucket.pause(30)
+        self.assertAlmostEqual(bucket.try_acquire(), 30, delta=1)
+
+    @override_settings(RATE_LIMITS={"test": "60/m", "other": ""})
+    def test_get_rate_limit(self):
+        self.assertEqual(get_rate_limit("test").rate, 1)
+        self.assertIsNone(get_rate_limit("other"))
+        self.assertIsNone(get_rate_limit("missing"))
+
+
+@override_settings(RATE_LIMITS={"test": "10/s"})
+class SessionRateLimitTests(TestCase):
+    def setUp(self):
+        get_redis_connection().delete("ratelimit:test")
+
+    @responses.activate
+    def test_retry_after(self):
+        """
+        A 429 response should pause the rate limit for the Retry-After
+        """
+        responses.add(
+            responses.GET, "https://test/", status=429, headers={"Retry-After": "30"}
+        )
+
+        http.request("test", "get", "https://test/")
+
+        with self.assertRaises(RateLimitExceeded):
+            http.request("test", "get", "https://test/")
+        self.assertEqual(len(responses.calls), 1)
@@ -0,0 +1,230 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import call, patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone as django_timezone
+from django_celery_results.models import TaskResult
+from django_redis import get_redis_connection
+from prometheus_client import REGISTRY
+
+from healthcheck import tasks
+from healthcheck.models import ChangeLog
+from tbconnect.models import TBCheck, TBTest
+
+
+class SyncModelsToBigqueryInParallelTests(TestCase):
+    models = {
+        "checks": {
+            "model": TBCheck,
+            "field": "timestamp",
+            "fields": {"deduplication_id": "STRING"},
+        },
+        "tests": {
+            "model": TBTest,
+            "field": "updated_at",
+            "fields": {"deduplication_id": "STRING"},
+            "filter": {"key": "source", "value": "test"},
+        },
+    }
+
+    @patch("healthcheck.tasks.utils.sync_models_to_bigquery")
+    def test_sync_each_model(self, mock_sync_models_to_bigquery):
+        """
+        Should sync each of the models in a separate task
+        """
+        tasks.sync_models_to_bigquery_in_parallel(
+            "test_credentials.json", "project123.tbconnect", self.models
+        )
+
+        mock_sync_models_to_bigquery.assert_has_calls(
+            [
+                call(
+                    "test_credentials.json",
+                    "project123.tbconnect",
+                    {"checks": self.models["checks"]},
+                ),
+                call(
+                    "test_credentials.json",
+                    "project123.tbconnect",
+                    {"tests": self.models["tests"]},
+                ),
+            ],
+            any_order=True,
+        )
+
+    @patch("healthcheck.tasks.utils.sync_models_to_bigquery")
+    def test_skip_locked_model(self, mock_sync_models_to_bigquery):
+        """
+        Should skip a model that is already being synced, without holding up others
+        """
+        r = get_redis_connection()
+        with r.lock("sync_model_to_bigquery_project123.tbconnect.checks", 10):
+            tasks.sync_models_to_bigquery_in_parallel(
+                "test_credentials.json", "project123.tbconnect", self.models
+            )
+
+        mock_sync_models_to_bigquery.assert_called_once_with(
+            "test_credentials.json",
+            "project123.tbconnect",
+            {"tests": self.models["tests"]},
+        )
+
+    @patch("healthcheck.tasks.utils.sync_models_to_bigquery")
+    def test_skip_locked_model_metric(self, mock_sync_models_to_bigquery):
+        """
+        Should count the skipped runs for each table
+        """
+        labels = {"lease": "sync_model_to_bigquery_project123.tbconnect.checks"}
+        skips = REGISTRY.get_sample_value("lease_skips_total", labels) or 0
+
+        r = get_redis_connection()
+        with r.lock("sync_model_to_bigquery_project123.tbconnect.checks", 10):
+            tasks.sync_model_to_bigquery(
+                "test_credentials.json",
+                "project123.tbconnect",
+                "checks",
+                {**self.models["checks"], "model": "tbconnect.TBCheck"},
+            )
+
+        mock_sync_models_to_bigquery.assert_not_called()
+        self.assertEqual(
+            REGISTRY.get_sample_value("lease_skips_total", labels), skips + 1
+        )
+
+
+class BackfillModelInParallelTests(TestCase):
+    details = {
+        "model": TBCheck,
+        "field": "timestamp",
+        "fields": {"deduplication_id": "STRING"},
+    }
+
+    def tearDown(self):
+        get_redis_connection().delete("etl_backfill:project123.tbconnect.checks")
+
+    @patch("healthcheck.tasks.utils.backfill_model_to_bigquery")
+    def test_backfill_each_window(self, mock_backfill_model_to_bigquery):
+        """
+        Should export each window in a separate task
+        """
+        mock_backfill_model_to_bigquery.return_value = {}
+        windows = tasks.backfill_model_in_parallel(
+            "test_credentials.json",
+            "project123.tbconnect",
+            "checks",
+            self.details,
+            datetime(2021, 1, 1, tzinfo=timezone.utc),
+            datetime(2021, 1, 10, tzinfo=timezone.utc),
+            timedelta(days=7),
+        )
+
+        self.assertEqual(windows, 2)
+        mock_backfill_model_to_bigquery.assert_has_calls(
+            [
+                call(
+                    "test_credentials.json",
+                    "project123.tbconnect",
+                    "checks",
+                    self.details,
+                    datetime(2021, 1, 1, tzinfo=timezone.utc),
+                    datetime(2021, 1, 8, tzinfo=timezone.utc),
+                ),
+                call(
+                    "test_credentials.json",
+                    "project123.tbconnect",
+                    "checks",
+                    self.details,
+                    datetime(2021, 1, 8, tzinfo=timezone.utc),
+                    datetime(2021, 1, 10, tzinfo=timezone.utc),
+                ),
+            ]
+        )
+
+    @patch("healthcheck.tasks.utils.backfill_model_to_bigquery")
+    def test_skip_finished_window(self, mock_backfill_model_to_bigquery):
+        """
+        Should only export each window once
+        """
+        mock_backfill_model_to_bigquery.return_value = {"checks": {"rows": 3}}
+        args = (
+            "test_credentials.json",
+            "project123.tbconnect",
+            "checks",
+            {**self.details, "model": "tbconnect.TBCheck"},
+            "2021-01-01T00:00:00+00:00",
+            "2021-01-08T00:00:00+00:00",
+        )
+
+        self.assertEqual(
+            tasks.backfill_model_window(*args),
+            "Finished backfilling 3 rows to project123.tbconnect.checks from "
+            "2021-01-01T00:00:00+00:00 to 2021-01-08T00:00:00+00:00",
+        )
+        self.assertEqual(
+            tasks.backfill_model_window(*args),
+            "Already backfilled project123.tbconnect.checks from "
+            "2021-01-01T00:00:00+00:00 to 2021-01-08T00:00:00+00:00",
+        )
+        mock_backfill_model_to_bigquery.assert_called_once()
+
+    def test_acks_late(self):
+        """
+        Backfill windows should be redelivered if the worker dies, unlike the
+        periodic ETL, which picks up from its watermark on the next run
+        """
+        self.assertTrue(tasks.backfill_model_window.acks_late)
+        self.assertFalse(tasks.sync_model_to_bigquery.acks_late)
+
+
+class PruneTaskResultsTests(TestCase):
+    def create_task_result(self, task_id, days_ago):
+        result = TaskResult.objects.create(task_id=task_id, status="SUCCESS")
+        TaskResult.objects.filter(id=result.id).update(
+            date_done=django_timezone.now() - timedelta(days=days_ago)
+        )
+
+    @override_settings(TASK_RESULT_RETENTION_DAYS=7)
+    def test_prune_old_results(self):
+        """
+        Should delete the results older than the retention period, in batches
+        """
+        for i in range(5):
+            self.create_task_result(f"old-{i}", days_ago=8)
+        self.create_task_result("new", days_ago=1)
+
+        self.assertEqual(
+            tasks.prune_task_results(batch_size=2), "Deleted 5 task results"
+        )
+        self.assertEqual(
+            list(TaskResult.objects.values_list("task_id", flat=True)), ["new"]
+        )
+
+
+class PruneChangeLogTests(TestCase):
+    @override_settings(CHANGELOG_RETENTION_DAYS=7)
+    def test_prune_old_changes(self):
+        """
+        Should delete the change log entries older than the retention period, in
+        batches
+        """
+        for i in range(5):
+            ChangeLog.objects.create(model="tbconnect.TBTest", object_id=f"old-{i}")
+        ChangeLog.objects.update(timestamp=django_timezone.now() - timedelta(days=8))
+        ChangeLog.objects.create(model="tbconnect.TBTest", object_id="new")
+
+        self.assertEqual(
+            tasks.prune_changelog(batch_size=2), "Deleted 5 change log entries"
+        )
+        self.assertEqual(
+            list(ChangeLog.objects.values_list("object_id", flat=True)), ["new"]
+        )
+
+
+class TaskResultPolicyTests(TestCase):
+    def test_results_ignored_by_default(self):
+        """
+        Only the tasks that are annotated should store their results
+        """
+        self.assertTrue(tasks.prune_task_results.ignore_result)
+        self.assertFalse(tasks.sync_model_to_bigquery.ignore_result)
+        self.assertFalse(tasks.backfill_model_window.ignore_result)
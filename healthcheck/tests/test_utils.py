@@ -1,19 +1,50 @@
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock, patch
 
-from django.test import TestCase
+import fastavro
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+from google.api_core.exceptions import NotFound
+from prometheus_client import REGISTRY
 
 from healthcheck import utils
+from healthcheck.leases import LeaseLost
+from healthcheck.models import ChangeLog
 from selfswab.models import SelfSwabTest
 from tbconnect.models import TBTest
 
 
 class UtilsTests(TestCase):
+    def tearDown(self):
+        r = get_redis_connection()
+        for key in r.scan_iter("etl_watermark:*"):
+            r.delete(key)
+        for key in r.scan_iter("etl_backfill:*"):
+            r.delete(key)
+
     def test_hash_string(self):
         self.assertEqual(
             utils.hash_string("+27831231234"),
             "eIUHAUSFHvvZ2vpXxPJDwMZ2MuMPVpKOJHUeICFyQnE=",
         )
 
+    def test_extract_lat_long(self):
+        self.assertEqual(
+            utils.extract_lat_long("+40.21361-35.16361"), (40.21361, -35.16361)
+        )
+        self.assertEqual(utils.extract_lat_long(""), (None, None))
+        self.assertEqual(utils.extract_lat_long(None), (None, None))
+
+    def test_reduce_accuracy(self):
+        self.assertEqual(utils.reduce_accuracy(-35.16361, 2), -35.16)
+        self.assertEqual(utils.reduce_accuracy(-35.16361), -35.2)
+        self.assertIsNone(utils.reduce_accuracy(None))
+
     def test_extract_reduced_accuracy_lat_long(self):
         lat, long = utils.extract_reduced_accuracy_lat_long("+40.21361+35.16361", 2)
         self.assertEqual(lat, 40.21)
@@ -52,6 +83,178 @@ class UtilsTests(TestCase):
 
         self.assertEqual(data, [test.get_processed_data()])
 
+    def test_write_avro(self):
+        fields = {
+            "id": "STRING",
+            "lat": "FLOAT",
+            "cough": "BOOLEAN",
+            "timestamp": "TIMESTAMP",
+            "optout_timestamp": "TIMESTAMP",
+        }
+        data = [
+            {
+                "id": "abc",
+                "lat": -33.9,
+                "cough": True,
+                "timestamp": "2023-01-02T03:04:05.000006+00:00",
+                "optout_timestamp": None,
+            }
+        ]
+
+        f = io.BytesIO()
+        utils.write_avro(f, "tests", fields, data)
+        f.seek(0)
+        reader = fastavro.reader(f)
+
+        self.assertEqual(reader.codec, "deflate")
+        self.assertEqual(
+            list(reader),
+            [
+                {
+                    "id": "abc",
+                    "lat": -33.9,
+                    "cough": True,
+                    "timestamp": datetime(2023, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+                    "optout_timestamp": None,
+                }
+            ],
+        )
+        # The rows that were passed in shouldn't change
+        self.assertEqual(data[0]["timestamp"], "2023-01-02T03:04:05.000006+00:00")
+
+    def test_upload_to_bigquery(self):
+        fake_bigquery_client = Mock()
+        data = [{"id": "abc"}]
+
+        utils.upload_to_bigquery(
+            fake_bigquery_client,
+            "project123.tbconnect",
+            "tests",
+            {"id": "STRING"},
+            data,
+        )
+
+        [(args, kwargs)] = fake_bigquery_client.load_table_from_json.call_args_list
+        self.assertEqual(args, (data, "project123.tbconnect.tests"))
+        self.assertEqual(kwargs["job_config"].source_format, "NEWLINE_DELIMITED_JSON")
+        fake_bigquery_client.load_table_from_json.return_value.result.assert_called()
+
+    @override_settings(ETL_SOURCE_FORMAT="AVRO", ETL_STAGING_STORAGE_PATH="etl")
+    @patch("healthcheck.utils.default_storage")
+    def test_upload_to_bigquery_avro(self, mock_default_storage):
+        fake_bigquery_client = Mock()
+
+        def load_table_from_file(f, destination, rewind, job_config):
+            f.seek(0)
+            self.assertEqual(list(fastavro.reader(f)), [{"id": "abc"}])
+            return Mock()
+
+        fake_bigquery_client.load_table_from_file.side_effect = load_table_from_file
+
+        utils.upload_to_bigquery(
+            fake_bigquery_client,
+            "project123.tbconnect",
+            "tests",
+            {"id": "STRING"},
+            [{"id": "abc"}],
+        )
+
+        [(args, kwargs)] = fake_bigquery_client.load_table_from_file.call_args_list
+        self.assertEqual(args[1], "project123.tbconnect.tests")
+        self.assertTrue(kwargs["rewind"])
+        self.assertEqual(kwargs["job_config"].source_format, "AVRO")
+        self.assertTrue(kwargs["job_config"].use_avro_logical_types)
+        fake_bigquery_client.load_table_from_json.assert_not_called()
+
+        [(path, content), _] = mock_default_storage.save.call_args
+        self.assertTrue(path.startswith("etl/project123.tbconnect/tests/"))
+        self.assertTrue(path.endswith(".avro"))
+        self.assertEqual(
+            list(fastavro.reader(io.BytesIO(content.read()))), [{"id": "abc"}]
+        )
+
+    def test_export_spec(self):
+        spec = utils.ExportSpec(
+            id=("STRING", str),
+            msisdn=("STRING", utils.hash_string),
+            source="STRING",
+            latitude=("FLOAT", utils.reduce_accuracy, "location_latitude"),
+            longitude=("FLOAT", utils.reduce_accuracy, "location_longitude"),
+        )
+
+        self.assertEqual(
+            spec.fields,
+            {
+                "id": "STRING",
+                "msisdn": "STRING",
+                "source": "STRING",
+                "latitude": "FLOAT",
+                "longitude": "FLOAT",
+            },
+        )
+        self.assertEqual(
+            spec.sources,
+            ["id", "msisdn", "source", "location_latitude", "location_longitude"],
+        )
+        self.assertEqual(
+            spec.process_rows(
+                [
+                    (1, "+27831231234", "test", 40.21361, -35.16361),
+                    (2, "+123", "", None, None),
+                ]
+            ),
+            [
+                {
+                    "id": "1",
+                    "msisdn": "eIUHAUSFHvvZ2vpXxPJDwMZ2MuMPVpKOJHUeICFyQnE=",
+                    "source": "test",
+                    "latitude": 40.2,
+                    "longitude": -35.2,
+                },
+                {
+                    "id": "2",
+                    "msisdn": "GyReRepLLYF5Ldr6IyA1mu8VM96Et16I0TFIyDvRmK4=",
+                    "source": "",
+                    "latitude": None,
+                    "longitude": None,
+                },
+            ],
+        )
+
+    @override_settings(ETL_TRANSFORM_PROCESSES=2)
+    def test_export_spec_process_pool(self):
+        spec = utils.ExportSpec(
+            msisdn=("STRING", utils.hash_string), timestamp=("TIMESTAMP", str)
+        )
+        rows = [(f"+27831231{i:03}", i) for i in range(5)]
+
+        with ProcessPoolExecutor(2) as executor:
+            data = spec.process_rows(rows, executor)
+
+        self.assertEqual(data, spec.process_rows(rows))
+
+    @override_settings(ETL_TRANSFORM_PROCESSES=2)
+    @patch("healthcheck.utils.multiprocessing.current_process")
+    @patch("healthcheck.utils.ProcessPoolExecutor")
+    def test_export_batches_daemon(self, mock_executor, mock_current_process):
+        """
+        Shouldn't start a process pool in a daemonic process, eg. a prefork worker
+        """
+        mock_current_process.return_value.daemon = True
+        TBTest.objects.create(msisdn="+123", source="test", result="pending")
+
+        [(data, _)] = utils.get_export_batches(
+            TBTest.objects.all(), "updated_at", batch_size=10
+        )
+
+        mock_executor.assert_not_called()
+        self.assertEqual(len(data), 1)
+
+    def test_get_batches(self):
+        self.assertEqual(list(utils.get_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(utils.get_batches(range(4), 2)), [[0, 1], [2, 3]])
+        self.assertEqual(list(utils.get_batches([], 2)), [])
+
     @patch("healthcheck.utils.upload_to_bigquery")
     @patch("healthcheck.utils.get_latest_bigquery_timestamp")
     @patch("healthcheck.utils.get_bigquery_client")
@@ -69,6 +272,7 @@ class UtilsTests(TestCase):
 
         fake_bigquery_client = Mock()
         mock_get_bigquery_client.return_value = fake_bigquery_client
+        mock_upload_to_bigquery.return_value.input_file_bytes = 100
         mock_get_latest_bigquery_timestamp.return_value = None
 
         models = {
@@ -123,6 +327,7 @@ class UtilsTests(TestCase):
 
         fake_bigquery_client = Mock()
         mock_get_bigquery_client.return_value = fake_bigquery_client
+        mock_upload_to_bigquery.return_value.input_file_bytes = 100
         mock_get_latest_bigquery_timestamp.return_value = None
 
         models = {
@@ -146,3 +351,542 @@ class UtilsTests(TestCase):
             models["tests"]["fields"],
             [test2.get_processed_data()],
         )
+
+    @override_settings(ETL_BATCH_SIZE=2)
+    @patch("healthcheck.utils.upload_to_bigquery")
+    @patch("healthcheck.utils.get_latest_bigquery_timestamp")
+    @patch("healthcheck.utils.get_bigquery_client")
+    def test_sync_models_to_bigquery_batches(
+        self,
+        mock_get_bigquery_client,
+        mock_get_latest_bigquery_timestamp,
+        mock_upload_to_bigquery,
+    ):
+        tests = [
+            TBTest.objects.create(
+                **{"msisdn": "+123", "source": "test", "result": TBTest.RESULT_PENDING}
+            )
+            for _ in range(3)
+        ]
+
+        dataset = "project123.tbconnect"
+
+        fake_bigquery_client = Mock()
+        mock_get_bigquery_client.return_value = fake_bigquery_client
+        mock_upload_to_bigquery.return_value.input_file_bytes = 100
+        mock_get_latest_bigquery_timestamp.return_value = None
+
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "fields": {"deduplication_id": "STRING"},
+            },
+        }
+
+        utils.sync_models_to_bigquery("test_credentials.json", dataset, models)
+
+        self.assertEqual(mock_upload_to_bigquery.call_count, 2)
+        [call1, call2] = mock_upload_to_bigquery.call_args_list
+        self.assertEqual(call1.args[4], [t.get_processed_data() for t in tests[:2]])
+        self.assertEqual(call2.args[4], [tests[2].get_processed_data()])
+
+    @patch("healthcheck.utils.get_latest_bigquery_timestamp")
+    def test_get_etl_watermark(self, mock_get_latest_bigquery_timestamp):
+        """
+        Should seed the watermark from BigQuery, and then use the stored value
+        """
+        fake_bigquery_client = Mock()
+        timestamp = datetime(2023, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc)
+        mock_get_latest_bigquery_timestamp.return_value = timestamp
+
+        args = (fake_bigquery_client, "project123.tbconnect", "tests", "updated_at")
+        self.assertEqual(utils.get_etl_watermark(*args), timestamp)
+        self.assertEqual(utils.get_etl_watermark(*args), timestamp)
+        mock_get_latest_bigquery_timestamp.assert_called_once_with(*args)
+
+        utils.reset_etl_watermark("project123.tbconnect", "tests")
+        self.assertEqual(utils.get_etl_watermark(*args), timestamp)
+        self.assertEqual(mock_get_latest_bigquery_timestamp.call_count, 2)
+
+    def test_get_latest_bigquery_timestamp_new_table(self):
+        """
+        Should return None if the table hasn't been created yet
+        """
+        client = Mock()
+        client.query.return_value.result.side_effect = NotFound("Not found: Table")
+        self.assertIsNone(
+            utils.get_latest_bigquery_timestamp(
+                client, "project123.tbconnect", "profiles", "updated_at"
+            )
+        )
+
+    @patch("healthcheck.utils.get_latest_bigquery_timestamp")
+    def test_get_etl_watermark_empty_table(self, mock_get_latest_bigquery_timestamp):
+        """
+        Should not store a watermark if there is no data in BigQuery
+        """
+        mock_get_latest_bigquery_timestamp.return_value = None
+
+        args = (Mock(), "project123.tbconnect", "tests", "updated_at")
+        self.assertIsNone(utils.get_etl_watermark(*args))
+        self.assertIsNone(utils.get_etl_watermark(*args))
+        self.assertEqual(mock_get_latest_bigquery_timestamp.call_count, 2)
+
+    @patch("healthcheck.utils.upload_to_bigquery")
+    @patch("healthcheck.utils.get_latest_bigquery_timestamp")
+    @patch("healthcheck.utils.get_bigquery_client")
+    def test_sync_models_to_bigquery_updates_watermark(
+        self,
+        mock_get_bigquery_client,
+        mock_get_latest_bigquery_timestamp,
+        mock_upload_to_bigquery,
+    ):
+        """
+        Should advance the watermark after each upload, and only export newer rows
+        """
+        test1 = TBTest.objects.create(
+            **{"msisdn": "+123", "source": "test", "result": TBTest.RESULT_PENDING}
+        )
+
+        dataset = "project123.tbconnect"
+
+        mock_get_bigquery_client.return_value = Mock()
+        mock_upload_to_bigquery.return_value.input_file_bytes = 100
+        mock_get_latest_bigquery_timestamp.return_value = None
+
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "fields": {"deduplication_id": "STRING"},
+            },
+        }
+
+        utils.sync_models_to_bigquery("test_credentials.json", dataset, models)
+        self.assertEqual(
+            utils.get_etl_watermark(Mock(), dataset, "tests", "updated_at"),
+            test1.updated_at,
+        )
+
+        test2 = TBTest.objects.create(
+            **{"msisdn": "+124", "source": "test", "result": TBTest.RESULT_PENDING}
+        )
+        utils.sync_models_to_bigquery("test_credentials.json", dataset, models)
+
+        mock_get_latest_bigquery_timestamp.assert_called_once()
+        mock_upload_to_bigquery.assert_called_with(
+            mock_get_bigquery_client.return_value,
+            dataset,
+            "tests",
+            models["tests"]["fields"],
+            [test2.get_processed_data()],
+        )
+        self.assertEqual(
+            utils.get_etl_watermark(Mock(), dataset, "tests", "updated_at"),
+            test2.updated_at,
+        )
+
+    def test_sync_models_to_bigquery_local_sink(self):
+        """
+        Should write the batches and watermark to files when using the local sink
+        """
+        tests = [
+            TBTest.objects.create(
+                **{"msisdn": "+123", "source": "test", "result": TBTest.RESULT_PENDING}
+            )
+            for _ in range(3)
+        ]
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "fields": TBTest.export_spec.fields,
+                "batch_size": 2,
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            with override_settings(ETL_SINK="local", ETL_LOCAL_SINK_PATH=path):
+                stats = utils.sync_models_to_bigquery(
+                    "test_credentials.json", "project123.tbconnect", models
+                )
+                self.assertEqual(stats["tests"]["rows"], 3)
+                self.assertEqual(stats["tests"]["batches"], 2)
+
+                directory = os.path.join(path, "project123.tbconnect", "tests")
+                filenames = sorted(os.listdir(directory))
+                self.assertEqual(len(filenames), 2)
+                self.assertTrue(filenames[0].endswith("-000000.json"))
+                self.assertTrue(filenames[1].endswith("-000001.json"))
+                with open(os.path.join(directory, filenames[1])) as f:
+                    self.assertEqual(
+                        [json.loads(line) for line in f],
+                        [tests[2].get_processed_data()],
+                    )
+
+                sink = utils.LocalSink(path, "project123.tbconnect")
+                self.assertEqual(
+                    sink.get_watermark("tests", "updated_at"), tests[2].updated_at
+                )
+
+                stats = utils.sync_models_to_bigquery(
+                    "test_credentials.json", "project123.tbconnect", models
+                )
+                self.assertEqual(stats, {})
+
+    @patch("healthcheck.utils.check_lease")
+    def test_sync_models_to_bigquery_lease_lost(self, mock_check_lease):
+        """
+        Should stop between batches if the lease was lost, keeping the watermark of
+        the batches that were loaded
+        """
+        mock_check_lease.side_effect = [None, LeaseLost("sync")]
+        tests = [
+            TBTest.objects.create(
+                **{"msisdn": "+123", "source": "test", "result": TBTest.RESULT_PENDING}
+            )
+            for _ in range(3)
+        ]
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "fields": TBTest.export_spec.fields,
+                "batch_size": 2,
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            with override_settings(ETL_SINK="local", ETL_LOCAL_SINK_PATH=path):
+                with self.assertRaises(LeaseLost):
+                    utils.sync_models_to_bigquery(
+                        "test_credentials.json", "project123.tbconnect", models
+                    )
+
+                directory = os.path.join(path, "project123.tbconnect", "tests")
+                self.assertEqual(len(os.listdir(directory)), 1)
+                sink = utils.LocalSink(path, "project123.tbconnect")
+                self.assertEqual(
+                    sink.get_watermark("tests", "updated_at"), tests[1].updated_at
+                )
+
+    def test_sync_models_to_bigquery_changelog(self):
+        """
+        Should export the rows that were created or updated since the last change
+        that was exported, once per batch
+        """
+        test1 = TBTest.objects.create(
+            msisdn="+123", source="test", result=TBTest.RESULT_PENDING
+        )
+        test2 = TBTest.objects.create(
+            msisdn="+123", source="test", result=TBTest.RESULT_PENDING
+        )
+        test1.result = TBTest.RESULT_POSITIVE
+        test1.save()
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "changelog": True,
+                "fields": TBTest.export_spec.fields,
+                "changelog_lag": 0,
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            sink.set_watermark("tests", 0)
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "project123.tbconnect", models, sink=sink
+            )
+            self.assertEqual(stats["tests"]["rows"], 2)
+            with open(sink.get_filename("tests", 0)) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(
+                rows, [test1.get_processed_data(), test2.get_processed_data()]
+            )
+            self.assertEqual(rows[0]["result"], "positive")
+            self.assertEqual(
+                sink.get_watermark("tests", "updated_at"), ChangeLog.objects.last().id
+            )
+
+            # Only the updated row should be exported on the next run
+            test2.result = TBTest.RESULT_NEGATIVE
+            test2.save()
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "project123.tbconnect", models, sink=sink
+            )
+            self.assertEqual(stats["tests"]["rows"], 1)
+
+    def test_sync_models_to_bigquery_changelog_filter(self):
+        """
+        Should only export the changed rows that match the model's filter
+        """
+        test1 = TBTest.objects.create(
+            msisdn="+123", source="test", result=TBTest.RESULT_PENDING
+        )
+        TBTest.objects.create(
+            msisdn="+123", source="other", result=TBTest.RESULT_PENDING
+        )
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "changelog": True,
+                "fields": TBTest.export_spec.fields,
+                "changelog_lag": 0,
+                "filter": {"key": "source", "value": "test"},
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            sink.set_watermark("tests", 0)
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "project123.tbconnect", models, sink=sink
+            )
+            self.assertEqual(stats["tests"]["rows"], 1)
+            with open(sink.get_filename("tests", 0)) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(rows, [test1.get_processed_data()])
+            self.assertEqual(
+                sink.get_watermark("tests", "updated_at"), ChangeLog.objects.last().id
+            )
+
+    def test_sync_models_to_bigquery_metrics(self):
+        """
+        Should record the rows and bytes exported, and the age of the watermark
+        """
+        TBTest.objects.create(msisdn="+123", source="test", result="pending")
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "changelog": True,
+                "fields": TBTest.export_spec.fields,
+                "changelog_lag": 0,
+            },
+        }
+        labels = {"dataset": "metrics.tbconnect", "table": "tests"}
+
+        def get_sample(name):
+            return REGISTRY.get_sample_value(name, labels) or 0
+
+        rows = get_sample("etl_rows_exported_total")
+        uploaded_bytes = get_sample("etl_bytes_uploaded_total")
+        loads = get_sample("etl_load_duration_seconds_count")
+
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "metrics.tbconnect")
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "metrics.tbconnect", models, sink=sink
+            )
+
+        self.assertEqual(get_sample("etl_rows_exported_total"), rows + 1)
+        self.assertEqual(
+            get_sample("etl_bytes_uploaded_total"),
+            uploaded_bytes + stats["tests"]["bytes"],
+        )
+        self.assertGreater(stats["tests"]["bytes"], 0)
+        self.assertEqual(get_sample("etl_load_duration_seconds_count"), loads + 1)
+        self.assertLess(get_sample("etl_watermark_age_seconds"), 60)
+
+    def test_sync_models_to_bigquery_changelog_lag(self):
+        """
+        Should leave changes that are newer than the lag for the next run
+        """
+        TBTest.objects.create(msisdn="+123", source="test", result="pending")
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "changelog": True,
+                "fields": TBTest.export_spec.fields,
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            sink.set_watermark("tests", 0)
+            with override_settings(ETL_CHANGELOG_LAG=60):
+                stats = utils.sync_models_to_bigquery(
+                    "test_credentials.json", "project123.tbconnect", models, sink=sink
+                )
+            self.assertEqual(stats, {})
+            self.assertEqual(sink.get_watermark("tests", "updated_at"), 0)
+
+    def test_sync_models_to_bigquery_changelog_timestamp_watermark(self):
+        """
+        If the table was previously exported by timestamp, should export the rows
+        after that timestamp, and then continue from the change log
+        """
+        old = TBTest.objects.create(msisdn="+123", source="test", result="pending")
+        TBTest.objects.filter(pk=old.pk).update(
+            updated_at=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        )
+        new = TBTest.objects.create(msisdn="+123", source="test", result="pending")
+        # The change log may not go back as far as the watermark
+        ChangeLog.objects.all().delete()
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "changelog": True,
+                "fields": TBTest.export_spec.fields,
+                "changelog_lag": 0,
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            sink.set_watermark("tests", datetime(2021, 1, 1, tzinfo=timezone.utc))
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "project123.tbconnect", models, sink=sink
+            )
+            self.assertEqual(stats["tests"]["rows"], 1)
+            with open(sink.get_filename("tests", 0)) as f:
+                [row] = [json.loads(line) for line in f]
+            self.assertEqual(row["deduplication_id"], str(new.deduplication_id))
+            self.assertEqual(sink.get_watermark("tests", "updated_at"), 0)
+
+            # The next run should export the changes since the catch up
+            new.result = TBTest.RESULT_NEGATIVE
+            new.save()
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "project123.tbconnect", models, sink=sink
+            )
+            self.assertEqual(stats["tests"]["rows"], 1)
+            self.assertEqual(
+                sink.get_watermark("tests", "updated_at"), ChangeLog.objects.last().id
+            )
+
+    def test_sync_models_to_bigquery_changelog_initial_load(self):
+        """
+        If the table hasn't been exported yet, should export all of its rows, and
+        then continue from the change log
+        """
+        tests = [
+            TBTest.objects.create(msisdn="+123", source="test", result="pending")
+            for _ in range(3)
+        ]
+        ChangeLog.objects.filter(object_id=str(tests[0].pk)).delete()
+        models = {
+            "tests": {
+                "model": TBTest,
+                "field": "updated_at",
+                "changelog": True,
+                "fields": TBTest.export_spec.fields,
+                "changelog_lag": 0,
+                "batch_size": 2,
+            },
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            stats = utils.sync_models_to_bigquery(
+                "test_credentials.json", "project123.tbconnect", models, sink=sink
+            )
+            self.assertEqual(stats["tests"]["rows"], 3)
+            self.assertEqual(stats["tests"]["batches"], 2)
+            self.assertEqual(
+                sink.get_watermark("tests", "updated_at"), ChangeLog.objects.last().id
+            )
+
+    def test_changelog_watermark_redis(self):
+        """
+        Should store change log ids as watermarks, without querying BigQuery
+        """
+        client = Mock()
+        utils.set_etl_watermark("dataset", "tests", 123)
+        self.assertEqual(
+            utils.get_etl_watermark(client, "dataset", "tests", "updated_at"), 123
+        )
+        client.query.assert_not_called()
+
+    def test_get_backfill_windows(self):
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(
+            utils.get_backfill_windows(
+                start, datetime(2021, 1, 20, tzinfo=timezone.utc), timedelta(days=7)
+            ),
+            [
+                (start, datetime(2021, 1, 8, tzinfo=timezone.utc)),
+                (
+                    datetime(2021, 1, 8, tzinfo=timezone.utc),
+                    datetime(2021, 1, 15, tzinfo=timezone.utc),
+                ),
+                (
+                    datetime(2021, 1, 15, tzinfo=timezone.utc),
+                    datetime(2021, 1, 20, tzinfo=timezone.utc),
+                ),
+            ],
+        )
+        self.assertEqual(utils.get_backfill_windows(start, start, timedelta(1)), [])
+
+    def test_backfill_model_to_bigquery(self):
+        """
+        Should export only the rows in the window, without changing the watermark
+        """
+        tests = [
+            TBTest.objects.create(
+                msisdn="+123",
+                source="test",
+                result="pending",
+                timestamp=datetime(2021, 1, day, tzinfo=timezone.utc),
+            )
+            for day in (1, 2, 3)
+        ]
+        details = {
+            "model": TBTest,
+            "field": "timestamp",
+            "fields": TBTest.export_spec.fields,
+        }
+
+        with tempfile.TemporaryDirectory() as path:
+            with override_settings(ETL_SINK="local", ETL_LOCAL_SINK_PATH=path):
+                stats = utils.backfill_model_to_bigquery(
+                    "test_credentials.json",
+                    "project123.tbconnect",
+                    "tests",
+                    details,
+                    datetime(2021, 1, 2, tzinfo=timezone.utc),
+                    datetime(2021, 1, 3, tzinfo=timezone.utc),
+                )
+                self.assertEqual(stats["tests"]["rows"], 1)
+
+                directory = os.path.join(path, "project123.tbconnect", "tests")
+                [filename] = os.listdir(directory)
+                self.assertTrue(filename.startswith("20210102T000000-"))
+                sink = utils.LocalSink(path, "project123.tbconnect")
+                with open(os.path.join(directory, filename)) as f:
+                    self.assertEqual(
+                        [json.loads(line) for line in f],
+                        [tests[1].get_processed_data()],
+                    )
+                self.assertIsNone(sink.get_watermark("tests", "timestamp"))
+
+    def test_local_sink_runs(self):
+        """
+        Each run should write its own files, instead of overwriting the last run's
+        """
+        with tempfile.TemporaryDirectory() as path:
+            for _ in range(2):
+                sink = utils.LocalSink(path, "project123.tbconnect")
+                sink.load_batch("tests", {"id": "STRING"}, [{"id": "abc"}])
+
+            self.assertEqual(
+                len(os.listdir(os.path.join(path, "project123.tbconnect", "tests"))), 2
+            )
+
+    @override_settings(ETL_SOURCE_FORMAT="AVRO")
+    def test_local_sink_avro(self):
+        with tempfile.TemporaryDirectory() as path:
+            sink = utils.LocalSink(path, "project123.tbconnect")
+            sink.load_batch("tests", {"id": "STRING"}, [{"id": "abc"}])
+
+            with open(sink.get_filename("tests", 0), "rb") as f:
+                self.assertEqual(list(fastavro.reader(f)), [{"id": "abc"}])
+            self.assertEqual(sink.get_stats()["tests"]["rows"], 1)
@@ -1,13 +1,34 @@
 import base64
 import hashlib
+import io
+import json
 import os
 import datetime
+import math
+import multiprocessing
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from functools import lru_cache
+from itertools import chain, islice
 
+import fastavro
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from google.oauth2 import service_account
 from iso6709 import Location
 
+from healthcheck import metrics
+from healthcheck.leases import check_lease
+from healthcheck.models import ChangeLog
+
 
 @lru_cache(maxsize=None)
 def get_bigquery_client(key_path):
@@ -24,60 +45,542 @@ def get_bigquery_client(key_path):
 
 
 def get_latest_bigquery_timestamp(bigquery_client, dataset, model, field):
+    """
+    Returns the latest value of field in the table, or None if the table is empty,
+    or doesn't exist yet, eg. for a new table that is created by its first load
+    """
     query = f"SELECT MAX({field}) AS ts FROM {dataset}.{model}"
 
     job_config = bigquery.QueryJobConfig()
     job_config.use_legacy_sql = False
 
-    query_job = bigquery_client.query(query, location="EU", job_config=job_config)
-    test = list(query_job.result())
+    try:
+        query_job = bigquery_client.query(query, location="EU", job_config=job_config)
+        test = list(query_job.result())
+    except NotFound:
+        return None
     return test[0][0]
 
 
-def upload_to_bigquery(bigquery_client, dataset, table, fields, data):
+def get_etl_watermark_key(dataset, table):
+    return f"etl_watermark:{dataset}.{table}"
+
+
+def get_etl_watermark(bigquery_client, dataset, table, field):
+    """
+    Gets the latest exported value of field from redis. Only queries BigQuery if
+    there is no stored watermark, and stores the result for the next run
+    """
+    r = get_redis_connection()
+    watermark = r.get(get_etl_watermark_key(dataset, table))
+    if watermark:
+        return parse_etl_watermark(watermark.decode("utf-8"))
+
+    watermark = get_latest_bigquery_timestamp(bigquery_client, dataset, table, field)
+    if watermark:
+        set_etl_watermark(dataset, table, watermark)
+    return watermark
+
+
+def set_etl_watermark(dataset, table, watermark):
+    r = get_redis_connection()
+    r.set(get_etl_watermark_key(dataset, table), format_etl_watermark(watermark))
+
+
+def format_etl_watermark(watermark):
+    """
+    Watermarks are either timestamps, or change log ids
+    """
+    if isinstance(watermark, int):
+        return str(watermark)
+    return watermark.isoformat()
+
+
+def parse_etl_watermark(value):
+    if value.isdigit():
+        return int(value)
+    return parse_datetime(value)
+
+
+def reset_etl_watermark(dataset, table):
+    """
+    Removes the stored watermark, so that the next run reseeds it from BigQuery
+    """
+    r = get_redis_connection()
+    r.delete(get_etl_watermark_key(dataset, table))
+
+
+AVRO_TYPES = {
+    "STRING": "string",
+    "INTEGER": "long",
+    "FLOAT": "double",
+    "BOOLEAN": "boolean",
+    "TIMESTAMP": {"type": "long", "logicalType": "timestamp-micros"},
+}
+
+
+def get_avro_schema(table, fields):
+    return fastavro.parse_schema(
+        {
+            "type": "record",
+            "name": table,
+            "fields": [
+                {"name": field, "type": ["null", AVRO_TYPES[data_type]]}
+                for field, data_type in fields.items()
+            ],
+        }
+    )
+
+
+def write_avro(fileobj, table, fields, data):
+    """
+    Writes the processed data to fileobj as a deflate compressed Avro file, typed
+    using the BigQuery fields. The rows are converted into new dicts, so that the
+    caller's data isn't changed.
+    """
+    timestamp_fields = [
+        f for f, data_type in fields.items() if data_type == "TIMESTAMP"
+    ]
+
+    def records():
+        for row in data:
+            converted = {}
+            for field in timestamp_fields:
+                if isinstance(row.get(field), str):
+                    converted[field] = datetime.datetime.fromisoformat(row[field])
+            yield {**row, **converted}
+
+    fastavro.writer(fileobj, get_avro_schema(table, fields), records(), codec="deflate")
+
+
+def upload_to_bigquery(
+    bigquery_client, dataset, table, fields, data, source_format=None
+):
+    source_format = source_format or settings.ETL_SOURCE_FORMAT
+
     schema = []
     for field, data_type in fields.items():
         schema.append(bigquery.SchemaField(field, data_type))
 
     job_config = bigquery.LoadJobConfig(
-        source_format="NEWLINE_DELIMITED_JSON",
+        source_format=source_format,
         write_disposition="WRITE_APPEND",
         schema=schema,
     )
 
+    if source_format == "AVRO":
+        job_config.use_avro_logical_types = True
+        with io.BytesIO() as f:
+            write_avro(f, table, fields, data)
+            if settings.ETL_STAGING_STORAGE_PATH:
+                default_storage.save(
+                    f"{settings.ETL_STAGING_STORAGE_PATH}/{dataset}/{table}/"
+                    f"{uuid.uuid4()}.avro",
+                    ContentFile(f.getvalue()),
+                )
+            job = bigquery_client.load_table_from_file(
+                f, f"{dataset}.{table}", rewind=True, job_config=job_config
+            )
+            return job.result()
+
     job = bigquery_client.load_table_from_json(
         data, f"{dataset}.{table}", job_config=job_config
     )
 
-    job.result()
+    return job.result()
 
 
-def sync_models_to_bigquery(key_path, dataset, models):
-    bigquery_client = get_bigquery_client(key_path)
-    if bigquery_client:
-        for model, details in models.items():
-            field = details["field"]
-            latest_timestamp = get_latest_bigquery_timestamp(
-                bigquery_client, dataset, model, field
-            )
+class Sink:
+    """
+    Somewhere to load the ETL batches into. Subclasses implement getting and
+    setting the watermarks, and serializing and uploading a batch into a table.
+
+    The stats record the rows and batches loaded for each table, as well as the
+    time spent in each stage of the ETL: querying the database, transforming the
+    rows, serializing the batch, and uploading it.
+    """
+
+    STAGES = ("query", "transform", "serialize", "upload")
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.stats = defaultdict(
+            lambda: {
+                "rows": 0,
+                "batches": 0,
+                "bytes": 0,
+                **{f"{stage}_seconds": 0 for stage in self.STAGES},
+            }
+        )
 
-            if latest_timestamp:
-                records = details["model"].objects.filter(
-                    **{f"{field}__gt": latest_timestamp}
+    def is_available(self):
+        return True
+
+    def get_watermark(self, table, field):
+        raise NotImplementedError()
+
+    def set_watermark(self, table, watermark):
+        raise NotImplementedError()
+
+    def load_batch(self, table, fields, data):
+        start = time.monotonic()
+        payload = self._serialize(table, fields, data)
+        serialized = time.monotonic()
+        uploaded_bytes = self._upload(table, fields, payload)
+        end = time.monotonic()
+        self.stats[table]["rows"] += len(data)
+        self.stats[table]["batches"] += 1
+        self.stats[table]["bytes"] += uploaded_bytes
+        self.stats[table]["serialize_seconds"] += serialized - start
+        self.stats[table]["upload_seconds"] += end - serialized
+
+        labels = {"dataset": self.dataset, "table": table}
+        metrics.ETL_ROWS.labels(**labels).inc(len(data))
+        metrics.ETL_BYTES.labels(**labels).inc(uploaded_bytes)
+        metrics.ETL_LOAD_DURATION.labels(**labels).observe(end - start)
+
+    def _serialize(self, table, fields, data):
+        return data
+
+    def _upload(self, table, fields, payload):
+        """
+        Uploads the serialized batch, and returns the number of bytes uploaded
+        """
+        raise NotImplementedError()
+
+    def get_stats(self):
+        return {table: stats for table, stats in self.stats.items() if stats["batches"]}
+
+
+class BigQuerySink(Sink):
+    """
+    Loads batches into BigQuery, keeping the watermarks in redis
+    """
+
+    def __init__(self, key_path, dataset):
+        super().__init__(dataset)
+        self.client = get_bigquery_client(key_path)
+
+    def is_available(self):
+        return self.client is not None
+
+    def get_watermark(self, table, field):
+        return get_etl_watermark(self.client, self.dataset, table, field)
+
+    def set_watermark(self, table, watermark):
+        set_etl_watermark(self.dataset, table, watermark)
+
+    def _upload(self, table, fields, payload):
+        # The client serializes the batch as part of the load, so it's counted as
+        # upload time
+        job = upload_to_bigquery(self.client, self.dataset, table, fields, payload)
+        return job.input_file_bytes or 0
+
+
+class LocalSink(Sink):
+    """
+    Writes batches to files under ETL_LOCAL_SINK_PATH instead of BigQuery, so that
+    the ETL can be run and measured without GCP. Each batch is written as a
+    NEWLINE_DELIMITED_JSON or AVRO file, depending on ETL_SOURCE_FORMAT, and the
+    watermarks are kept in files next to them.
+
+    The files are named for the run, after the prefix, so that runs, and backfill
+    windows that are exported in parallel, don't overwrite each other's files.
+    """
+
+    def __init__(self, path, dataset, prefix=""):
+        super().__init__(dataset)
+        self.path = os.path.join(path, dataset)
+        self.run = f"{prefix}{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.path, exist_ok=True)
+
+    def _get_watermark_path(self, table):
+        return os.path.join(self.path, f"{table}.watermark")
+
+    def get_watermark(self, table, field):
+        try:
+            with open(self._get_watermark_path(table)) as f:
+                return parse_etl_watermark(f.read())
+        except FileNotFoundError:
+            return None
+
+    def set_watermark(self, table, watermark):
+        with open(self._get_watermark_path(table), "w") as f:
+            f.write(format_etl_watermark(watermark))
+
+    def _serialize(self, table, fields, data):
+        f = io.BytesIO()
+        if settings.ETL_SOURCE_FORMAT == "AVRO":
+            write_avro(f, table, fields, data)
+        else:
+            for row in data:
+                f.write(json.dumps(row).encode())
+                f.write(b"\n")
+        return f.getvalue()
+
+    def get_filename(self, table, batch):
+        extension = "avro" if settings.ETL_SOURCE_FORMAT == "AVRO" else "json"
+        return os.path.join(self.path, table, f"{self.run}-{batch:06}.{extension}")
+
+    def _upload(self, table, fields, payload):
+        os.makedirs(os.path.join(self.path, table), exist_ok=True)
+        filename = self.get_filename(table, self.stats[table]["batches"])
+        with open(filename, "wb") as f:
+            return f.write(payload)
+
+
+def get_sink(key_path, dataset, prefix=""):
+    if settings.ETL_SINK == "local":
+        return LocalSink(settings.ETL_LOCAL_SINK_PATH, dataset, prefix)
+    return BigQuerySink(key_path, dataset)
+
+
+def sync_models_to_bigquery(key_path, dataset, models, sink=None):
+    """
+    Exports the rows that have changed since the last run for each of the models.
+    Returns the stats of what was loaded for each table.
+
+    The sink defaults to the one configured by ETL_SINK.
+    """
+    if sink is None:
+        sink = get_sink(key_path, dataset)
+    if not sink.is_available():
+        return {}
+
+    for model, details in models.items():
+        batch_size = details.get("batch_size", settings.ETL_BATCH_SIZE)
+        stats = sink.stats[model]
+        if details.get("changelog"):
+            watermark = sink.get_watermark(model, details["field"])
+            lag = details.get("changelog_lag", settings.ETL_CHANGELOG_LAG)
+            if isinstance(watermark, int):
+                batches = get_changelog_batches(
+                    details, watermark, batch_size, lag, stats
                 )
             else:
-                records = details["model"].objects.all()
-
-            if "filter" in details:
-                records = records.filter(
-                    **{details["filter"]["key"]: details["filter"]["value"]}
+                batches = get_changelog_catch_up_batches(
+                    details, watermark, batch_size, lag, stats
                 )
+        else:
+            field = details["field"]
+            watermark = sink.get_watermark(model, field)
+            filters = {f"{field}__gt": watermark} if watermark else {}
+            records = get_records(details, **filters)
+            batches = get_export_batches(records, field, batch_size, stats)
+
+        labels = {"dataset": dataset, "table": model}
+        transform_seconds = stats["transform_seconds"]
+        for data, watermark in batches:
+            # Each batch's watermark is saved, so a lost lease can stop between them
+            check_lease()
+            metrics.ETL_TRANSFORM_DURATION.labels(**labels).observe(
+                stats["transform_seconds"] - transform_seconds
+            )
+            transform_seconds = stats["transform_seconds"]
+            if data:
+                sink.load_batch(model, details["fields"], data)
+            sink.set_watermark(model, watermark)
+
+        watermark_timestamp = get_watermark_timestamp(watermark)
+        if watermark_timestamp:
+            metrics.ETL_WATERMARK_AGE.labels(**labels).set(
+                (timezone.now() - watermark_timestamp).total_seconds()
+            )
+
+    return sink.get_stats()
+
+
+def get_watermark_timestamp(watermark):
+    """
+    Gets the time of the last exported row, or of the last exported change for
+    change log watermarks
+    """
+    if isinstance(watermark, int):
+        return (
+            ChangeLog.objects.filter(id=watermark)
+            .values_list("timestamp", flat=True)
+            .first()
+        )
+    return watermark
+
+
+def get_records(details, **filters):
+    """
+    Gets the records of the model that match the filters, and the model's filter if
+    it has one, in order of field
+    """
+    records = details["model"].objects.filter(**filters)
+    if "filter" in details:
+        records = records.filter(
+            **{details["filter"]["key"]: details["filter"]["value"]}
+        )
+
+    # Upload in ascending order, so that if a batch fails, the next run
+    # picks up from the last batch that was successfully loaded
+    return records.order_by(details["field"])
+
+
+def get_etl_backfill_key(dataset, table):
+    return f"etl_backfill:{dataset}.{table}"
+
+
+def get_backfill_windows(start, end, window):
+    """
+    Splits the time range from start up to end into windows of the given size
+    """
+    windows = []
+    while start < end:
+        windows.append((start, min(start + window, end)))
+        start += window
+    return windows
+
+
+def backfill_model_to_bigquery(key_path, dataset, table, details, start, end):
+    """
+    Exports the rows of the model with a value of field from start up to end. The
+    watermark isn't changed, so this can run alongside the regular ETL, and rows
+    that are exported by both can be deduplicated on their deduplication_id.
+    """
+    sink = get_sink(key_path, dataset, prefix=f"{start:%Y%m%dT%H%M%S}-")
+    if not sink.is_available():
+        return {}
+
+    field = details["field"]
+    records = get_records(details, **{f"{field}__gte": start, f"{field}__lt": end})
+    batch_size = details.get("batch_size", settings.ETL_BATCH_SIZE)
+    for data, _ in get_export_batches(records, field, batch_size, sink.stats[table]):
+        sink.load_batch(table, details["fields"], data)
+
+    return sink.get_stats()
+
+
+def get_changelog_batches(details, watermark, batch_size, lag, stats):
+    """
+    Yields batches of processed data for the rows of the model that have changed
+    since the watermark, according to the change log, and that match the model's
+    filter if it has one, along with the id of the last change in each batch.
+
+    Changes newer than lag seconds are left for the next run, so that a change
+    that is committed after a later one has been exported isn't skipped. Rows
+    that change more than once are only exported once per batch, and if a batch
+    is loaded again after a failure, the rows can be deduplicated on their
+    deduplication_id.
+    """
+    model = details["model"]
+    changes = (
+        ChangeLog.objects.filter(
+            model=model._meta.label,
+            id__gt=watermark,
+            timestamp__lte=timezone.now() - datetime.timedelta(seconds=lag),
+        )
+        .order_by("id")
+        .values_list("id", "object_id")
+    )
+    batches = get_batches(changes.iterator(chunk_size=2000), batch_size)
+    for batch in timed_iterator(batches, stats, "query_seconds"):
+        object_ids = {object_id for _, object_id in batch}
+        records = get_records(details, pk__in=object_ids).order_by("pk")
+        data = []
+        for processed, _ in get_export_batches(records, "pk", batch_size, stats):
+            data.extend(processed)
+        yield data, batch[-1][0]
+
+
+def get_changelog_catch_up_batches(details, watermark, batch_size, lag, stats):
+    """
+    Yields batches of processed data for the rows of a change log model with a
+    value of field after the timestamp watermark, or all of its rows if there is no
+    watermark, along with the value of field for the last row in each batch. This
+    catches up tables that were exported by timestamp, or haven't been exported
+    yet, however far back the change log goes.
+
+    The last batch is empty, with the id of the latest change that was older than
+    lag when the export started, so that the next run continues from the change
+    log. Rows that change after that are exported again, and can be deduplicated on
+    their deduplication_id.
+    """
+    model = details["model"]
+    changelog_id = (
+        ChangeLog.objects.filter(
+            model=model._meta.label,
+            timestamp__lte=timezone.now() - datetime.timedelta(seconds=lag),
+        )
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+
+    field = details["field"]
+    filters = {f"{field}__gt": watermark} if watermark else {}
+    records = get_records(details, **filters)
+    yield from get_export_batches(records, field, batch_size, stats)
+    yield [], changelog_id or 0
 
-            if records:
-                data = get_processed_records(records)
-                upload_to_bigquery(
-                    bigquery_client, dataset, model, details["fields"], data
-                )
+
+def get_export_batches(records, field, batch_size, stats=None):
+    """
+    Yields batches of processed data for the records, along with the value of field
+    for the last record in each batch.
+
+    If the model has an export_spec, only the required columns are fetched, and
+    the processing is done on the columns of each batch, optionally split over
+    ETL_TRANSFORM_PROCESSES processes. Daemonic processes, eg. the children of a
+    celery prefork worker, can't start processes, so they process the batches
+    themselves.
+
+    If stats is given, the time spent querying and transforming is added to its
+    "query_seconds" and "transform_seconds".
+    """
+    if stats is None:
+        stats = defaultdict(int)
+
+    spec = getattr(records.model, "export_spec", None)
+    if not spec:
+        batches = get_batches(records.iterator(chunk_size=2000), batch_size)
+        for batch in timed_iterator(batches, stats, "query_seconds"):
+            start = time.monotonic()
+            data = get_processed_records(batch)
+            stats["transform_seconds"] += time.monotonic() - start
+            yield data, getattr(batch[-1], field)
+        return
+
+    sources = spec.sources
+    if field not in sources:
+        sources = sources + [field]
+    field_index = sources.index(field)
+    rows = records.values_list(*sources).iterator(chunk_size=2000)
+
+    executor = None
+    daemon = multiprocessing.current_process().daemon
+    if settings.ETL_TRANSFORM_PROCESSES > 1 and not daemon:
+        executor = ProcessPoolExecutor(settings.ETL_TRANSFORM_PROCESSES)
+    try:
+        batches = get_batches(rows, batch_size)
+        for batch in timed_iterator(batches, stats, "query_seconds"):
+            start = time.monotonic()
+            data = spec.process_rows(batch, executor)
+            stats["transform_seconds"] += time.monotonic() - start
+            yield data, batch[-1][field_index]
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def timed_iterator(iterable, stats, key):
+    """
+    Yields the items of iterable, adding the time spent waiting for each item to
+    stats[key]
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.monotonic()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stats[key] += time.monotonic() - start
+        yield item
 
 
 def get_processed_records(records):
@@ -87,21 +590,127 @@ def get_processed_records(records):
     return data
 
 
+class ExportSpec:
+    """
+    Describes how a model is exported to BigQuery. Each keyword argument is an
+    exported column, and its value is either the BigQuery type, or a tuple of
+    (BigQuery type, transform, source field). The transform and source field are
+    optional, the source field defaults to the column name.
+
+    Transforms must be picklable, so that they can be run in other processes.
+    """
+
+    def __init__(self, **columns):
+        self.columns = []
+        for name, column in columns.items():
+            if isinstance(column, str):
+                column = (column,)
+            data_type, transform, source = (column + (None, None))[:3]
+            self.columns.append((name, data_type, transform, source or name))
+
+    @property
+    def fields(self):
+        return {name: data_type for name, data_type, _, _ in self.columns}
+
+    @property
+    def sources(self):
+        return list(dict.fromkeys(source for _, _, _, source in self.columns))
+
+    def process_rows(self, rows, executor=None):
+        """
+        Processes rows of values for `sources` into a list of dicts of the exported
+        columns
+        """
+        if executor and len(rows) > 1:
+            size = math.ceil(len(rows) / settings.ETL_TRANSFORM_PROCESSES)
+            return list(
+                chain.from_iterable(
+                    executor.map(self.process_rows, get_batches(rows, size))
+                )
+            )
+
+        source_columns = dict(zip(self.sources, zip(*rows)))
+        names, columns = [], []
+        for name, _, transform, source in self.columns:
+            values = source_columns[source]
+            if transform:
+                values = map(transform, values)
+            names.append(name)
+            columns.append(values)
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    def process_instance(self, instance):
+        return self.process_rows([[getattr(instance, s) for s in self.sources]])[0]
+
+
+def get_batches(iterable, size):
+    """
+    Splits iterable into lists of at most size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# The same MSISDNs show up repeatedly in the ETL and in joins across tables, so keep
+# a bounded cache of the most recent hashes
+@lru_cache(maxsize=100000)
 def hash_string(text):
     return base64.b64encode(hashlib.sha256(text.encode("utf-8")).digest()).decode(
         "utf-8"
     )
 
 
-def extract_reduced_accuracy_lat_long(location, resolution=1):
+def backfill_hashed_fields(model, fields, batch_size=1000):
+    """
+    Fills in the hashed fields, eg. {"hashed_msisdn": "msisdn"}, for the rows that
+    were created before they existed, in batches. Returns the number of rows that
+    were updated. The migrations have their own copy, so that changes to this
+    don't change what they do.
+    """
+    total = 0
+    while True:
+        batch = list(
+            model.objects.filter(hashed_msisdn="").only("pk", *fields.values())[
+                :batch_size
+            ]
+        )
+        if not batch:
+            return total
+        for record in batch:
+            for hashed_field, field in fields.items():
+                setattr(record, hashed_field, hash_string(getattr(record, field)))
+        model.objects.bulk_update(batch, fields.keys())
+        total += len(batch)
+
+
+def extract_lat_long(location):
     if location:
         loc = Location(location)
-        lat = round(float(loc.lat.decimal), resolution)
-        lng = round(float(loc.lng.decimal), resolution)
-        return (lat, lng)
+        return (float(loc.lat.decimal), float(loc.lng.decimal))
     else:
         return (None, None)
 
 
+def extract_reduced_accuracy_lat_long(location, resolution=1):
+    lat, lng = extract_lat_long(location)
+    return (reduce_accuracy(lat, resolution), reduce_accuracy(lng, resolution))
+
+
+def reduce_accuracy(coordinate, resolution=1):
+    if coordinate is None:
+        return None
+    return round(coordinate, resolution)
+
+
+def to_isoformat(value):
+    if value is None:
+        return None
+    return value.isoformat()
+
+
 def get_today():
     return datetime.date.today()
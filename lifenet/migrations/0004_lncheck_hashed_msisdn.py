@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lifenet", "0003_auto_20201119_1000"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lncheck",
+            name="hashed_msisdn",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=44
+            ),
+            preserve_default=False,
+        ),
+    ]
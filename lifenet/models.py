@@ -5,10 +5,11 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_prometheus.models import ExportModelOperationsMixin
 
-from healthcheck.utils import hash_string
+from healthcheck.models import EventIndexMixin
+from healthcheck.utils import ExportSpec, hash_string, to_isoformat
 
 
-class LNCheck(ExportModelOperationsMixin("ln-check"), models.Model):
+class LNCheck(ExportModelOperationsMixin("ln-check"), EventIndexMixin, models.Model):
     class Age(models.TextChoices):
         AGE_U18 = "<18", _("<18")
         AGE_18T39 = "18-39", _("18-39")
@@ -32,6 +33,7 @@ class LNCheck(ExportModelOperationsMixin("ln-check"), models.Model):
     deduplication_id = models.CharField(max_length=255, default=uuid.uuid4, unique=True)
     created_by = models.CharField(max_length=255, blank=True, default="")
     msisdn = models.CharField(max_length=255, db_index=True)
+    hashed_msisdn = models.CharField(max_length=44, db_index=True, editable=False)
     source = models.CharField(max_length=255)
     age = models.CharField(max_length=5, choices=Age.choices)
     cough = models.BooleanField()
@@ -50,25 +52,31 @@ class LNCheck(ExportModelOperationsMixin("ln-check"), models.Model):
         max_length=3, choices=Language.choices, null=True, blank=True
     )
 
-    @property
-    def hashed_msisdn(self):
-        return hash_string(self.msisdn)
+    def save(self, *args, **kwargs):
+        self.hashed_msisdn = hash_string(self.msisdn)
+        super().save(*args, **kwargs)
+
+    export_spec = ExportSpec(
+        deduplication_id=("STRING", str),
+        msisdn=("STRING", None, "hashed_msisdn"),
+        timestamp=("TIMESTAMP", to_isoformat),
+        source="STRING",
+        age="STRING",
+        cough="BOOLEAN",
+        fever="BOOLEAN",
+        sore_throat="BOOLEAN",
+        difficulty_breathing="BOOLEAN",
+        muscle_pain="BOOLEAN",
+        smell="BOOLEAN",
+        exposure="STRING",
+        risk="STRING",
+        tracing="BOOLEAN",
+        follow_up_optin="BOOLEAN",
+        language="STRING",
+    )
 
     def get_processed_data(self):
-        return {
-            "deduplication_id": str(self.deduplication_id),
-            "msisdn": self.hashed_msisdn,
-            "timestamp": self.timestamp.isoformat(),
-            "source": self.source,
-            "age": self.age,
-            "cough": self.cough,
-            "fever": self.fever,
-            "sore_throat": self.sore_throat,
-            "difficulty_breathing": self.difficulty_breathing,
-            "muscle_pain": self.muscle_pain,
-            "smell": self.smell,
-            "exposure": self.exposure,
-            "risk": self.risk,
-            "follow_up_optin": self.follow_up_optin,
-            "language": self.language,
-        }
+        return self.export_spec.process_instance(self)
+
+    class Meta:
+        get_latest_by = "completed_timestamp"
@@ -1,43 +1,23 @@
 from celery import shared_task
 from django.conf import settings
-from django_redis import get_redis_connection
 
-from healthcheck import utils
+from healthcheck.leases import singleton_task
+from healthcheck.tasks import sync_models_to_bigquery_in_parallel
 from lifenet.models import LNCheck
-from userprofile.models import HealthCheckUserProfile
 
 
-@shared_task
-def perform_etl():
-    r = get_redis_connection()
-    if r.get("perform_etl_ln_connect"):
-        return
-
-    models = {
-        "checks": {
-            "model": LNCheck,
-            "field": "timestamp",
-            "fields": {
-                "deduplication_id": "STRING",
-                "msisdn": "STRING",
-                "timestamp": "TIMESTAMP",
-                "source": "STRING",
-                "age": "STRING",
-                "cough": "BOOLEAN",
-                "fever": "BOOLEAN",
-                "sore_throat": "BOOLEAN",
-                "difficulty_breathing": "BOOLEAN",
-                "muscle_pain": "BOOLEAN",
-                "smell": "BOOLEAN",
-                "exposure": "STRING",
-                "risk": "STRING",
-                "tracing": "BOOLEAN",
-                "language": "STRING",
-            },
-        }
+ETL_MODELS = {
+    "checks": {
+        "model": LNCheck,
+        "field": "timestamp",
+        "fields": LNCheck.export_spec.fields,
     }
+}
 
-    with r.lock("perform_etl_lifenet", 1800):
-        utils.sync_models_to_bigquery(
-            settings.LIFENET_BQ_KEY_PATH, settings.LIFENET_BQ_DATASET, models
-        )
+
+@shared_task
+@singleton_task("perform_etl_lifenet")
+def perform_etl():
+    sync_models_to_bigquery_in_parallel(
+        settings.LIFENET_BQ_KEY_PATH, settings.LIFENET_BQ_DATASET, ETL_MODELS
+    )
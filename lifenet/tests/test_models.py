@@ -55,6 +55,7 @@ class LNCheckTests(TestCase):
                 "smell": True,
                 "exposure": LNCheck.Exposure.EXPOSURE_NOT_SURE,
                 "risk": LNCheck.Risk.RISK_HIGH,
+                "tracing": True,
                 "follow_up_optin": False,
                 "language": "eng",
             },
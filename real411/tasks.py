@@ -4,17 +4,21 @@ from celery.utils.log import get_task_logger
 from django.conf import settings
 from requests.exceptions import RequestException
 from temba_client.exceptions import TembaException
-from temba_client.v2 import TembaClient
 
+from healthcheck.http import get_rapidpro_client
+from healthcheck.ratelimit import RateLimitExceeded
 from real411.models import Complaint
 
 logger = get_task_logger(__name__)
 
-rapidpro_client = TembaClient(settings.RAPIDPRO_URL, settings.RAPIDPRO_TOKEN)
-
 
 @shared_task(
-    autoretry_for=(RequestException, TembaException, SoftTimeLimitExceeded),
+    autoretry_for=(
+        RequestException,
+        TembaException,
+        RateLimitExceeded,
+        SoftTimeLimitExceeded,
+    ),
     max_retries=20,
     retry_backoff=True,
     soft_time_limit=15,
@@ -30,7 +34,7 @@ def process_complaint_update(update: dict) -> dict:
     logger.info(f"Processing complaint update with data {update}")
 
     complaint = Complaint.objects.get(complaint_ref=update["complaint_ref"])
-    result = rapidpro_client.create_flow_start(
+    result = get_rapidpro_client().create_flow_start(
         settings.RAPIDPRO_REAL411_FLOW,
         urns=[f"whatsapp:{complaint.msisdn.lstrip('+')}"],
         restart_participants=True,
@@ -70,11 +70,11 @@ class ComplaintUpdateViewTests(APITestCase):
 
 class ComplaintUpdateTaskTests(TestCase):
     @override_settings(RAPIDPRO_REAL411_FLOW="testflow")
-    @patch("real411.tasks.rapidpro_client")
-    def test_submit_to_rapidpro(self, rapidpro_client: MagicMock):
+    @patch("real411.tasks.get_rapidpro_client")
+    def test_submit_to_rapidpro(self, get_rapidpro_client: MagicMock):
         Complaint.objects.create(complaint_ref="REF001", msisdn="+27820001001")
         process_complaint_update({"complaint_ref": "REF001"})
-        rapidpro_client.create_flow_start.assert_called_once_with(
+        get_rapidpro_client.return_value.create_flow_start.assert_called_once_with(
             "testflow",
             urns=["whatsapp:27820001001"],
             restart_participants=True,
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("selfswab", "0017_selfswabtest_pdf_media_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="selfswabregistration",
+            name="hashed_msisdn",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=44
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="selfswabregistration",
+            name="hashed_employee_number",
+            field=models.CharField(default="", editable=False, max_length=44),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="selfswabscreen",
+            name="hashed_msisdn",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=44
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="selfswabscreen",
+            name="hashed_employee_number",
+            field=models.CharField(default="", editable=False, max_length=44),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="selfswabtest",
+            name="hashed_msisdn",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=44
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -3,7 +3,8 @@ import uuid
 from django.db import models
 from django.utils import timezone
 
-from healthcheck.utils import hash_string
+from healthcheck.models import EventIndexMixin
+from healthcheck.utils import ExportSpec, hash_string, to_isoformat
 from userprofile.validators import za_phone_number
 
 
@@ -36,8 +37,10 @@ class SelfSwabRegistration(models.Model, BaseModel):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_by = models.CharField(max_length=255)
     employee_number = models.CharField(max_length=255, blank=True, default="")
+    hashed_employee_number = models.CharField(max_length=44, editable=False)
     contact_id = models.CharField(max_length=255, blank=True, default="")
     msisdn = models.CharField(max_length=255, validators=[za_phone_number], blank=True)
+    hashed_msisdn = models.CharField(max_length=44, db_index=True, editable=False)
     first_name = models.CharField(max_length=255, blank=False)
     last_name = models.CharField(max_length=255, blank=False)
     facility = models.CharField(max_length=255, blank=False)
@@ -55,37 +58,32 @@ class SelfSwabRegistration(models.Model, BaseModel):
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
     should_sync = models.BooleanField(default=True)
 
-    @property
-    def hashed_msisdn(self):
-        return hash_string(self.msisdn)
-
-    @property
-    def hashed_employee_number(self):
-        return hash_string(self.employee_number)
+    def save(self, *args, **kwargs):
+        self.hashed_msisdn = hash_string(self.msisdn)
+        self.hashed_employee_number = hash_string(self.employee_number)
+        super().save(*args, **kwargs)
+
+    export_spec = ExportSpec(
+        id=("STRING", str),
+        contact_id="STRING",
+        employee_number=("STRING", None, "hashed_employee_number"),
+        msisdn=("STRING", None, "hashed_msisdn"),
+        facility="STRING",
+        occupation="STRING",
+        age="STRING",
+        gender="STRING",
+        opted_out="BOOLEAN",
+        optout_reason="STRING",
+        optout_timestamp=("TIMESTAMP", to_isoformat),
+        timestamp=("TIMESTAMP", to_isoformat),
+        updated_at=("TIMESTAMP", to_isoformat),
+    )
 
     def get_processed_data(self):
-        optout_timestamp = None
-        if self.optout_timestamp:
-            optout_timestamp = self.optout_timestamp.isoformat()
-
-        return {
-            "id": str(self.id),
-            "contact_id": self.contact_id,
-            "employee_number": self.hashed_employee_number,
-            "msisdn": self.hashed_msisdn,
-            "facility": self.facility,
-            "occupation": self.occupation,
-            "age": self.age,
-            "gender": self.gender,
-            "opted_out": self.opted_out,
-            "optout_reason": self.optout_reason,
-            "optout_timestamp": optout_timestamp,
-            "timestamp": self.timestamp.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
-
-
-class SelfSwabScreen(models.Model, BaseModel):
+        return self.export_spec.process_instance(self)
+
+
+class SelfSwabScreen(EventIndexMixin, models.Model, BaseModel):
     LOW_RISK = "Low"
     HIGH_RISK = "High"
     RISK_TYPES = ((LOW_RISK, "Low"), (HIGH_RISK, "High"))
@@ -96,12 +94,14 @@ class SelfSwabScreen(models.Model, BaseModel):
     msisdn = models.CharField(
         max_length=255, validators=[za_phone_number], db_index=True
     )
+    hashed_msisdn = models.CharField(max_length=44, db_index=True, editable=False)
     age = models.CharField(max_length=5, choices=BaseModel.Age.choices)
     gender = models.CharField(max_length=10, choices=BaseModel.Gender.choices)
     facility = models.CharField(max_length=255, blank=False)
     risk_type = models.CharField(max_length=10, choices=RISK_TYPES)
     occupation = models.CharField(max_length=255, blank=True, default="")
     employee_number = models.CharField(max_length=255, blank=True, default="")
+    hashed_employee_number = models.CharField(max_length=44, editable=False)
     pre_existing_condition = models.CharField(max_length=255, blank=True, default="")
     cough = models.BooleanField()
     fever = models.BooleanField()
@@ -113,35 +113,37 @@ class SelfSwabScreen(models.Model, BaseModel):
     should_sync = models.BooleanField(default=True)
     timestamp = models.DateTimeField(default=timezone.now)
 
-    @property
-    def hashed_msisdn(self):
-        return hash_string(self.msisdn)
-
-    @property
-    def hashed_employee_number(self):
-        return hash_string(self.employee_number)
+    def save(self, *args, **kwargs):
+        self.hashed_msisdn = hash_string(self.msisdn)
+        self.hashed_employee_number = hash_string(self.employee_number)
+        super().save(*args, **kwargs)
+
+    export_spec = ExportSpec(
+        id=("STRING", str),
+        contact_id="STRING",
+        msisdn=("STRING", None, "hashed_msisdn"),
+        age="STRING",
+        gender="STRING",
+        facility="STRING",
+        risk_type="STRING",
+        timestamp=("TIMESTAMP", to_isoformat),
+        occupation="STRING",
+        employee_number=("STRING", None, "hashed_employee_number"),
+        pre_existing_condition="STRING",
+        cough="BOOLEAN",
+        fever="BOOLEAN",
+        shortness_of_breath="BOOLEAN",
+        body_aches="BOOLEAN",
+        loss_of_taste_smell="BOOLEAN",
+        sore_throat="BOOLEAN",
+        additional_symptoms="BOOLEAN",
+    )
 
     def get_processed_data(self):
-        return {
-            "id": str(self.id),
-            "contact_id": self.contact_id,
-            "msisdn": self.hashed_msisdn,
-            "age": self.age,
-            "gender": self.gender,
-            "facility": self.facility,
-            "risk_type": self.risk_type,
-            "timestamp": self.timestamp.isoformat(),
-            "occupation": self.occupation,
-            "employee_number": self.hashed_employee_number,
-            "pre_existing_condition": self.pre_existing_condition,
-            "cough": self.cough,
-            "fever": self.fever,
-            "shortness_of_breath": self.shortness_of_breath,
-            "body_aches": self.body_aches,
-            "loss_of_taste_smell": self.loss_of_taste_smell,
-            "sore_throat": self.sore_throat,
-            "additional_symptoms": self.additional_symptoms,
-        }
+        return self.export_spec.process_instance(self)
+
+    class Meta:
+        get_latest_by = "timestamp"
 
 
 class SelfSwabTest(models.Model):
@@ -160,6 +162,7 @@ class SelfSwabTest(models.Model):
     created_by = models.CharField(max_length=255, blank=True, default="")
     contact_id = models.CharField(max_length=255, blank=False)
     msisdn = models.CharField(max_length=255, validators=[za_phone_number])
+    hashed_msisdn = models.CharField(max_length=44, db_index=True, editable=False)
     result = models.CharField(
         max_length=100, choices=Result.choices, default=Result.PENDING
     )
@@ -172,34 +175,25 @@ class SelfSwabTest(models.Model):
     authorized_timestamp = models.DateTimeField(null=True)
     should_sync = models.BooleanField(default=True)
 
-    @property
-    def hashed_msisdn(self):
-        return hash_string(self.msisdn)
+    def save(self, *args, **kwargs):
+        self.hashed_msisdn = hash_string(self.msisdn)
+        super().save(*args, **kwargs)
+
+    export_spec = ExportSpec(
+        id=("STRING", str),
+        contact_id="STRING",
+        msisdn=("STRING", None, "hashed_msisdn"),
+        result="STRING",
+        barcode="STRING",
+        timestamp=("TIMESTAMP", to_isoformat),
+        updated_at=("TIMESTAMP", to_isoformat),
+        collection_timestamp=("TIMESTAMP", to_isoformat),
+        received_timestamp=("TIMESTAMP", to_isoformat),
+        authorized_timestamp=("TIMESTAMP", to_isoformat),
+    )
 
     def get_processed_data(self):
-        collection_timestamp = None
-        received_timestamp = None
-        authorized_timestamp = None
-
-        if self.collection_timestamp:
-            collection_timestamp = self.collection_timestamp.isoformat()
-        if self.received_timestamp:
-            received_timestamp = self.received_timestamp.isoformat()
-        if self.authorized_timestamp:
-            authorized_timestamp = self.authorized_timestamp.isoformat()
-
-        return {
-            "id": str(self.id),
-            "contact_id": self.contact_id,
-            "msisdn": self.hashed_msisdn,
-            "result": self.result,
-            "barcode": self.barcode,
-            "timestamp": self.timestamp.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-            "collection_timestamp": collection_timestamp,
-            "received_timestamp": received_timestamp,
-            "authorized_timestamp": authorized_timestamp,
-        }
+        return self.export_spec.process_instance(self)
 
     def set_result(self, result):
         if result.upper() in ["POS", "POSITIVE", "DETECTED"]:
@@ -9,6 +9,7 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 from unittest.mock import patch
 
+from healthcheck.ratelimit import RateLimitExceeded
 from selfswab.models import SelfSwabRegistration, SelfSwabScreen, SelfSwabTest
 from userprofile.tests.test_views import BaseEventTestCase
 
@@ -593,6 +594,31 @@ class SelfSwabWhitelistViewSetTests(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json(), {"error": "already whitelisted"})
 
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        SELFSWAB_RAPIDPRO_TOKEN="123",
+    )
+    @patch("healthcheck.http.TembaClient.get_contacts")
+    def test_rate_limited(self, mock_get_contacts):
+        """
+        If rapidpro is rate limited, should return a 429 without waiting
+        """
+        mock_get_contacts.side_effect = RateLimitExceeded("rapidpro", 5)
+        user = get_user_model().objects.create_user("test")
+        self.client.force_authenticate(user)
+
+        response = self.client.post(
+            self.url,
+            {
+                "msisdn": "27123123",
+                "whitelist_group_uuid": "da85c55c-c213-4cfc-9d6d-c88d97993bf3",
+                "study_number": 2,
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "5")
+
 
 class SendTestResultPDFViewViewSetTests(APITestCase):
     url = reverse("selfswab:rest_send_test_result_pdf")
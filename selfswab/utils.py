@@ -1,11 +1,12 @@
 import cv2
 import zbar
 import re
-import requests
 import tempfile
 from django.conf import settings
 from urllib.parse import urljoin
 
+from healthcheck import http
+
 from .models import SelfSwabRegistration
 
 
@@ -37,7 +38,9 @@ def upload_turn_media(media, content_type="application/pdf"):
         "Content-Type": content_type,
     }
 
-    response = requests.post(
+    response = http.request(
+        "selfswab_turn",
+        "post",
         urljoin(settings.SELFSWAB_TURN_URL, f"v1/media"),
         headers=headers,
         data=media,
@@ -59,8 +62,12 @@ def send_whatsapp_media_message(wa_id, media_type, media_id):
         media_type: {"id": media_id},
     }
 
-    response = requests.post(
-        urljoin(settings.SELFSWAB_TURN_URL, "v1/messages"), headers=headers, json=data
+    response = http.request(
+        "selfswab_turn",
+        "post",
+        urljoin(settings.SELFSWAB_TURN_URL, "v1/messages"),
+        headers=headers,
+        json=data,
     )
     response.raise_for_status()
     return response
@@ -100,7 +107,9 @@ def get_whatsapp_messages(wa_id):
         "content-type": "application/json",
         "Accept": "application/vnd.v1+json",
     }
-    response = requests.get(
+    response = http.request(
+        "selfswab_turn",
+        "get",
         urljoin(settings.SELFSWAB_TURN_URL, f"/v1/contacts/{wa_id}/messages"),
         headers=headers,
     )
@@ -110,8 +119,11 @@ def get_whatsapp_messages(wa_id):
 
 def get_whatsapp_media(media_id):
     headers = {"Authorization": f"Bearer {settings.SELFSWAB_TURN_TOKEN}"}
-    response = requests.get(
-        urljoin(settings.SELFSWAB_TURN_URL, f"v1/media/{media_id}"), headers=headers
+    response = http.request(
+        "selfswab_turn",
+        "get",
+        urljoin(settings.SELFSWAB_TURN_URL, f"v1/media/{media_id}"),
+        headers=headers,
     )
     response.raise_for_status()
     return response.content
@@ -1,11 +1,14 @@
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import Throttled
 from rest_framework.mixins import CreateModelMixin, UpdateModelMixin
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
-from temba_client.v2 import TembaClient
 from django.conf import settings
 
+from healthcheck.http import get_rapidpro_client
+from healthcheck.ratelimit import RateLimitExceeded
+
 from .models import SelfSwabRegistration, SelfSwabScreen, SelfSwabTest
 from .serializers import (
     SelfSwabRegistrationSerializer,
@@ -60,48 +63,53 @@ class WhitelistContactView(generics.GenericAPIView):
         active_study_number = data.pop("study_number", None)
 
         if settings.RAPIDPRO_URL and settings.SELFSWAB_RAPIDPRO_TOKEN:
-            rapidpro = TembaClient(
-                settings.RAPIDPRO_URL, settings.SELFSWAB_RAPIDPRO_TOKEN
-            )
+            rapidpro = get_rapidpro_client(settings.SELFSWAB_RAPIDPRO_TOKEN, max_wait=0)
+            try:
+                return self.whitelist_contact(
+                    rapidpro, msisdn, whitelist_group_uuid, active_study_number
+                )
+            except RateLimitExceeded as e:
+                raise Throttled(wait=e.retry_after)
 
-            contact = rapidpro.get_contacts(urn=f"whatsapp:{msisdn}").first()
+        return Response(
+            {"error": "rapidpro not configured"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
 
-            if contact:
-                group_ids = exclude_dynamic_groups(
-                    rapidpro, [g.uuid for g in contact.groups]
-                )
+    def whitelist_contact(self, rapidpro, msisdn, whitelist_group_uuid, study_number):
+        contact = rapidpro.get_contacts(urn=f"whatsapp:{msisdn}").first()
 
-                if whitelist_group_uuid in group_ids:
-                    return Response(
-                        {"error": "already whitelisted"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-                else:
-                    group_ids.append(whitelist_group_uuid)
-                    rapidpro.update_contact(
-                        contact,
-                        groups=group_ids,
-                        fields={"self_swab_study_number": active_study_number},
-                    )
-
-                    return Response({}, status=status.HTTP_200_OK)
+        if contact:
+            group_ids = exclude_dynamic_groups(
+                rapidpro, [g.uuid for g in contact.groups]
+            )
+
+            if whitelist_group_uuid in group_ids:
+                return Response(
+                    {"error": "already whitelisted"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
             else:
-                rapidpro.create_contact(
-                    language="eng",
-                    fields={
-                        "msisdn": msisdn,
-                        "self_swab_study_number": active_study_number,
-                    },
-                    groups=[whitelist_group_uuid],
-                    urns=[f"whatsapp:{msisdn}"],
+                group_ids.append(whitelist_group_uuid)
+                rapidpro.update_contact(
+                    contact,
+                    groups=group_ids,
+                    fields={"self_swab_study_number": study_number},
                 )
 
-                return Response({}, status=status.HTTP_201_CREATED)
+                return Response({}, status=status.HTTP_200_OK)
+        else:
+            rapidpro.create_contact(
+                language="eng",
+                fields={
+                    "msisdn": msisdn,
+                    "self_swab_study_number": study_number,
+                },
+                groups=[whitelist_group_uuid],
+                urns=[f"whatsapp:{msisdn}"],
+            )
 
-        return Response(
-            {"error": "rapidpro not configured"},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        )
+            return Response({}, status=status.HTTP_201_CREATED)
 
 
 class SendTestResultPDFView(generics.GenericAPIView):
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tbconnect", "0017_auto_20231024_0905"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tbcheck",
+            name="hashed_msisdn",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=44
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="tbtest",
+            name="hashed_msisdn",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=44
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from iso6709 import Location
+
+
+FIELDS = [
+    "location_latitude",
+    "location_longitude",
+    "city_latitude",
+    "city_longitude",
+]
+
+
+def extract_lat_long(location):
+    try:
+        loc = Location(location)
+        return (float(loc.lat.decimal), float(loc.lng.decimal))
+    except (AttributeError, TypeError):
+        return (None, None)
+
+
+class Migration(migrations.Migration):
+    # Commit each batch separately, so that we don't lock the whole table
+    atomic = False
+
+    dependencies = [
+        ("tbconnect", "0018_hashed_msisdn"),
+    ]
+
+    def populate_coordinates(apps, schema_editor):
+        TBCheck = apps.get_model("tbconnect", "TBCheck")
+        records = (
+            TBCheck.objects.exclude(location__isnull=True, city_location__isnull=True)
+            .only("pk", "location", "city_location")
+            .order_by("pk")
+        )
+
+        batch = []
+        for record in records.iterator(chunk_size=1000):
+            if record.location:
+                record.location_latitude, record.location_longitude = extract_lat_long(
+                    record.location
+                )
+            if record.city_location:
+                record.city_latitude, record.city_longitude = extract_lat_long(
+                    record.city_location
+                )
+            batch.append(record)
+            if len(batch) >= 1000:
+                TBCheck.objects.bulk_update(batch, FIELDS)
+                batch = []
+        TBCheck.objects.bulk_update(batch, FIELDS)
+
+    operations = [
+        migrations.AddField(
+            model_name="tbcheck",
+            name="location_latitude",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="tbcheck",
+            name="location_longitude",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="tbcheck",
+            name="city_latitude",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="tbcheck",
+            name="city_longitude",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            populate_coordinates, migrations.RunPython.noop, elidable=True
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tbconnect", "0019_tbcheck_coordinates"),
+        ("userprofile", "0019_healthcheckuserprofile_updated_at"),
+    ]
+
+    def queue_unsynced_profiles(apps, schema_editor):
+        """
+        Moves the profiles that are waiting to be synced from the flag in their data
+        to the queue
+        """
+        HealthCheckUserProfile = apps.get_model("userprofile", "HealthCheckUserProfile")
+        RapidProSyncQueue = apps.get_model("tbconnect", "RapidProSyncQueue")
+
+        msisdns = HealthCheckUserProfile.objects.filter(
+            data__contains={"synced_to_tb_rapidpro": False}
+        ).values_list("msisdn", flat=True)
+        RapidProSyncQueue.objects.bulk_create(
+            (RapidProSyncQueue(msisdn=msisdn) for msisdn in msisdns.iterator()),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    operations = [
+        migrations.CreateModel(
+            name="RapidProSyncQueue",
+            fields=[
+                (
+                    "msisdn",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                (
+                    "queued_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(
+            queue_unsynced_profiles, reverse_code=migrations.RunPython.noop
+        ),
+    ]
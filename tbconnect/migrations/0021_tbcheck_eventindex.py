@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("healthcheck", "0002_eventindex"),
+        ("tbconnect", "0020_rapidprosyncqueue"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="tbcheck",
+            options={"get_latest_by": "completed_timestamp"},
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO healthcheck_eventindex (
+                msisdn, model, first_id, first_timestamp, latest_id, latest_timestamp
+            )
+            SELECT
+                msisdn,
+                'tbconnect.TBCheck',
+                (array_agg(id::text ORDER BY completed_timestamp, id))[1],
+                min(completed_timestamp),
+                (array_agg(id::text ORDER BY completed_timestamp DESC, id DESC))[1],
+                max(completed_timestamp)
+            FROM tbconnect_tbcheck
+            GROUP BY msisdn
+            ON CONFLICT (msisdn, model) DO NOTHING
+            """,
+            reverse_sql="DELETE FROM healthcheck_eventindex WHERE model = 'tbconnect.TBCheck'",
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+import base64
+import hashlib
+
+from django.db import migrations
+
+MODELS = {
+    "TBCheck": {"hashed_msisdn": "msisdn"},
+    "TBTest": {"hashed_msisdn": "msisdn"},
+}
+
+
+def hash_string(text):
+    return base64.b64encode(hashlib.sha256(text.encode("utf-8")).digest()).decode(
+        "utf-8"
+    )
+
+
+def backfill_hashed_fields(model, fields, batch_size=1000):
+    while True:
+        batch = list(
+            model.objects.filter(hashed_msisdn="").only("pk", *fields.values())[
+                :batch_size
+            ]
+        )
+        if not batch:
+            return
+        for record in batch:
+            for hashed_field, field in fields.items():
+                setattr(record, hashed_field, hash_string(getattr(record, field)))
+        model.objects.bulk_update(batch, fields.keys())
+
+
+def backfill_hashed_msisdns(apps, schema_editor):
+    """
+    Fills in the hashed columns for the rows that were created before they were
+    added, so that the ETL doesn't export them with empty msisdns
+    """
+    for name, fields in MODELS.items():
+        backfill_hashed_fields(apps.get_model("tbconnect", name), fields)
+
+
+class Migration(migrations.Migration):
+
+    # Each batch is committed separately, so that the tables aren't locked for the
+    # whole backfill
+    atomic = False
+
+    dependencies = [
+        ("tbconnect", "0021_tbcheck_eventindex"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_hashed_msisdns, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -1,15 +1,28 @@
 import uuid
+from functools import partial
 
 import pycountry
 from django.db import models
 from django.utils import timezone
 from django_prometheus.models import ExportModelOperationsMixin
 
-from healthcheck.utils import hash_string, extract_reduced_accuracy_lat_long
+from healthcheck.models import ChangeLogMixin, EventIndexMixin
+from healthcheck.utils import (
+    ExportSpec,
+    extract_lat_long,
+    hash_string,
+    reduce_accuracy,
+    to_isoformat,
+)
 from userprofile.validators import geographic_coordinate, za_phone_number
 
 
-class TBCheck(ExportModelOperationsMixin("tb-check"), models.Model):
+class TBCheck(
+    ExportModelOperationsMixin("tb-check"),
+    ChangeLogMixin,
+    EventIndexMixin,
+    models.Model,
+):
     AGE_U18 = "<18"
     AGE_18T40 = "18-40"
     AGE_40T65 = "40-65"
@@ -94,6 +107,7 @@ class TBCheck(ExportModelOperationsMixin("tb-check"), models.Model):
     msisdn = models.CharField(
         max_length=255, validators=[za_phone_number], db_index=True
     )
+    hashed_msisdn = models.CharField(max_length=44, db_index=True, editable=False)
     source = models.CharField(max_length=255)
     province = models.CharField(
         max_length=6, choices=PROVINCE_CHOICES, blank=True, null=True, default=""
@@ -107,6 +121,10 @@ class TBCheck(ExportModelOperationsMixin("tb-check"), models.Model):
     city_location = models.CharField(
         max_length=255, validators=[geographic_coordinate], null=True
     )
+    location_latitude = models.FloatField(null=True, editable=False)
+    location_longitude = models.FloatField(null=True, editable=False)
+    city_latitude = models.FloatField(null=True, editable=False)
+    city_longitude = models.FloatField(null=True, editable=False)
     cough = models.BooleanField()
     fever = models.BooleanField()
     sweat = models.BooleanField()
@@ -134,46 +152,50 @@ class TBCheck(ExportModelOperationsMixin("tb-check"), models.Model):
         max_length=3, choices=DAY_CHOICES, null=True, blank=True
     )
 
-    @property
-    def hashed_msisdn(self):
-        return hash_string(self.msisdn)
+    def save(self, *args, **kwargs):
+        self.hashed_msisdn = hash_string(self.msisdn)
+        self.location_latitude, self.location_longitude = extract_lat_long(
+            self.location
+        )
+        self.city_latitude, self.city_longitude = extract_lat_long(self.city_location)
+        super().save(*args, **kwargs)
+
+    export_spec = ExportSpec(
+        deduplication_id=("STRING", str),
+        msisdn=("STRING", None, "hashed_msisdn"),
+        timestamp=("TIMESTAMP", to_isoformat),
+        source="STRING",
+        province="STRING",
+        age="STRING",
+        gender="STRING",
+        location_latitude=("FLOAT", partial(reduce_accuracy, resolution=2)),
+        location_longitude=("FLOAT", partial(reduce_accuracy, resolution=2)),
+        city_latitude=("FLOAT", partial(reduce_accuracy, resolution=2)),
+        city_longitude=("FLOAT", partial(reduce_accuracy, resolution=2)),
+        cough="BOOLEAN",
+        fever="BOOLEAN",
+        sweat="BOOLEAN",
+        weight="BOOLEAN",
+        exposure="STRING",
+        risk="STRING",
+        follow_up_optin="BOOLEAN",
+        language="STRING",
+        activation="STRING",
+        originating_msisdn="STRING",
+        commit_get_tested="STRING",
+        research_consent="BOOLEAN",
+        clinic_to_visit="STRING",
+        clinic_visit_day="STRING",
+    )
 
     def get_processed_data(self):
-        location_lat, location_long = extract_reduced_accuracy_lat_long(
-            self.location, 2
-        )
-        city_lat, city_long = extract_reduced_accuracy_lat_long(self.city_location, 2)
-
-        return {
-            "deduplication_id": str(self.deduplication_id),
-            "msisdn": self.hashed_msisdn,
-            "timestamp": self.timestamp.isoformat(),
-            "source": self.source,
-            "province": self.province,
-            "age": self.age,
-            "gender": self.gender,
-            "location_latitude": location_lat,
-            "location_longitude": location_long,
-            "city_latitude": city_lat,
-            "city_longitude": city_long,
-            "cough": self.cough,
-            "fever": self.fever,
-            "sweat": self.sweat,
-            "weight": self.weight,
-            "exposure": self.exposure,
-            "risk": self.risk,
-            "follow_up_optin": self.follow_up_optin,
-            "language": self.language,
-            "activation": self.activation,
-            "originating_msisdn": self.originating_msisdn,
-            "commit_get_tested": self.commit_get_tested,
-            "research_consent": self.research_consent,
-            "clinic_to_visit": self.clinic_to_visit,
-            "clinic_visit_day": self.clinic_visit_day,
-        }
-
-
-class TBTest(ExportModelOperationsMixin("tb-test"), models.Model):
+        return self.export_spec.process_instance(self)
+
+    class Meta:
+        get_latest_by = "completed_timestamp"
+
+
+class TBTest(ExportModelOperationsMixin("tb-test"), ChangeLogMixin, models.Model):
     RESULT_POSITIVE = "positive"
     RESULT_NEGATIVE = "negative"
     RESULT_PENDING = "pending"
@@ -186,21 +208,44 @@ class TBTest(ExportModelOperationsMixin("tb-test"), models.Model):
     deduplication_id = models.CharField(max_length=255, default=uuid.uuid4, unique=True)
     created_by = models.CharField(max_length=255, blank=True, default="")
     msisdn = models.CharField(max_length=255, validators=[za_phone_number])
+    hashed_msisdn = models.CharField(max_length=44, db_index=True, editable=False)
     source = models.CharField(max_length=255)
     result = models.CharField(max_length=10, choices=RESULT_CHOICES)
     timestamp = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
-    @property
-    def hashed_msisdn(self):
-        return hash_string(self.msisdn)
+    def save(self, *args, **kwargs):
+        self.hashed_msisdn = hash_string(self.msisdn)
+        super().save(*args, **kwargs)
+
+    export_spec = ExportSpec(
+        deduplication_id=("STRING", str),
+        msisdn=("STRING", None, "hashed_msisdn"),
+        source="STRING",
+        result="STRING",
+        timestamp=("TIMESTAMP", to_isoformat),
+        updated_at=("TIMESTAMP", to_isoformat),
+    )
 
     def get_processed_data(self):
-        return {
-            "deduplication_id": str(self.deduplication_id),
-            "msisdn": self.hashed_msisdn,
-            "source": self.source,
-            "result": self.result,
-            "timestamp": self.timestamp.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
+        return self.export_spec.process_instance(self)
+
+
+class RapidProSyncQueueManager(models.Manager):
+    def enqueue(self, msisdn):
+        """
+        Queues the profile to be synced, or moves it to the back of the queue if
+        it's already queued, so that the sync uses its latest TB Check
+        """
+        self.update_or_create(msisdn=msisdn, defaults={"queued_at": timezone.now()})
+
+
+class RapidProSyncQueue(models.Model):
+    """
+    The profiles that have a new TB Check to sync to RapidPro
+    """
+
+    msisdn = models.CharField(max_length=255, primary_key=True)
+    queued_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = RapidProSyncQueueManager()
@@ -1,140 +1,254 @@
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
+from datetime import timedelta
+from itertools import islice
+
 from celery import shared_task
+from celery.utils.log import get_task_logger
 from django.conf import settings
-from django_redis import get_redis_connection
-from temba_client.v2 import TembaClient
+from django.db.models import Q
+from django.utils import timezone
+from temba_client.exceptions import (
+    TembaBadRequestError,
+    TembaConnectionError,
+    TembaHttpError,
+    TembaNoSuchObjectError,
+    TembaRateExceededError,
+    TembaTokenError,
+)
 
-from healthcheck import utils
-from tbconnect.models import TBCheck, TBTest
+from healthcheck import http
+from healthcheck.http import get_rapidpro_client
+from healthcheck.leases import check_lease, singleton_task
+from healthcheck.models import EventIndex
+from healthcheck.ratelimit import RateLimitExceeded, get_rate_limit
+from healthcheck.tasks import sync_models_to_bigquery_in_parallel
+from tbconnect.models import RapidProSyncQueue, TBCheck, TBTest
 from userprofile.models import HealthCheckUserProfile
-import requests
 
+logger = get_task_logger(__name__)
 
-@shared_task
-def perform_sync_to_rapidpro():
-    r = get_redis_connection()
-    if r.get("perform_sync_to_rapidpro"):
-        return
 
-    with r.lock("perform_sync_to_rapidpro", 1800):
-        if (
-            settings.RAPIDPRO_URL
-            and settings.RAPIDPRO_TOKEN
-            and settings.RAPIDPRO_TBCONNECT_FLOW
-        ):
-            rapidpro = TembaClient(settings.RAPIDPRO_URL, settings.RAPIDPRO_TOKEN)
-
-            # using data__contains to hit the GIN index - userprofile__data__gin_idx
-            for contact in HealthCheckUserProfile.objects.filter(
-                data__contains={"synced_to_tb_rapidpro": False}
-            ).iterator():
-                check = (
-                    TBCheck.objects.filter(msisdn=contact.msisdn)
-                    .order_by("-completed_timestamp")
-                    .first()
+# Errors that mean that none of the flow starts will work for now, eg. RapidPro
+# being down, so the sync stops, and is retried later
+SYNC_RETRY_ERRORS = (
+    TembaConnectionError,
+    TembaHttpError,
+    TembaRateExceededError,
+    RateLimitExceeded,
+)
+# A bad token won't fix itself, so the sync stops without being retried
+SYNC_ABORT_ERRORS = SYNC_RETRY_ERRORS + (TembaTokenError,)
+# Errors for a single contact, eg. an invalid URN, that don't stop the sync
+CONTACT_ERRORS = (TembaBadRequestError, TembaNoSuchObjectError)
+
+
+@shared_task(autoretry_for=SYNC_RETRY_ERRORS, max_retries=5, retry_backoff=True)
+@singleton_task("perform_sync_to_rapidpro")
+def perform_sync_to_rapidpro(chunk_size=500):
+    """
+    Drains the RapidProSyncQueue in chunks. This is started for each new TB Check,
+    and runs periodically to pick up anything that was missed.
+    """
+    if (
+        settings.RAPIDPRO_URL
+        and settings.RAPIDPRO_TOKEN
+        and settings.RAPIDPRO_TBCONNECT_FLOW
+    ):
+        rapidpro = get_rapidpro_client()
+        # Contacts whose flow couldn't be started stay in the queue for the next
+        # run, so each chunk starts after the last one
+        cursor = None
+        failed = 0
+
+        while True:
+            check_lease()
+            # Contacts that RapidPro rejected are queued again in the future, so
+            # that they don't hold up the head of the queue
+            queued = RapidProSyncQueue.objects.filter(
+                queued_at__lte=timezone.now()
+            ).order_by("queued_at", "msisdn")
+            if cursor:
+                queued = queued.filter(
+                    Q(queued_at__gt=cursor[1])
+                    | Q(queued_at=cursor[1], msisdn__gt=cursor[0])
                 )
+            queued = list(queued.values_list("msisdn", "queued_at")[:chunk_size])
+            if not queued:
+                break
+            msisdns = [msisdn for msisdn, _ in queued]
+            cursor = queued[-1]
+            contacts = HealthCheckUserProfile.objects.in_bulk(msisdns)
+            checks = get_latest_tbchecks(msisdns)
 
-                force_ussd_followup = False
-
-                if check:
-                    # Force prefered channel for shared device activations.
-                    if check.activation and check.activation.endswith("_agent"):
-                        force_ussd_followup = True
-
-                    urn = f"tel:{contact.msisdn}"
-                    if check.source == "WhatsApp" and not force_ussd_followup:
-                        urn = f"whatsapp:{contact.msisdn.lstrip('+')}"
-
-                    tbconnect_group_arm_timestamp = None
-                    if contact.tbconnect_group_arm_timestamp:
-                        tbconnect_group_arm_timestamp = (
-                            contact.tbconnect_group_arm_timestamp.strftime(
-                                "%Y-%m-%dT%H:%M:%SZ"
-                            )
-                        )
-                    rapidpro.create_flow_start(
-                        urns=[urn],
-                        flow=settings.RAPIDPRO_TBCONNECT_FLOW,
-                        extra={
-                            "risk": check.risk,
-                            "source": check.source,
-                            "follow_up_optin": contact.data.get(
-                                "follow_up_optin", check.follow_up_optin
-                            ),
-                            "completed_timestamp": check.completed_timestamp.strftime(
-                                "%d/%m/%Y"
-                            ),
-                            "exposure": check.exposure,
-                            "language": contact.language,
-                            "activation": check.activation,
-                            "tbconnect_group_arm": contact.tbconnect_group_arm,
-                            "tbconnect_group_arm_timestamp": tbconnect_group_arm_timestamp,
-                            "commit_get_tested": check.commit_get_tested,
-                            "research_consent": check.research_consent,
-                        },
-                    )
-
-                    contact.data["synced_to_tb_rapidpro"] = True
-                    contact.save()
+            # There's nothing to start for profiles without a TB Check
+            synced = [m for m in msisdns if m not in contacts or m not in checks]
+            starts = [(contacts[m], checks[m]) for m in msisdns if m not in synced]
+            rejected = []
+            retry_at = timezone.now() + timedelta(
+                seconds=settings.RAPIDPRO_SYNC_REJECTED_DELAY
+            )
+            try:
+                for msisdn, error in start_tbconnect_flows(rapidpro, starts):
+                    if error:
+                        rejected.append(msisdn)
+                    else:
+                        synced.append(msisdn)
+            finally:
+                # Profiles that were queued again while they were being synced, eg.
+                # for a new TB Check, stay in the queue to be synced again
+                RapidProSyncQueue.objects.filter(
+                    msisdn__in=synced, queued_at__lte=cursor[1]
+                ).delete()
+                RapidProSyncQueue.objects.filter(
+                    msisdn__in=rejected, queued_at__lte=cursor[1]
+                ).update(queued_at=retry_at)
+            failed += len(msisdns) - len(synced)
 
+        if failed:
+            return f"Finished syncing contacts to Rapidpro, {failed} failed"
     return "Finished syncing contacts to Rapidpro"
 
 
-@shared_task
-def perform_etl():
-    r = get_redis_connection()
-    if r.get("perform_etl_tb_connect"):
-        return
-
-    models = {
-        "checks": {
-            "model": TBCheck,
-            "field": "timestamp",
-            "fields": {
-                "deduplication_id": "STRING",
-                "msisdn": "STRING",
-                "timestamp": "TIMESTAMP",
-                "source": "STRING",
-                "province": "STRING",
-                "age": "STRING",
-                "gender": "STRING",
-                "location_latitude": "FLOAT",
-                "location_longitude": "FLOAT",
-                "city_latitude": "FLOAT",
-                "city_longitude": "FLOAT",
-                "cough": "BOOLEAN",
-                "fever": "BOOLEAN",
-                "sweat": "BOOLEAN",
-                "weight": "BOOLEAN",
-                "exposure": "STRING",
-                "risk": "STRING",
-                "follow_up_optin": "BOOLEAN",
-                "language": "STRING",
-                "activation": "STRING",
-                "originating_msisdn": "STRING",
-                "commit_get_tested": "STRING",
-                "research_consent": "BOOLEAN",
-                "clinic_to_visit": "STRING",
-                "clinic_visit_day": "STRING",
-            },
-        },
-        "tests": {
-            "model": TBTest,
-            "field": "updated_at",
-            "fields": {
-                "deduplication_id": "STRING",
-                "msisdn": "STRING",
-                "source": "STRING",
-                "result": "STRING",
-                "timestamp": "TIMESTAMP",
-                "updated_at": "TIMESTAMP",
-            },
-        },
-    }
+def start_tbconnect_flows(rapidpro, starts):
+    """
+    Starts the TB Connect flow for each of the (contact, check)s, with up to
+    RAPIDPRO_SYNC_CONCURRENCY requests at a time, and at most the
+    rapidpro_flow_starts rate limit. Yields the msisdn of each contact as its flow
+    is started, or is rejected with one of CONTACT_ERRORS, along with the error,
+    and logs the other failures.
 
-    with r.lock("perform_etl_tb_connect", 1800):
-        utils.sync_models_to_bigquery(
-            settings.TBCONNECT_BQ_KEY_PATH, settings.TBCONNECT_BQ_DATASET, models
+    Stops if a start fails with one of SYNC_ABORT_ERRORS, or after
+    RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES other failures in a row, so that a
+    systemic failure doesn't try every contact in the queue. The starts that were
+    already sent are finished and yielded, and then the error is raised.
+    """
+    rate_limit = get_rate_limit("rapidpro_flow_starts")
+
+    def start(contact, check):
+        if rate_limit:
+            rate_limit.acquire()
+        start_tbconnect_flow(rapidpro, contact, check)
+
+    concurrency = settings.RAPIDPRO_SYNC_CONCURRENCY
+    max_failures = settings.RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    starts = iter(starts)
+    try:
+        # Only submit a flow start when a worker is free, so that none are sent
+        # after the sync stops
+        pending = {
+            executor.submit(start, contact, check): contact.msisdn
+            for contact, check in islice(starts, concurrency)
+        }
+        consecutive_failures = 0
+        abort = None
+        while pending:
+            # Once the sync is stopping, finish the starts that were already sent
+            done, _ = wait(
+                pending, return_when=ALL_COMPLETED if abort else FIRST_COMPLETED
+            )
+            for future in done:
+                msisdn = pending.pop(future)
+                try:
+                    future.result()
+                except CONTACT_ERRORS as e:
+                    logger.warning(f"RapidPro rejected the TB Connect flow: {e}")
+                    yield msisdn, e
+                except SYNC_ABORT_ERRORS as e:
+                    abort = abort or e
+                except Exception as e:
+                    logger.exception("Failed to start the TB Connect flow")
+                    consecutive_failures += 1
+                    if consecutive_failures >= max_failures:
+                        abort = abort or e
+                else:
+                    consecutive_failures = 0
+                    yield msisdn, None
+            if not abort:
+                for contact, check in islice(starts, len(done)):
+                    pending[executor.submit(start, contact, check)] = contact.msisdn
+        if abort:
+            raise abort
+    finally:
+        # Don't start any more flows if the task is stopped, eg. by a time limit
+        executor.shutdown(cancel_futures=True)
+
+
+def get_latest_tbchecks(msisdns):
+    """
+    Returns the latest TB Check for each of the msisdns, in one query
+    """
+    checks = EventIndex.objects.get_latest_events(TBCheck, msisdns)
+    return {check.msisdn: check for check in checks}
+
+
+def start_tbconnect_flow(rapidpro, contact, check):
+    # Force prefered channel for shared device activations.
+    force_ussd_followup = bool(check.activation and check.activation.endswith("_agent"))
+
+    urn = f"tel:{contact.msisdn}"
+    if check.source == "WhatsApp" and not force_ussd_followup:
+        urn = f"whatsapp:{contact.msisdn.lstrip('+')}"
+
+    tbconnect_group_arm_timestamp = None
+    if contact.tbconnect_group_arm_timestamp:
+        tbconnect_group_arm_timestamp = contact.tbconnect_group_arm_timestamp.strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
         )
+    rapidpro.create_flow_start(
+        urns=[urn],
+        flow=settings.RAPIDPRO_TBCONNECT_FLOW,
+        extra={
+            "risk": check.risk,
+            "source": check.source,
+            "follow_up_optin": contact.data.get(
+                "follow_up_optin", check.follow_up_optin
+            ),
+            "completed_timestamp": check.completed_timestamp.strftime("%d/%m/%Y"),
+            "exposure": check.exposure,
+            "language": contact.language,
+            "activation": check.activation,
+            "tbconnect_group_arm": contact.tbconnect_group_arm,
+            "tbconnect_group_arm_timestamp": tbconnect_group_arm_timestamp,
+            "commit_get_tested": check.commit_get_tested,
+            "research_consent": check.research_consent,
+        },
+    )
+
+
+ETL_MODELS = {
+    "checks": {
+        "model": TBCheck,
+        "field": "timestamp",
+        "changelog": True,
+        "fields": TBCheck.export_spec.fields,
+    },
+    "tests": {
+        "model": TBTest,
+        "field": "updated_at",
+        "changelog": True,
+        "fields": TBTest.export_spec.fields,
+    },
+    "profiles": {
+        "model": HealthCheckUserProfile,
+        "field": "updated_at",
+        "changelog": True,
+        "fields": HealthCheckUserProfile.export_spec.fields,
+    },
+}
+
+
+@shared_task
+@singleton_task("perform_etl_tbconnect")
+def perform_etl():
+    sync_models_to_bigquery_in_parallel(
+        settings.TBCONNECT_BQ_KEY_PATH, settings.TBCONNECT_BQ_DATASET, ETL_MODELS
+    )
 
 
 @shared_task
@@ -151,7 +265,9 @@ def send_tbcheck_data_to_cci(data):
         headers = {
             "Content-Type": "application/json",
         }
-        response = requests.post(url=settings.CCI_URL, headers=headers, json=data)
+        response = http.request(
+            "cci", "post", url=settings.CCI_URL, headers=headers, json=data
+        )
 
         if (
             response.status_code == 200
@@ -1,3 +1,5 @@
+from healthcheck.models import EventIndex
+
 from .models import TBCheck, TBTest
 
 
@@ -7,13 +9,16 @@ def run():
 
     for tbtest in tbtests:
         # Get recent tbcheck to update tbtest source
-        tbcheck = (
-            TBCheck.objects.filter(
-                msisdn=tbtest.msisdn, completed_timestamp__lt=tbtest.timestamp
+        tbcheck = EventIndex.objects.get_latest_events(TBCheck, [tbtest.msisdn]).first()
+        # Only look further back if the latest tbcheck is after the test
+        if tbcheck and tbcheck.completed_timestamp >= tbtest.timestamp:
+            tbcheck = (
+                TBCheck.objects.filter(
+                    msisdn=tbtest.msisdn, completed_timestamp__lt=tbtest.timestamp
+                )
+                .order_by("-completed_timestamp")
+                .first()
             )
-            .order_by("-completed_timestamp")
-            .first()
-        )
 
         if tbcheck:
             if tbcheck.source == "USSD" and tbtest.source != "SMS":
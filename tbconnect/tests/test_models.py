@@ -29,6 +29,27 @@ class TBTestTests(TestCase):
 
 
 class TBCheckTests(TestCase):
+    def test_coordinates(self):
+        """
+        Should store the decoded coordinates when saving
+        """
+        check = TBCheck.objects.create(
+            **{
+                "msisdn": "+123",
+                "cough": False,
+                "fever": False,
+                "sweat": False,
+                "weight": False,
+                "tracing": True,
+                "location": "+40.20361+18.12345/",
+            }
+        )
+        check.refresh_from_db()
+        self.assertEqual(check.location_latitude, 40.20361)
+        self.assertEqual(check.location_longitude, 18.12345)
+        self.assertIsNone(check.city_latitude)
+        self.assertIsNone(check.city_longitude)
+
     def test_hashed_msisdn(self):
         check = TBCheck.objects.create(
             **{
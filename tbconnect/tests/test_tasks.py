@@ -1,10 +1,16 @@
 import json
+import threading
+from datetime import timedelta
+from unittest.mock import patch
 
 import responses
 from django.test import TestCase, override_settings
 from django.utils import timezone
+from temba_client.exceptions import TembaTokenError
 
-from tbconnect.models import TBCheck
+from healthcheck.leases import LeaseLost
+from tbconnect.models import RapidProSyncQueue, TBCheck
+from tbconnect import tasks
 from tbconnect.tasks import (
     perform_sync_to_rapidpro,
     send_tbcheck_data_to_cci,
@@ -65,11 +71,14 @@ class SyncToRapidproTests(TestCase):
             }
         )
 
+        if not synced:
+            RapidProSyncQueue.objects.enqueue(msisdn)
+
         return HealthCheckUserProfile.objects.create(
             **{
                 "msisdn": msisdn,
                 "language": "eng",
-                "data": {"follow_up_optin": optin, "synced_to_tb_rapidpro": synced},
+                "data": {"follow_up_optin": optin},
                 "tbconnect_group_arm": tbconnect_group_arm,
             }
         )
@@ -97,7 +106,9 @@ class SyncToRapidproTests(TestCase):
         perform_sync_to_rapidpro()
 
         profile.refresh_from_db()
-        self.assertTrue(profile.data["synced_to_tb_rapidpro"])
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
         [call1, call2] = responses.calls
         body = json.loads(call1.request.body)
@@ -169,7 +180,9 @@ class SyncToRapidproTests(TestCase):
 
         profile.refresh_from_db()
 
-        self.assertTrue(profile.data["synced_to_tb_rapidpro"])
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
         [call] = responses.calls
         body = json.loads(call.request.body)
@@ -218,7 +231,9 @@ class SyncToRapidproTests(TestCase):
 
         profile.refresh_from_db()
 
-        self.assertTrue(profile.data["synced_to_tb_rapidpro"])
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
         [call] = responses.calls
         body = json.loads(call.request.body)
@@ -267,7 +282,9 @@ class SyncToRapidproTests(TestCase):
         perform_sync_to_rapidpro()
 
         profile.refresh_from_db()
-        self.assertTrue(profile.data["synced_to_tb_rapidpro"])
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
         [call] = responses.calls
         body = json.loads(call.request.body)
@@ -303,7 +320,9 @@ class SyncToRapidproTests(TestCase):
 
         profile.refresh_from_db()
 
-        self.assertFalse(profile.data["synced_to_tb_rapidpro"])
+        self.assertTrue(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
     @responses.activate
     @override_settings(
@@ -332,7 +351,9 @@ class SyncToRapidproTests(TestCase):
         perform_sync_to_rapidpro()
 
         profile.refresh_from_db()
-        self.assertTrue(profile.data["synced_to_tb_rapidpro"])
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
         [call1, call2] = responses.calls
         body = json.loads(call1.request.body)
@@ -410,7 +431,9 @@ class SyncToRapidproTests(TestCase):
         perform_sync_to_rapidpro()
 
         profile.refresh_from_db()
-        self.assertTrue(profile.data["synced_to_tb_rapidpro"])
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn=profile.msisdn).exists()
+        )
 
         [call1, call2] = responses.calls
         body = json.loads(call1.request.body)
@@ -460,6 +483,352 @@ class SyncToRapidproTests(TestCase):
             },
         )
 
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+    )
+    def test_sync_in_chunks(self):
+        """
+        Should sync the queued profiles in chunks, with a fixed number of queries for
+        each chunk, using the latest check
+        """
+        for i in range(5):
+            self.create_profile_and_check(f"+2783000000{i}")
+        TBCheck.objects.create(
+            msisdn="+27830000000",
+            cough=False,
+            fever=False,
+            sweat=False,
+            weight=False,
+            tracing=False,
+            exposure=TBCheck.EXPOSURE_NO,
+            source="WhatsApp",
+            risk=TBCheck.RISK_LOW,
+            completed_timestamp=self.completed_timestamp - timedelta(days=1),
+        )
+        responses.add(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            json=self.flow_response,
+        )
+
+        # For each chunk: fetch the queue, profiles and checks, and remove them from
+        # the queue. And a query to find that the queue is empty.
+        with self.assertNumQueries(3 * 4 + 1):
+            perform_sync_to_rapidpro(chunk_size=2)
+
+        self.assertEqual(len(responses.calls), 5)
+        self.assertEqual(
+            json.loads(responses.calls[0].request.body)["extra"]["risk"], "high"
+        )
+        self.assertFalse(RapidProSyncQueue.objects.exists())
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+    )
+    def test_sync_requeued_profile(self):
+        """
+        A profile that is queued again while it's being synced, eg. for a new TB
+        Check, should be synced again
+        """
+        profile = self.create_profile_and_check()
+        responses.add(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            json=self.flow_response,
+        )
+        get_latest_tbchecks = tasks.get_latest_tbchecks
+
+        def requeue_profile(msisdns):
+            if len(responses.calls) == 0:
+                RapidProSyncQueue.objects.enqueue(profile.msisdn)
+            return get_latest_tbchecks(msisdns)
+
+        with patch("tbconnect.tasks.get_latest_tbchecks", side_effect=requeue_profile):
+            perform_sync_to_rapidpro()
+
+        self.assertEqual(len(responses.calls), 2)
+        self.assertFalse(RapidProSyncQueue.objects.exists())
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+    )
+    def test_sync_without_check(self):
+        """
+        Should remove profiles without a TB Check from the queue, without syncing
+        """
+        RapidProSyncQueue.objects.enqueue("+27830000001")
+
+        perform_sync_to_rapidpro()
+
+        self.assertEqual(len(responses.calls), 0)
+        self.assertFalse(RapidProSyncQueue.objects.exists())
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+        RAPIDPRO_SYNC_CONCURRENCY=3,
+    )
+    def test_sync_concurrently(self):
+        """
+        Should send up to RAPIDPRO_SYNC_CONCURRENCY flow starts at a time
+        """
+        for i in range(3):
+            self.create_profile_and_check(f"+2783000000{i}")
+        # Each request waits until all three have been sent
+        barrier = threading.Barrier(3, timeout=5)
+
+        def start_flow(request):
+            barrier.wait()
+            return (201, {}, json.dumps(self.flow_response))
+
+        responses.add_callback(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            callback=start_flow,
+        )
+
+        perform_sync_to_rapidpro()
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertFalse(RapidProSyncQueue.objects.exists())
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+        RAPIDPRO_SYNC_CONCURRENCY=3,
+    )
+    def test_sync_partial_failure(self):
+        """
+        Should only remove the contacts whose flow was started from the queue, and
+        carry on with the rest
+        """
+        for i in range(3):
+            self.create_profile_and_check(f"+2783000000{i}")
+
+        def start_flow(request):
+            if json.loads(request.body)["urns"] == ["whatsapp:27830000001"]:
+                return (400, {}, json.dumps({"urns": ["Invalid URN"]}))
+            return (201, {}, json.dumps(self.flow_response))
+
+        responses.add_callback(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            callback=start_flow,
+        )
+
+        result = perform_sync_to_rapidpro(chunk_size=2)
+
+        self.assertEqual(result, "Finished syncing contacts to Rapidpro, 1 failed")
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(
+            list(RapidProSyncQueue.objects.values_list("msisdn", flat=True)),
+            ["+27830000001"],
+        )
+
+        # The rejected contact is tried again later, not on the next run
+        self.assertGreater(
+            RapidProSyncQueue.objects.get().queued_at,
+            timezone.now() + timedelta(minutes=59),
+        )
+        perform_sync_to_rapidpro()
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+    )
+    @patch("tbconnect.tasks.check_lease")
+    def test_sync_lease_lost(self, mock_check_lease):
+        """
+        Should stop between chunks if the lease was lost, leaving the rest of the
+        queue for the next run
+        """
+        mock_check_lease.side_effect = [None, LeaseLost("perform_sync_to_rapidpro")]
+        for i in range(2):
+            self.create_profile_and_check(f"+2783000000{i}")
+        responses.add(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            json=self.flow_response,
+        )
+
+        self.assertIsNone(perform_sync_to_rapidpro(chunk_size=1))
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(
+            list(RapidProSyncQueue.objects.values_list("msisdn", flat=True)),
+            ["+27830000001"],
+        )
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+        RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES=2,
+    )
+    def test_sync_rejected_contacts(self):
+        """
+        Contacts that RapidPro rejects shouldn't count towards the consecutive
+        failures, so that they can't stop the sync
+        """
+        for i in range(4):
+            self.create_profile_and_check(f"+2783000000{i}")
+
+        def start_flow(request):
+            if json.loads(request.body)["urns"] == ["whatsapp:27830000003"]:
+                return (201, {}, json.dumps(self.flow_response))
+            return (400, {}, json.dumps({"urns": ["Invalid URN"]}))
+
+        responses.add_callback(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            callback=start_flow,
+        )
+
+        result = perform_sync_to_rapidpro()
+
+        self.assertEqual(result, "Finished syncing contacts to Rapidpro, 3 failed")
+        self.assertEqual(len(responses.calls), 4)
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn="+27830000003").exists()
+        )
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+    )
+    def test_sync_token_error(self):
+        """
+        Should stop the sync, and raise the error without retrying, if the token is
+        rejected
+        """
+        for i in range(3):
+            self.create_profile_and_check(f"+2783000000{i}")
+        responses.add(
+            responses.POST, "https://rp-test.com/api/v2/flow_starts.json", status=403
+        )
+
+        with self.assertRaises(TembaTokenError):
+            perform_sync_to_rapidpro()
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(RapidProSyncQueue.objects.count(), 3)
+        self.assertNotIn(TembaTokenError, perform_sync_to_rapidpro.autoretry_for)
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+        RAPIDPRO_SYNC_CONCURRENCY=2,
+    )
+    def test_sync_stopped_with_started_flows(self):
+        """
+        When the sync stops, the flows that were already being started should be
+        finished, and removed from the queue if they were started
+        """
+        for i in range(3):
+            self.create_profile_and_check(f"+2783000000{i}")
+        token_rejected = threading.Event()
+
+        def start_flow(request):
+            if json.loads(request.body)["urns"] == ["whatsapp:27830000000"]:
+                token_rejected.set()
+                return (403, {}, "")
+            # Still in flight when the token is rejected
+            token_rejected.wait(timeout=5)
+            return (201, {}, json.dumps(self.flow_response))
+
+        responses.add_callback(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            callback=start_flow,
+        )
+
+        with self.assertRaises(TembaTokenError):
+            perform_sync_to_rapidpro()
+
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(
+            list(
+                RapidProSyncQueue.objects.order_by("msisdn").values_list(
+                    "msisdn", flat=True
+                )
+            ),
+            ["+27830000000", "+27830000002"],
+        )
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+        RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES=2,
+    )
+    def test_sync_consecutive_failures(self):
+        """
+        Should stop the sync after RAPIDPRO_SYNC_MAX_CONSECUTIVE_FAILURES flow
+        starts fail in a row, and raise the last error
+        """
+        for i in range(6):
+            self.create_profile_and_check(f"+2783000000{i}")
+
+        def start_flow(rapidpro, contact, check):
+            if contact.msisdn != "+27830000000":
+                raise ValueError(contact.msisdn)
+
+        with patch("tbconnect.tasks.start_tbconnect_flow", side_effect=start_flow):
+            with self.assertRaisesMessage(ValueError, "+27830000002"):
+                perform_sync_to_rapidpro()
+
+        self.assertEqual(RapidProSyncQueue.objects.count(), 5)
+        self.assertFalse(
+            RapidProSyncQueue.objects.filter(msisdn="+27830000000").exists()
+        )
+
+    @responses.activate
+    @override_settings(
+        RAPIDPRO_URL="https://rp-test.com",
+        RAPIDPRO_TOKEN="123",
+        RAPIDPRO_TBCONNECT_FLOW="321",
+    )
+    def test_sync_rate_limit(self):
+        """
+        Should wait for the flow start rate limit before each flow start
+        """
+        for i in range(2):
+            self.create_profile_and_check(f"+2783000000{i}")
+        responses.add(
+            responses.POST,
+            "https://rp-test.com/api/v2/flow_starts.json",
+            json=self.flow_response,
+        )
+
+        with patch("tbconnect.tasks.get_rate_limit") as get_rate_limit:
+            perform_sync_to_rapidpro()
+
+        get_rate_limit.assert_called_once_with("rapidpro_flow_starts")
+        self.assertEqual(get_rate_limit.return_value.acquire.call_count, 2)
+        self.assertEqual(len(responses.calls), 2)
+
 
 class SendUserDataToCCITests(TestCase):
     msisdn = "2781234567"
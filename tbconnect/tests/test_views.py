@@ -1,12 +1,17 @@
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from healthcheck import utils
-from tbconnect.models import TBCheck, TBTest
+from healthcheck.models import ChangeLog
+from healthcheck.ratelimit import RateLimitExceeded
+from tbconnect.models import RapidProSyncQueue, TBCheck, TBTest
 from tbconnect.serializers import TBCheckSerializer
 from userprofile.models import HealthCheckUserProfile
 from userprofile.tests.test_views import BaseEventTestCase
@@ -170,6 +175,38 @@ class TBCheckViewSetTests(APITestCase, BaseEventTestCase):
         self.assertEqual(profile.age, TBCheck.AGE_18T40)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    @patch("tbconnect.views.perform_sync_to_rapidpro")
+    def test_queues_rapidpro_sync(self, mock_perform_sync_to_rapidpro):
+        """
+        The profile should be queued to be synced to RapidPro, and the sync started
+        once the TB Check is committed
+        """
+        user = get_user_model().objects.create_user("test")
+        user.user_permissions.add(Permission.objects.get(codename="add_tbcheck"))
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                self.url,
+                {
+                    "msisdn": "+27856454612",
+                    "source": "USSD",
+                    "age": TBCheck.AGE_18T40,
+                    "gender": TBCheck.GENDER_FEMALE,
+                    "cough": True,
+                    "fever": True,
+                    "sweat": False,
+                    "weight": True,
+                    "exposure": "yes",
+                    "tracing": True,
+                    "risk": TBCheck.RISK_LOW,
+                },
+                format="json",
+            )
+        self.assertTrue(
+            RapidProSyncQueue.objects.filter(msisdn="+27856454612").exists()
+        )
+        mock_perform_sync_to_rapidpro.delay.assert_called_once_with()
+
     def test_commit_get_tested_update(self):
         """
         Update user profile commit field
@@ -214,6 +251,15 @@ class TBCheckViewSetTests(APITestCase, BaseEventTestCase):
         tbcheck.refresh_from_db()
 
         self.assertEqual(tbcheck.commit_get_tested, TBCheck.COMMIT_YES)
+        # The update should be logged, so that the ETL exports it
+        self.assertEqual(
+            list(
+                ChangeLog.objects.filter(model="tbconnect.TBCheck").values_list(
+                    "object_id", flat=True
+                )
+            ),
+            [str(tbcheck.id), str(tbcheck.id)],
+        )
 
     def test_tbcheck_include_user_profile(self):
         """
@@ -250,7 +296,11 @@ class TBCheckViewSetTests(APITestCase, BaseEventTestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(profile.get("msisdn"), "27856454612")
         self.assertEqual(
-            response.json().get("profile"),
+            parse_datetime(profile.pop("updated_at")),
+            HealthCheckUserProfile.objects.get().updated_at,
+        )
+        self.assertEqual(
+            profile,
             {
                 "msisdn": "27856454612",
                 "first_name": None,
@@ -266,7 +316,7 @@ class TBCheckViewSetTests(APITestCase, BaseEventTestCase):
                 "rooms_in_household": None,
                 "persons_in_household": None,
                 "language": "eng",
-                "data": {"follow_up_optin": True, "synced_to_tb_rapidpro": False},
+                "data": {"follow_up_optin": True},
                 "tbconnect_group_arm": None,
                 "research_consent": None,
                 "originating_msisdn": None,
@@ -560,6 +610,30 @@ class TBResetViewSetTests(APITestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    @override_settings(
+        ALLOW_TB_RESET_MSISDNS=["+27856454612"],
+    )
+    @patch("healthcheck.http.TembaClient.delete_contact")
+    def test_reset_rate_limited(self, mock_delete_contact):
+        """
+        If rapidpro is rate limited, then the reset should return a 429 without
+        waiting, and keep the profile so that it can be tried again
+        """
+        mock_delete_contact.side_effect = RateLimitExceeded("rapidpro", 5)
+        HealthCheckUserProfile.objects.create(msisdn="+27856454612")
+        user = get_user_model().objects.create_user("test")
+        user.user_permissions.add(Permission.objects.get(codename="add_tbtest"))
+        self.client.force_authenticate(user)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(
+            mock_delete_contact.call_args_list[0].args, ("tel:+27856454612",)
+        )
+        self.assertTrue(
+            HealthCheckUserProfile.objects.filter(msisdn="+27856454612").exists()
+        )
+
 
 class TbCheckCciDataViewSetTest(APITestCase):
     url = reverse("tbcheckccidata-list")
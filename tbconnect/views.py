@@ -1,28 +1,31 @@
 from datetime import datetime
 
 from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
+from rest_framework.exceptions import Throttled
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, UpdateModelMixin
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.renderers import TemplateHTMLRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ViewSet
 from temba_client.exceptions import TembaNoSuchObjectError
-from temba_client.v2 import TembaClient
 
+from healthcheck.http import get_rapidpro_client
+from healthcheck.ratelimit import RateLimitExceeded
 from healthcheck.utils import get_today
-from userprofile.models import HealthCheckUserProfile
+from userprofile.models import HealthCheckUserProfile, ProfileCounter
 from userprofile.serializers import MSISDNSerializer
 
-from .models import TBCheck, TBTest
+from .models import RapidProSyncQueue, TBCheck, TBTest
 from .serializers import (
     TBActivationSerializer,
     TBCheckCciDataSerializer,
     TBCheckSerializer,
     TBTestSerializer,
 )
-from .tasks import send_tbcheck_data_to_cci
+from .tasks import perform_sync_to_rapidpro, send_tbcheck_data_to_cci
 
 
 class TBCheckViewSet(GenericViewSet, CreateModelMixin, UpdateModelMixin):
@@ -30,9 +33,10 @@ class TBCheckViewSet(GenericViewSet, CreateModelMixin, UpdateModelMixin):
     serializer_class = TBCheckSerializer
     permission_classes = (DjangoModelPermissions,)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         """
-        Create or Update the user profile
+        Create or Update the user profile, and queue it to be synced to RapidPro
         """
         instance = serializer.save()
 
@@ -45,6 +49,9 @@ class TBCheckViewSet(GenericViewSet, CreateModelMixin, UpdateModelMixin):
 
         profile.save()
 
+        RapidProSyncQueue.objects.enqueue(profile.msisdn)
+        transaction.on_commit(perform_sync_to_rapidpro.delay)
+
         return instance
 
 
@@ -74,16 +81,21 @@ class TBResetViewSet(ViewSet):
             )
 
         profile = get_object_or_404(HealthCheckUserProfile, pk=pk)
-        profile.delete()
-        TBCheck.objects.filter(msisdn=pk).delete()
 
+        # Delete the contacts first, so that the reset can be tried again if it's
+        # rate limited
+        rapidpro = get_rapidpro_client(max_wait=0)
         urns = [f"tel:{pk}", f"whatsapp:{pk.lstrip('+')}"]
         for urn in urns:
             try:
-                rapidpro = TembaClient(settings.RAPIDPRO_URL, settings.RAPIDPRO_TOKEN)
                 rapidpro.delete_contact(urn)
             except TembaNoSuchObjectError:
                 continue
+            except RateLimitExceeded as e:
+                raise Throttled(wait=e.retry_after)
+
+        profile.delete()
+        TBCheck.objects.filter(msisdn=pk).delete()
         return Response({"status": "OK"})
 
 
@@ -122,7 +134,9 @@ class TBActivationStatusViewSet(generics.GenericAPIView):
             getattr(settings, f"{activation.upper()}_END_DATE"), "%Y-%m-%d"
         ).date()
 
-        count = HealthCheckUserProfile.objects.filter(activation=activation).count()
+        count = ProfileCounter.objects.get_count(
+            ProfileCounter.activation_key(activation)
+        )
 
         active = False
         if count < max_count and get_today() <= end_date:
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("userprofile", "0018_covid19triage_coordinates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="healthcheckuserprofile",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("healthcheck", "0002_eventindex"),
+        ("userprofile", "0019_healthcheckuserprofile_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="covid19triage",
+            options={"get_latest_by": "timestamp"},
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO healthcheck_eventindex (
+                msisdn, model, first_id, first_timestamp, latest_id, latest_timestamp
+            )
+            SELECT
+                msisdn,
+                'userprofile.Covid19Triage',
+                (array_agg(id::text ORDER BY timestamp, id))[1],
+                min(timestamp),
+                (array_agg(id::text ORDER BY timestamp DESC, id DESC))[1],
+                max(timestamp)
+            FROM eventstore_covid19triage
+            GROUP BY msisdn
+            ON CONFLICT (msisdn, model) DO NOTHING
+            """,
+            reverse_sql="DELETE FROM healthcheck_eventindex WHERE model = 'userprofile.Covid19Triage'",
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("userprofile", "0020_covid19triage_eventindex"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProfileCounter",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO userprofile_profilecounter (key, count)
+            SELECT 'activation:' || activation, count(*)
+            FROM eventstore_healthcheckuserprofile
+            WHERE activation <> ''
+            GROUP BY activation
+            UNION ALL
+            SELECT
+                'tb_study_arm:' || activation || ':' || tbconnect_group_arm, count(*)
+            FROM eventstore_healthcheckuserprofile
+            WHERE activation <> '' AND research_consent AND tbconnect_group_arm <> ''
+            GROUP BY activation, tbconnect_group_arm
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -6,16 +6,26 @@ from typing import Text
 import pycountry
 from django.conf import settings
 from django.contrib.postgres.indexes import GinIndex
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django_prometheus.models import ExportModelOperationsMixin
 
+from healthcheck.models import ChangeLogMixin, EventIndex, EventIndexMixin
+from healthcheck.utils import (
+    ExportSpec,
+    extract_lat_long,
+    hash_string,
+    to_isoformat,
+)
 from tbconnect.models import TBCheck
 from userprofile.utils import has_value
 from userprofile.validators import geographic_coordinate, za_phone_number
 
 
-class Covid19Triage(ExportModelOperationsMixin("covid19triage"), models.Model):
+class Covid19Triage(
+    ExportModelOperationsMixin("covid19triage"), EventIndexMixin, models.Model
+):
     AGE_U18 = "<18"
     AGE_18T40 = "18-40"
     AGE_40T65 = "40-65"
@@ -108,6 +118,10 @@ class Covid19Triage(ExportModelOperationsMixin("covid19triage"), models.Model):
         default=None,
         validators=[geographic_coordinate],
     )
+    location_latitude = models.FloatField(null=True, editable=False)
+    location_longitude = models.FloatField(null=True, editable=False)
+    city_latitude = models.FloatField(null=True, editable=False)
+    city_longitude = models.FloatField(null=True, editable=False)
     muscle_pain = models.BooleanField(null=True, blank=True, default=None)
     smell = models.BooleanField(null=True, blank=True, default=None)
     preexisting_condition = models.CharField(
@@ -120,11 +134,102 @@ class Covid19Triage(ExportModelOperationsMixin("covid19triage"), models.Model):
     created_by = models.CharField(max_length=255, blank=True, default="")
     data = models.JSONField(default=dict, blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        self.location_latitude, self.location_longitude = extract_lat_long(
+            self.location
+        )
+        self.city_latitude, self.city_longitude = extract_lat_long(self.city_location)
+        super().save(*args, **kwargs)
+
     class Meta:
         db_table = "eventstore_covid19triage"
+        get_latest_by = "timestamp"
         indexes = [models.Index(fields=["msisdn", "timestamp"])]
 
 
+class ProfileCounterManager(models.Manager):
+    def get_count(self, key):
+        return self.filter(key=key).values_list("count", flat=True).first() or 0
+
+    def add(self, key, amount=1, limit=None):
+        """
+        Adds amount to the counter, if it's below limit. Returns whether it was added.
+        The counter is locked until the end of the transaction.
+        """
+        self.get_or_create(key=key)
+        counters = self.filter(key=key)
+        if limit is not None:
+            counters = counters.filter(count__lt=limit)
+        return counters.update(count=F("count") + amount) > 0
+
+    def update_counts(self, old_keys, new_keys):
+        """
+        Moves a profile from the old_keys counters to the new_keys counters
+        """
+        # In a consistent order, so that concurrent updates can't deadlock
+        for key in sorted(old_keys ^ new_keys):
+            self.add(key, 1 if key in new_keys else -1)
+
+    def recount(self):
+        """
+        Recounts the profiles for every counter, with the same query as the
+        migration that created them, to correct drift from queryset updates and
+        deletes. The counters are locked while the profiles are counted, so that
+        saves that change them wait for the recount. Returns the counters that were
+        corrected, with their old and new counts.
+        """
+        table = HealthCheckUserProfile._meta.db_table
+        corrected = {}
+        with transaction.atomic(), connection.cursor() as cursor:
+            counters = dict(self.select_for_update().values_list("key", "count"))
+            cursor.execute(
+                f"""
+                SELECT 'activation:' || activation, count(*)
+                FROM {table}
+                WHERE activation <> ''
+                GROUP BY activation
+                UNION ALL
+                SELECT
+                    'tb_study_arm:' || activation || ':' || tbconnect_group_arm,
+                    count(*)
+                FROM {table}
+                WHERE activation <> ''
+                    AND research_consent
+                    AND tbconnect_group_arm <> ''
+                GROUP BY activation, tbconnect_group_arm
+                """
+            )
+            counts = dict(cursor.fetchall())
+            for key in sorted(counters.keys() | counts.keys()):
+                count = counts.get(key, 0)
+                if counters.get(key) != count:
+                    self.update_or_create(key=key, defaults={"count": count})
+                    corrected[key] = (counters.get(key, 0), count)
+        return corrected
+
+
+class ProfileCounter(models.Model):
+    """
+    Counts of the profiles, eg. for each activation, that are updated in the same
+    transaction as every save, so that they don't have to be counted for each
+    request. Queryset updates and deletes of profiles don't update them, so the
+    recount_profile_counters task corrects them every night.
+    """
+
+    key = models.CharField(max_length=255, primary_key=True)
+    count = models.IntegerField(default=0)
+
+    objects = ProfileCounterManager()
+
+    @staticmethod
+    def activation_key(activation):
+        return f"activation:{activation}"
+
+    @staticmethod
+    def tb_study_arm_key(activation, arm):
+        return f"tb_study_arm:{activation}:{arm}"
+
+
 class HealthCheckUserProfileManager(models.Manager):
     def get_or_prefill(self, msisdn: Text) -> "HealthCheckUserProfile":
         """
@@ -134,17 +239,22 @@ class HealthCheckUserProfileManager(models.Manager):
         try:
             return self.get(msisdn=msisdn)
         except self.model.DoesNotExist:
+            profile = self.model()
+            # Most new profiles don't have any healthchecks to prefill from
+            if not EventIndex.objects.has_events(Covid19Triage, msisdn):
+                return profile
             healthchecks = Covid19Triage.objects.filter(msisdn=msisdn).order_by(
                 "completed_timestamp"
             )
-            profile = self.model()
             for healthcheck in healthchecks.iterator():
                 profile.update_from_healthcheck(healthcheck)
             return profile
 
 
 class HealthCheckUserProfile(
-    ExportModelOperationsMixin("healthcheck-user-profile"), models.Model
+    ExportModelOperationsMixin("healthcheck-user-profile"),
+    ChangeLogMixin,
+    models.Model,
 ):
     ARM_CONTROL = "control"
     ARM_SOFT_COMMITMENT_PLUS = "soft_commitment_plus"
@@ -197,9 +307,68 @@ class HealthCheckUserProfile(
         max_length=255, validators=[za_phone_number], null=True
     )
     activation = models.CharField(max_length=255, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = HealthCheckUserProfileManager()
 
+    # The ProfileCounters that the profile is counted in
+    _counter_keys = frozenset()
+
+    export_spec = ExportSpec(
+        msisdn=("STRING", hash_string),
+        province="STRING",
+        city="STRING",
+        age="STRING",
+        gender="STRING",
+        preexisting_condition="STRING",
+        rooms_in_household="INTEGER",
+        persons_in_household="INTEGER",
+        language="STRING",
+        tbconnect_group_arm="STRING",
+        tbconnect_group_arm_timestamp=("TIMESTAMP", to_isoformat),
+        research_consent="BOOLEAN",
+        activation="STRING",
+        updated_at=("TIMESTAMP", to_isoformat),
+    )
+
+    def get_processed_data(self):
+        return self.export_spec.process_instance(self)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counter_keys = instance.get_counter_keys()
+        return instance
+
+    def get_counter_keys(self):
+        """
+        Returns the ProfileCounters that the profile should be counted in
+        """
+        keys = set()
+        if self.activation:
+            keys.add(ProfileCounter.activation_key(self.activation))
+            if self.research_consent and self.tbconnect_group_arm:
+                keys.add(
+                    ProfileCounter.tb_study_arm_key(
+                        self.activation, self.tbconnect_group_arm
+                    )
+                )
+        return frozenset(keys)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            counter_keys = self.get_counter_keys()
+            ProfileCounter.objects.update_counts(self._counter_keys, counter_keys)
+            self._counter_keys = counter_keys
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get("using")):
+            deleted = super().delete(*args, **kwargs)
+            ProfileCounter.objects.update_counts(self._counter_keys, frozenset())
+            self._counter_keys = frozenset()
+            return deleted
+
     def update_from_healthcheck(self, healthcheck: Covid19Triage) -> None:
         """
         Updates the profile with the data from the latest healthcheck
@@ -251,21 +420,20 @@ class HealthCheckUserProfile(
                 setattr(self, field, value)
 
         self.data["follow_up_optin"] = tbcheck.follow_up_optin
-        self.data["synced_to_tb_rapidpro"] = False
 
         for k, v in tbcheck.data.items():
             if has_value(v):
                 self.data[k] = v
 
     def _get_tb_study_arms(self):
-        # we can update the setting to 0 to disable this expensive check
+        # we can update the setting to 0 to disable soft commitment plus
         if self.activation == "tb_study_c":
             if settings.SOFT_COMMITMENT_PLUS_LIMIT > 0:
-                soft_commitment_plus_count = HealthCheckUserProfile.objects.filter(
-                    activation="tb_study_c",
-                    research_consent=True,
-                    tbconnect_group_arm="soft_commitment_plus",
-                ).count()
+                soft_commitment_plus_count = ProfileCounter.objects.get_count(
+                    ProfileCounter.tb_study_arm_key(
+                        "tb_study_c", self.ARM_SOFT_COMMITMENT_PLUS
+                    )
+                )
 
                 if soft_commitment_plus_count >= settings.SOFT_COMMITMENT_PLUS_LIMIT:
                     return self.GROUP_ARM_CHOICES[:1]
@@ -274,6 +442,11 @@ class HealthCheckUserProfile(
         return self.GROUP_ARM_CHOICES
 
     def update_tbconnect_group_arm(self):
+        """
+        Assigns the profile to a TB study arm. This should be in the same transaction
+        as saving the profile, so that its place in a limited arm is given back if
+        the save fails.
+        """
         if not self.research_consent:
             return
 
@@ -282,7 +455,18 @@ class HealthCheckUserProfile(
 
         if self.activation in ("tb_study_b", "tb_study_c"):
             arms = self._get_tb_study_arms()
-            self.tbconnect_group_arm = random.choice(arms)[0]
+            arm = random.choice(arms)[0]
+            # Concurrent checks could all see a count below the limit, so take a
+            # place in the arm before assigning it
+            if self.activation == "tb_study_c" and arm == self.ARM_SOFT_COMMITMENT_PLUS:
+                key = ProfileCounter.tb_study_arm_key(self.activation, arm)
+                if ProfileCounter.objects.add(
+                    key, limit=settings.SOFT_COMMITMENT_PLUS_LIMIT
+                ):
+                    self._counter_keys = self._counter_keys | {key}
+                else:
+                    arm = self.ARM_CONTROL
+            self.tbconnect_group_arm = arm
             self.tbconnect_group_arm_timestamp = datetime.now()
 
     class Meta:
@@ -164,6 +164,7 @@ class HealthCheckUserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = HealthCheckUserProfile
         fields = "__all__"
+        read_only_fields = ["updated_at"]
 
     def update(self, instance, validated_data):
         if "data" in validated_data:
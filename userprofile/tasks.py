@@ -0,0 +1,11 @@
+from celery import shared_task
+
+from healthcheck.leases import singleton_task
+from userprofile.models import ProfileCounter
+
+
+@shared_task
+@singleton_task("recount_profile_counters")
+def recount_profile_counters():
+    corrected = ProfileCounter.objects.recount()
+    return f"Corrected {len(corrected)} profile counters"
@@ -1,8 +1,13 @@
+from unittest.mock import patch
+
 import responses
+from django.db import transaction
 from django.test import TestCase, override_settings
 
+from healthcheck.models import ChangeLog
 from tbconnect.models import TBCheck
-from userprofile.models import Covid19Triage, HealthCheckUserProfile
+from userprofile.models import Covid19Triage, HealthCheckUserProfile, ProfileCounter
+from userprofile.tasks import recount_profile_counters
 
 
 class HealthCheckUserProfileTests(TestCase):
@@ -75,7 +80,6 @@ class HealthCheckUserProfileTests(TestCase):
                 "replaceint": 0,
                 "replacebool": False,
                 "existing": "value",
-                "synced_to_tb_rapidpro": False,
                 "follow_up_optin": True,
             },
         )
@@ -93,7 +97,9 @@ class HealthCheckUserProfileTests(TestCase):
         Should return an empty profile if there are matching profiles, and no data to
         prefill with
         """
-        profile = HealthCheckUserProfile.objects.get_or_prefill("+27820001001")
+        # The profile, and the event index for healthchecks
+        with self.assertNumQueries(2):
+            profile = HealthCheckUserProfile.objects.get_or_prefill("+27820001001")
         self.assertEqual(profile.msisdn, "")
 
     def test_get_or_prefill_existing_healthchecks(self):
@@ -301,3 +307,216 @@ class HealthCheckUserProfileTests(TestCase):
         )
 
         self.assertIsNotNone(profile)
+
+    def test_save_logs_change(self):
+        """
+        Each save should be logged, so that the profile is exported by the ETL
+        """
+        profile = HealthCheckUserProfile.objects.create(
+            msisdn="+27820001001", age=Covid19Triage.AGE_18T40
+        )
+        profile.tbconnect_group_arm = HealthCheckUserProfile.ARM_CONTROL
+        profile.save()
+
+        self.assertEqual(
+            list(
+                ChangeLog.objects.filter(
+                    model="userprofile.HealthCheckUserProfile"
+                ).values_list("object_id", flat=True)
+            ),
+            ["+27820001001", "+27820001001"],
+        )
+
+    def test_get_processed_data(self):
+        """
+        Should hash the MSISDN, and leave out the personal details
+        """
+        profile = HealthCheckUserProfile.objects.create(
+            msisdn="+27831231234",
+            first_name="first",
+            age=Covid19Triage.AGE_18T40,
+            tbconnect_group_arm=HealthCheckUserProfile.ARM_CONTROL,
+        )
+
+        data = profile.get_processed_data()
+        self.assertEqual(data["msisdn"], "eIUHAUSFHvvZ2vpXxPJDwMZ2MuMPVpKOJHUeICFyQnE=")
+        self.assertEqual(data["tbconnect_group_arm"], "control")
+        self.assertEqual(data["updated_at"], profile.updated_at.isoformat())
+        self.assertNotIn("first_name", data)
+
+
+class ProfileCounterTests(TestCase):
+    def get_counts(self):
+        return dict(ProfileCounter.objects.values_list("key", "count"))
+
+    def test_save_and_delete(self):
+        """
+        Should move the profile between counters as it's updated, and remove it when
+        it's deleted
+        """
+        HealthCheckUserProfile.objects.create(msisdn="+27820001001")
+        HealthCheckUserProfile.objects.create(
+            msisdn="+27820001002", activation="tb_study_a"
+        )
+        self.assertEqual(self.get_counts(), {"activation:tb_study_a": 1})
+
+        profile = HealthCheckUserProfile.objects.get(msisdn="+27820001002")
+        profile.activation = "tb_study_c"
+        profile.research_consent = True
+        profile.tbconnect_group_arm = HealthCheckUserProfile.ARM_CONTROL
+        profile.save()
+        profile.save()
+        self.assertEqual(
+            self.get_counts(),
+            {
+                "activation:tb_study_a": 0,
+                "activation:tb_study_c": 1,
+                "tb_study_arm:tb_study_c:control": 1,
+            },
+        )
+
+        HealthCheckUserProfile.objects.get(msisdn="+27820001002").delete()
+        self.assertEqual(
+            self.get_counts(),
+            {
+                "activation:tb_study_a": 0,
+                "activation:tb_study_c": 0,
+                "tb_study_arm:tb_study_c:control": 0,
+            },
+        )
+
+    @override_settings(SOFT_COMMITMENT_PLUS_LIMIT=1)
+    @patch("userprofile.models.random.choice", side_effect=lambda arms: arms[-1])
+    def test_soft_commitment_plus_limit(self, mock_choice):
+        """
+        Should take a place in soft commitment plus when it's assigned, so that the
+        limit can't be exceeded, and only count it once when the profile is saved
+        """
+        key = "tb_study_arm:tb_study_c:soft_commitment_plus"
+        profiles = [
+            HealthCheckUserProfile(
+                msisdn=f"+2782000100{i}", research_consent=True, activation="tb_study_c"
+            )
+            for i in range(2)
+        ]
+        # Both see a count below the limit before either is assigned
+        with patch.object(
+            HealthCheckUserProfile,
+            "_get_tb_study_arms",
+            return_value=HealthCheckUserProfile.GROUP_ARM_CHOICES,
+        ):
+            for profile in profiles:
+                with transaction.atomic():
+                    profile.update_tbconnect_group_arm()
+                    profile.save()
+
+        self.assertEqual(
+            [profile.tbconnect_group_arm for profile in profiles],
+            [
+                HealthCheckUserProfile.ARM_SOFT_COMMITMENT_PLUS,
+                HealthCheckUserProfile.ARM_CONTROL,
+            ],
+        )
+        self.assertEqual(ProfileCounter.objects.get_count(key), 1)
+
+    @override_settings(SOFT_COMMITMENT_PLUS_LIMIT=1)
+    @patch("userprofile.models.random.choice", side_effect=lambda arms: arms[-1])
+    def test_soft_commitment_plus_rolled_back(self, mock_choice):
+        """
+        Should give back the place in soft commitment plus if the save fails
+        """
+        profile = HealthCheckUserProfile(
+            msisdn="+27820001001", research_consent=True, activation="tb_study_c"
+        )
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                profile.update_tbconnect_group_arm()
+                raise ValueError()
+
+        self.assertEqual(
+            ProfileCounter.objects.get_count(
+                "tb_study_arm:tb_study_c:soft_commitment_plus"
+            ),
+            0,
+        )
+
+    def test_recount(self):
+        """
+        Should correct the counters that drifted from queryset updates and deletes
+        """
+        for i in range(3):
+            HealthCheckUserProfile.objects.create(
+                msisdn=f"+2782000100{i}", activation="tb_study_a"
+            )
+        HealthCheckUserProfile.objects.filter(msisdn="+27820001000").delete()
+        HealthCheckUserProfile.objects.filter(msisdn="+27820001001").update(
+            activation="tb_study_b"
+        )
+
+        self.assertEqual(
+            ProfileCounter.objects.recount(),
+            {"activation:tb_study_a": (3, 1), "activation:tb_study_b": (0, 1)},
+        )
+        self.assertEqual(
+            self.get_counts(),
+            {"activation:tb_study_a": 1, "activation:tb_study_b": 1},
+        )
+        self.assertEqual(ProfileCounter.objects.recount(), {})
+
+    @override_settings(SOFT_COMMITMENT_PLUS_LIMIT=1)
+    @patch("userprofile.models.random.choice", side_effect=lambda arms: arms[-1])
+    def test_soft_commitment_plus_limit_after_drift(self, mock_choice):
+        """
+        The limit should hold once the counters are recounted, if a profile was
+        assigned to soft commitment plus with a queryset update
+        """
+        HealthCheckUserProfile.objects.create(
+            msisdn="+27820001000", research_consent=True, activation="tb_study_c"
+        )
+        HealthCheckUserProfile.objects.filter(msisdn="+27820001000").update(
+            tbconnect_group_arm=HealthCheckUserProfile.ARM_SOFT_COMMITMENT_PLUS
+        )
+
+        self.assertEqual(recount_profile_counters(), "Corrected 1 profile counters")
+        profile = HealthCheckUserProfile(
+            msisdn="+27820001001", research_consent=True, activation="tb_study_c"
+        )
+        with transaction.atomic():
+            profile.update_tbconnect_group_arm()
+            profile.save()
+
+        self.assertEqual(
+            profile.tbconnect_group_arm, HealthCheckUserProfile.ARM_CONTROL
+        )
+        self.assertEqual(
+            ProfileCounter.objects.get_count(
+                "tb_study_arm:tb_study_c:soft_commitment_plus"
+            ),
+            1,
+        )
+
+
+class Covid19TriageTests(TestCase):
+    def test_coordinates(self):
+        """
+        Should store the decoded coordinates when saving
+        """
+        triage = Covid19Triage.objects.create(
+            msisdn="+27820001001",
+            source="USSD",
+            province="ZA-WC",
+            city="cape town",
+            age=Covid19Triage.AGE_18T40,
+            fever=False,
+            cough=False,
+            sore_throat=False,
+            exposure=Covid19Triage.EXPOSURE_NO,
+            tracing=True,
+            risk=Covid19Triage.RISK_LOW,
+            city_location="-33.9249+018.4241/",
+        )
+        triage.refresh_from_db()
+        self.assertIsNone(triage.location_latitude)
+        self.assertIsNone(triage.location_longitude)
+        self.assertEqual(triage.city_latitude, -33.9249)
+        self.assertEqual(triage.city_longitude, 18.4241)
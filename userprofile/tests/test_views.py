@@ -370,6 +370,72 @@ class Covid19TriageV2ViewSetTests(Covid19TriageViewSetTests):
         self.assertEqual(covid19triage.province, "ZA-WC")
         self.assertEqual(covid19triage.city, "cape town")
 
+    def test_returning_user_first_healthcheck_deleted(self):
+        """
+        If the first entry has been deleted, should use the information from the
+        next one
+        """
+        user = get_user_model().objects.create_user("test")
+        user.user_permissions.add(Permission.objects.get(codename="add_covid19triage"))
+        for province, city in (("ZA-WC", "cape town"), ("ZA-GT", "sandton")):
+            Covid19Triage.objects.create(
+                msisdn="+27820001001",
+                province=province,
+                city=city,
+                fever=False,
+                cough=False,
+                sore_throat=False,
+                tracing=True,
+            )
+        Covid19Triage.objects.filter(city="cape town").delete()
+
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            self.url,
+            {
+                "msisdn": "27820001001",
+                "source": "USSD",
+                "age": Covid19Triage.AGE_18T40,
+                "fever": False,
+                "cough": False,
+                "sore_throat": False,
+                "exposure": Covid19Triage.EXPOSURE_NO,
+                "tracing": True,
+                "risk": Covid19Triage.RISK_LOW,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        covid19triage = Covid19Triage.objects.get(id=response.data["id"])
+        self.assertEqual(covid19triage.city, "sandton")
+
+    def test_returning_user_without_healthchecks(self):
+        """
+        If there isn't a previous entry in the database to get the returning user's
+        information from, should return the missing fields
+        """
+        user = get_user_model().objects.create_user("test")
+        user.user_permissions.add(Permission.objects.get(codename="add_covid19triage"))
+
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            self.url,
+            {
+                "msisdn": "27820001001",
+                "source": "USSD",
+                "age": Covid19Triage.AGE_18T40,
+                "fever": False,
+                "cough": False,
+                "sore_throat": False,
+                "exposure": Covid19Triage.EXPOSURE_NO,
+                "tracing": True,
+                "risk": Covid19Triage.RISK_LOW,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("city", response.data)
+
 
 class Covid19TriageV4ViewSetTests(Covid19TriageViewSetTests):
     url = reverse("covid19triagev4-list")
@@ -558,6 +624,7 @@ class HealthCheckUserProfileViewSetTests(APITestCase, BaseEventTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["msisdn"], "+27820001001")
         self.assertEqual(response.data["first_name"], "testname")
+        self.assertIn("updated_at", response.data)
 
     def test_update_profile(self):
         HealthCheckUserProfile.objects.create(
@@ -568,13 +635,17 @@ class HealthCheckUserProfileViewSetTests(APITestCase, BaseEventTestCase):
             Permission.objects.get(codename="change_healthcheckuserprofile")
         )
         self.client.force_authenticate(user)
-        response = self.client.patch(self.url, {"first_name": "updated"})
+        response = self.client.patch(
+            self.url, {"first_name": "updated", "updated_at": "2020-01-01T00:00:00Z"}
+        )
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         [profile] = HealthCheckUserProfile.objects.all()
         self.assertEqual(profile.data, {"existing": "data"})
         self.assertEqual(profile.first_name, "updated")
+        # updated_at is read only
+        self.assertGreater(profile.updated_at.year, 2020)
 
     def test_update_profile_data(self):
         HealthCheckUserProfile.objects.create(
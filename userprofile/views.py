@@ -13,6 +13,7 @@ from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from healthcheck.models import EventIndex
 from userprofile.models import Covid19Triage, HealthCheckUserProfile
 from userprofile.serializers import (
     Covid19TriageSerializer,
@@ -116,7 +117,9 @@ class Covid19TriageV2ViewSet(Covid19TriageViewSet):
         if all(not request.data.get(f) for f in self.returning_user_skipped_fields):
             # Get those fields from a previous completed HealthCheck
             msisdn = self._get_msisdn(request.data)
-            triage = Covid19Triage.objects.filter(msisdn=msisdn).earliest("timestamp")
+            triage = EventIndex.objects.get_first_events(
+                Covid19Triage, [msisdn]
+            ).first()
             if triage:
                 self._update_data(request.data, triage)
         return super().create(request, *args, **kwargs)
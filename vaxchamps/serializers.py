@@ -1,10 +1,12 @@
 from urllib.parse import urljoin
 
-import requests
 from django.conf import settings
 from phonenumber_field.serializerfields import PhoneNumberField
 from rest_framework import serializers
 
+from healthcheck import http
+from healthcheck.ratelimit import RateLimitExceeded
+
 LANGUAGES = {
     1: "English",
     2: "isiZulu",
@@ -194,15 +196,24 @@ class RegistrationSerializer(serializers.Serializer):
         """
         Check that the number is a WhatsApp contact
         """
-        response = requests.post(
-            url=urljoin(settings.API_DOMAIN, "v1/contacts"),
-            headers={
-                "User-Agent": "healthcheck-django",
-                "Authorization": f"Bearer {settings.TURN_API_KEY}",
-                "Accept": "application/json",
-            },
-            json={"blocking": "wait", "contacts": [value.as_e164]},
-        )
+        # This has its own limit, so that it doesn't wait for the tasks' requests
+        try:
+            response = http.request(
+                "turn_interactive",
+                "post",
+                url=urljoin(settings.API_DOMAIN, "v1/contacts"),
+                headers={
+                    "User-Agent": "healthcheck-django",
+                    "Authorization": f"Bearer {settings.TURN_API_KEY}",
+                    "Accept": "application/json",
+                },
+                json={"blocking": "wait", "contacts": [value.as_e164]},
+                max_wait=0,
+            )
+        except RateLimitExceeded:
+            raise serializers.ValidationError(
+                "unable to check the WhatsApp contact, please try again later"
+            )
         response.raise_for_status()
         for contact in response.json()["contacts"]:
             if contact["status"] != "valid":
@@ -1,7 +1,8 @@
 import json
 
 import responses
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
 
 from vaxchamps.serializers import RegistrationSerializer
 
@@ -66,6 +67,41 @@ class RegistrationSerializerTests(TestCase):
         self.assertFalse(serializer.is_valid())
         self.assertEqual(serializer.errors, {"cell_no": ["not a WhatsApp contact"]})
 
+    @responses.activate
+    @override_settings(RATE_LIMITS={"turn_interactive": "1/m"})
+    def test_rate_limited(self):
+        """
+        Should return a validation error without waiting, if the rate limit for
+        interactive requests is used up
+        """
+        get_redis_connection().delete("ratelimit:turn_interactive")
+        responses.reset()
+        responses.add(
+            responses.POST,
+            "https://whatsapp.turn.io/v1/contacts",
+            json={"contacts": [{"status": "valid"}]},
+        )
+        data = {
+            "name": "test name",
+            "cell_no": "0820001001",
+            "lang": 1,
+            "comms_choice": 1,
+            "popia_consent": 0,
+        }
+        self.assertTrue(RegistrationSerializer(data=data).is_valid())
+
+        serializer = RegistrationSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors,
+            {
+                "cell_no": [
+                    "unable to check the WhatsApp contact, please try again later"
+                ]
+            },
+        )
+        self.assertEqual(len(responses.calls), 1)
+
     @responses.activate
     def test_province_missing_validation(self):
         serializer = RegistrationSerializer(
@@ -1,15 +1,18 @@
 import json
+from unittest.mock import patch
 
 import responses
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from vaxchamps.views import rapidpro_client
+from healthcheck.ratelimit import RateLimitExceeded
 
 
+@override_settings(RAPIDPRO_URL="https://textit.in")
 class RegistrationViewSetTests(APITestCase):
     def setUp(self):
         responses.add(
@@ -17,7 +20,6 @@ class RegistrationViewSetTests(APITestCase):
             "https://whatsapp.turn.io/v1/contacts",
             json={"contacts": [{"status": "valid"}]},
         )
-        rapidpro_client.root_url = "https://textit.in/api/v2"
         responses.add(
             responses.POST,
             "https://textit.in/api/v2/flow_starts.json",
@@ -78,3 +80,23 @@ class RegistrationViewSetTests(APITestCase):
                 "province": "Western Cape",
             },
         )
+
+    @responses.activate
+    @patch("healthcheck.http.TembaClient.create_flow_start")
+    def test_rate_limited(self, mock_create_flow_start):
+        """
+        If rapidpro is rate limited, should return a 429 without waiting
+        """
+        mock_create_flow_start.side_effect = RateLimitExceeded("rapidpro", 5)
+        url = reverse("registrations-list")
+        data = {
+            "name": "test name",
+            "cell_no": "0820001001",
+            "lang": 1,
+            "comms_choice": 1,
+            "email": "test@example.org",
+            "popia_consent": 0,
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "5")
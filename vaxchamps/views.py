@@ -1,10 +1,12 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import status, viewsets
+from rest_framework.exceptions import Throttled
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.response import Response
-from temba_client.v2 import TembaClient
 
+from healthcheck.http import get_rapidpro_client
+from healthcheck.ratelimit import RateLimitExceeded
 from vaxchamps.serializers import (
     AGES,
     DISTRICTS,
@@ -14,8 +16,6 @@ from vaxchamps.serializers import (
     RegistrationSerializer,
 )
 
-rapidpro_client = TembaClient(settings.RAPIDPRO_URL, settings.RAPIDPRO_TOKEN)
-
 
 class CreateRegistrationPermissions(DjangoModelPermissions):
     perms_map = {"POST": ["vaxchamps.create_registration"]}
@@ -39,9 +39,12 @@ class RegistrationViewSet(viewsets.ViewSet):
             data["gender"] = GENDERS[data["gender"]]
         if data.get("age"):
             data["age"] = AGES[data["age"]]
-        rapidpro_client.create_flow_start(
-            settings.VAXCHAMPS_RAPIDPRO_FLOW, urns=[urn], extra=data
-        )
+        try:
+            get_rapidpro_client(max_wait=0).create_flow_start(
+                settings.VAXCHAMPS_RAPIDPRO_FLOW, urns=[urn], extra=data
+            )
+        except RateLimitExceeded as e:
+            raise Throttled(wait=e.retry_after)
 
     def create(self, request):
         serializer = self.serializer_class(data=request.data)